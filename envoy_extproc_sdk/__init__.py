@@ -5,7 +5,9 @@
 # from .health import FilterOutHealthChecks  # noqa: E402
 # tracer.configure(settings={"FILTERS": [FilterOutHealthChecks()]})
 
+from .chain import ChainedExtProcService  # noqa: F401,E402
 from .extproc import BaseExtProcService  # noqa: F401,E402
 from .extproc import StopRequestProcessing  # noqa: F401,E402
+from .options import handler_options  # noqa: F401,E402
 from .server import create_server, serve  # noqa: F401,E402
 from .util.envoy import ext_api  # noqa: F401,E402
@@ -4,8 +4,15 @@ import logging
 from os import environ
 
 from .extproc import BaseExtProcService
+from .instrumentation import INSTRUMENTATIONS
 from .server import serve
-from .settings import GRPC_PORT, SHUTDOWN_GRACE_PERIOD
+from .settings import (
+    GRPC_PORT,
+    INSTRUMENTATION,
+    METRICS_PORT,
+    SHUTDOWN_GRACE_PERIOD,
+    WORKERS,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -63,6 +70,34 @@ def parse_cli_args() -> argparse.Namespace:
         default=SHUTDOWN_GRACE_PERIOD,
         help="Grace period to finish requests on shutdown",
     )
+    parser.add_argument(
+        "-i",
+        "--instrumentation",
+        dest="instrumentation",
+        required=False,
+        type=str,
+        default=INSTRUMENTATION,
+        choices=list(INSTRUMENTATIONS),
+        help="How to trace/time/log processing",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        dest="workers",
+        required=False,
+        type=int,
+        default=WORKERS,
+        help="Number of server processes to run on the port",
+    )
+    parser.add_argument(
+        "-m",
+        "--metrics-port",
+        dest="metrics_port",
+        required=False,
+        type=int,
+        default=METRICS_PORT,
+        help="Port to serve metrics on (0 for none)",
+    )
     parser.add_argument(
         "-l",
         "--logging",
@@ -87,4 +122,11 @@ if __name__ == "__main__":  # pragma: no cover
         logging.basicConfig(level=LOG_LEVEL, format=FORMAT, handlers=[logging.StreamHandler()])
 
     service = import_from_spec(args.service)() if args.service else BaseExtProcService()
-    serve(service, args.port, args.grace_period)
+    serve(
+        service,
+        args.port,
+        args.grace_period,
+        instrumentation=args.instrumentation,
+        workers=args.workers,
+        metrics_port=args.metrics_port,
+    )
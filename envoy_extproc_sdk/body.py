@@ -0,0 +1,115 @@
+from __future__ import annotations
+
+import json
+from typing import Any, Callable, Dict, List, Optional, Union
+from urllib.parse import parse_qs
+
+from .settings import BODY_PARSE_LIMIT, JSON_BACKEND
+from .util.envoy import ext_api
+from .util.lazy import LazyHttpBody
+
+Body = Union[ext_api.HttpBody, LazyHttpBody]
+JsonLoads = Callable[[Union[bytes, memoryview]], Any]
+
+
+def _stdlib_loads(data: Union[bytes, memoryview]) -> Any:
+    return json.loads(bytes(data))
+
+
+def _orjson_loads() -> JsonLoads:
+    from orjson import loads  # optional dependency
+
+    return loads
+
+
+# JSON parsers, by name, built when picked (so optional backends are only
+# imported when asked for); "auto" is orjson when it's installed
+JSON_BACKENDS: Dict[str, Callable[[], JsonLoads]] = {
+    "json": lambda: _stdlib_loads,
+    "orjson": _orjson_loads,
+}
+
+
+def get_json_loads(backend: Union[str, JsonLoads, None] = None) -> JsonLoads:
+    """get a JSON parser from a callable or a name in JSON_BACKENDS (or "auto")"""
+    if backend is None:
+        backend = JSON_BACKEND
+    if callable(backend):
+        return backend
+    if backend.lower() == "auto":
+        try:
+            return _orjson_loads()
+        except ImportError:
+            return _stdlib_loads
+    if backend.lower() in JSON_BACKENDS:
+        return JSON_BACKENDS[backend.lower()]()
+    raise ValueError(f"Unknown JSON backend {backend}, use one of {list(JSON_BACKENDS)} or auto")
+
+
+json_loads = get_json_loads()
+
+
+def set_json_backend(backend: Union[str, JsonLoads]) -> None:
+    """use a different JSON parser for body_json (a name, or a callable
+    taking bytes or a memoryview)"""
+    global json_loads
+    json_loads = get_json_loads(backend)
+
+
+class BodyTooLarge(ValueError):
+    """A body was too large to parse (see BODY_PARSE_LIMIT)"""
+
+
+class BodyCache:
+    """
+    The body message being processed, and what it has been parsed into
+    (by kind: "json", "form", or "text" and an encoding), so each is only
+    parsed once per body message. A chain shares one between its members,
+    so members don't parse a body again unless an earlier member changed
+    it (which makes a new body message).
+    """
+
+    __slots__ = ("body", "_parsed")
+
+    def __init__(self) -> None:
+        self.body: Optional[Body] = None
+        self._parsed: Optional[Dict[Any, Any]] = None
+
+    def set(self, body: Body) -> None:
+        if body is not self.body:
+            self.body = body
+            self._parsed = None
+
+    def parsed(self, kind: Any, parse: Callable[[Union[bytes, memoryview]], Any]) -> Any:
+        """the body parsed with parse, memoized as kind"""
+        if self.body is None:
+            raise ValueError("There is no body to parse outside of body phases")
+        if self._parsed is None:
+            self._parsed = {}
+        elif kind in self._parsed:
+            return self._parsed[kind]
+        data = self.body.body
+        if len(data) > BODY_PARSE_LIMIT:
+            raise BodyTooLarge(
+                f"Won't parse a {len(data)} byte body (BODY_PARSE_LIMIT is {BODY_PARSE_LIMIT})"
+            )
+        value = self._parsed[kind] = parse(data)
+        return value
+
+
+def parse_json(data: Union[bytes, memoryview]) -> Any:
+    return json_loads(data)
+
+
+def parse_form(data: Union[bytes, memoryview]) -> Dict[str, List[str]]:
+    return parse_qs(bytes(data).decode(), keep_blank_values=True)
+
+
+def content_charset(content_type: Optional[str], default: str = "utf-8") -> str:
+    """the charset named in a content-type header value, or default"""
+    if content_type:
+        for param in content_type.split(";")[1:]:
+            name, _, value = param.strip().partition("=")
+            if name.lower() == "charset" and value:
+                return value.strip('"')
+    return default
@@ -0,0 +1,442 @@
+from __future__ import annotations
+
+from asyncio import create_task, FIRST_EXCEPTION, gather, wait
+from logging import getLogger
+from time import perf_counter_ns
+from typing import Collection, List, Optional, Sequence, Union
+
+from grpc import ServicerContext
+
+from .body import BodyCache
+from .context import RequestContext
+from .extproc import BaseExtProcService, PHASE_MODES, StopRequestProcessing
+from .instrumentation import Instrumentation
+from .settings import REVEAL_EXTPROC_CHAIN
+from .util.envoy import EnvoyHeaderMap, EnvoyHeaderValueOption, ext_api
+from .util.headers import HeaderView
+from .util.lazy import LazyHttpBody, LazyResponse
+
+logger = getLogger(__name__)
+
+PhaseData = Union[ext_api.HttpHeaders, ext_api.HttpBody, LazyHttpBody, ext_api.HttpTrailers]
+PhaseResponse = Union[ext_api.CommonResponse, ext_api.HeaderMutation]
+
+
+class ChainContext(RequestContext):
+    """The request context for a chain: its own, plus one for each member
+    (`members`), and the index of the member that stopped processing, if
+    one did (`stopped`). The members share a body cache, so bodies are only
+    parsed once in a chain (unless a member changes them)."""
+
+    __slots__ = ("members", "stopped")
+
+    def __init__(self, members: List[RequestContext]) -> None:
+        super().__init__()
+        self.members = members
+        self.stopped: Optional[int] = None
+        self.body_cache = BodyCache()
+        for member in members:
+            member.body_cache = self.body_cache
+
+
+class ChainedExtProcService(BaseExtProcService):
+    """
+    Runs several processors in one Process stream, as if each were its own
+    ext_proc filter in the envoy filter chain, but without a gRPC stream
+    (and network hop) per processor:
+
+        P = ChainedExtProcService(
+            [TrivialExtProcService(), TimerExtProcService(), DigestExtProcService()]
+        )
+
+    As in an envoy filter chain, request phases run the members in order and
+    response phases in reverse order, and each member sees the headers (or
+    body, or trailers) as mutated by the members that ran before it. Each
+    member keeps its own request context for the stream. Mutations are merged
+    in the order the members run into the one response sent to envoy. If a
+    member raises StopRequestProcessing, no later member runs and its
+    ImmediateResponse is sent.
+
+    Members that declare themselves INDEPENDENT (of each other's mutations)
+    and run next to each other in a phase run concurrently, all seeing the
+    data as it was before any of them ran. Their responses are still merged
+    in chain order, so the result doesn't depend on which finishes first.
+    When one stops processing (or fails), the others are cancelled.
+
+    The chain header (see REVEAL_EXTPROC_CHAIN) lists the members, as the
+    separate filters would have; an ImmediateResponse lists the members up
+    to the one that stopped.
+    """
+
+    def __init__(
+        self,
+        members: Sequence[BaseExtProcService],
+        name: Optional[str] = None,
+        instrumentation: Union[str, Instrumentation, None] = None,
+    ) -> None:
+        if not members:
+            raise ValueError("A chain needs at least one member")
+        self.members = list(members)
+        super().__init__(name=name, instrumentation=instrumentation)
+        # members run their offloaded handlers in the chain's pools, which
+        # the server owns
+        for member in self.members:
+            member.executors = self.executors
+
+    @property
+    def member_names(self) -> str:
+        return ",".join(member.name for member in self.members)
+
+    def instrument(self, instrumentation: Union[str, Instrumentation, None] = None) -> None:
+        """Instrument the chain and, if given an instrumentation, its members"""
+        super().instrument(instrumentation)
+        if instrumentation is not None:
+            for member in self.members:
+                member.instrument(instrumentation)
+
+    def handles(self, phase: str) -> bool:
+        return any(member.handles(phase) for member in self.members)
+
+    def skipped_phases(self, request: ChainContext) -> Collection[str]:
+        """the phases every member that handles them asked to skip"""
+        if not any(context.skipped for context in request.members):
+            return ()
+        return [
+            phase
+            for phase in PHASE_MODES
+            if self.handles(phase)
+            and all(
+                phase in member.skipped_phases(context)
+                for member, context in zip(self.members, request.members)
+                if member.handles(phase)
+            )
+        ]
+
+    def new_context(self) -> ChainContext:
+        return ChainContext([member.new_context() for member in self.members])
+
+    def add_extprocs_chain_header(
+        self,
+        headers: Optional[Union[ext_api.HttpHeaders, HeaderView]],
+        response: Union[ext_api.CommonResponse, ext_api.ImmediateResponse],
+        name: Optional[str] = None,
+    ) -> Union[ext_api.CommonResponse, ext_api.ImmediateResponse]:
+        return super().add_extprocs_chain_header(headers, response, name or self.member_names)
+
+    def stop_response(
+        self, request: ChainContext, err: StopRequestProcessing
+    ) -> Union[ext_api.ImmediateResponse, bytes]:
+        if (request.stopped is None) or not REVEAL_EXTPROC_CHAIN or isinstance(err.response, bytes):
+            return super().stop_response(request, err)
+        # like separate filters, only the members the request reached
+        # (up to the one that stopped) mark the response
+        name = ",".join(member.name for member in self.members[: request.stopped + 1])
+        return self.add_extprocs_chain_header(request.headers, err.response, name)
+
+    def batches(self, phase: str) -> List[List[int]]:
+        """The members (indices) that handle a phase, in the order they run,
+        batched: consecutive independent members share a batch, and run
+        concurrently, and any other member runs by itself"""
+        order = range(len(self.members))
+        if phase.startswith("response"):
+            order = reversed(order)
+        batches: List[List[int]] = []
+        for index in order:
+            member = self.members[index]
+            if phase not in member._dispatch:
+                continue
+            if member.INDEPENDENT and batches and self.members[batches[-1][-1]].INDEPENDENT:
+                batches[-1].append(index)
+            else:
+                batches.append([index])
+        return batches
+
+    async def process_members(
+        self,
+        phase: str,
+        data: PhaseData,
+        context: ServicerContext,
+        request: ChainContext,
+        response: PhaseResponse,
+    ) -> PhaseResponse:
+        """Run a phase through the members, merging their responses into
+        response (in chain order, however the members ran)"""
+
+        for batch in self.batches(phase):
+            if len(batch) == 1:
+                responses = [await self.process_member(batch[0], phase, data, context, request)]
+            else:
+                responses = await self.process_concurrently(batch, phase, data, context, request)
+            for member_response in responses:
+                if member_response is None:
+                    continue
+                merge_response(response, member_response)
+                data = apply_response(data, member_response)
+
+        return response
+
+    async def process_member(
+        self,
+        index: int,
+        phase: str,
+        data: PhaseData,
+        context: ServicerContext,
+        request: ChainContext,
+    ) -> Optional[PhaseResponse]:
+        """Run a phase for one member, with its own context"""
+
+        member = self.members[index]
+        handler = member._dispatch[phase]
+
+        member_request = request.members[index]
+        member_request.phase = phase
+        member_request.sampled = request.sampled
+        if handler.is_headers:
+            member_request.headers = HeaderView(data).activate()
+        if handler.is_body:
+            member_request.next_chunk(data)
+        if handler.extract is not None:
+            member_request.defer(handler.extract, data)
+
+        # members that don't handle the phase don't respond
+        if handler.noop:
+            return None
+
+        # (the chain's metrics include each member's phases)
+        metrics = self.metrics
+        start = perf_counter_ns() if metrics is not None else 0
+        try:
+            response = await member.process_phase(
+                phase, data, context, member_request, handler.new_response(), handler
+            )
+        except StopRequestProcessing as err:
+            if member_request.mutation_builder:
+                member_request.mutation_builder.clear()
+            if member.instrumentation.enabled:
+                member.instrumentation.stopped(member, member_request, err)
+            if metrics is not None:
+                metrics.observe(member.name, phase, perf_counter_ns() - start)
+                metrics.stop(member.name, phase, err)
+            request.stopped = index
+            raise
+        except Exception as err:
+            if metrics is not None:
+                metrics.error(member.name, phase, err)
+            raise
+        if metrics is not None:
+            metrics.observe(member.name, phase, perf_counter_ns() - start)
+
+        # pre-serialized responses are merged like any other (without
+        # the member's pending mutations)
+        if isinstance(response, bytes):
+            if member_request.mutation_builder:
+                member_request.mutation_builder.clear()
+            return unwrap_response(phase, response)
+        # (and responses members left empty, or didn't use, changed nothing)
+        message = response.message if type(response) is LazyResponse else response
+        if not (
+            ((message is not None) and message.ListFields()) or member_request.mutation_builder
+        ):
+            return None
+        if type(response) is LazyResponse:
+            response = response.materialize()
+        if member_request.mutation_builder:
+            member_request.mutation_builder.apply(response)
+        return response
+
+    async def process_concurrently(
+        self,
+        batch: List[int],
+        phase: str,
+        data: PhaseData,
+        context: ServicerContext,
+        request: ChainContext,
+    ) -> List[Optional[PhaseResponse]]:
+        """
+        Run a phase for (independent) members concurrently, all seeing the
+        same data. If any raise (StopRequestProcessing, or an error) the
+        rest are cancelled, and the exception raised is that of the first
+        member in chain order to have raised one.
+        """
+
+        tasks = [
+            create_task(self.process_member(index, phase, data, context, request))
+            for index in batch
+        ]
+        try:
+            await wait(tasks, return_when=FIRST_EXCEPTION)
+        finally:
+            pending = [task for task in tasks if not task.done()]
+            for task in pending:
+                task.cancel()
+            if pending:
+                await gather(*pending, return_exceptions=True)
+
+        for index, task in zip(batch, tasks):
+            if task.cancelled():
+                continue
+            err = task.exception()
+            if err is not None:
+                if isinstance(err, StopRequestProcessing):
+                    request.stopped = index
+                raise err
+
+        return [task.result() for task in tasks]
+
+    async def process_request_headers(
+        self,
+        headers: ext_api.HttpHeaders,
+        context: ServicerContext,
+        request: ChainContext,
+        response: ext_api.CommonResponse,
+    ) -> ext_api.CommonResponse:
+        return await self.process_members("request_headers", headers, context, request, response)
+
+    async def process_request_body(
+        self,
+        body: ext_api.HttpBody,
+        context: ServicerContext,
+        request: ChainContext,
+        response: ext_api.CommonResponse,
+    ) -> ext_api.CommonResponse:
+        return await self.process_members("request_body", body, context, request, response)
+
+    async def process_request_trailers(
+        self,
+        trailers: ext_api.HttpTrailers,
+        context: ServicerContext,
+        request: ChainContext,
+        response: ext_api.HeaderMutation,
+    ) -> ext_api.HeaderMutation:
+        return await self.process_members("request_trailers", trailers, context, request, response)
+
+    async def process_response_headers(
+        self,
+        headers: ext_api.HttpHeaders,
+        context: ServicerContext,
+        request: ChainContext,
+        response: ext_api.CommonResponse,
+    ) -> ext_api.CommonResponse:
+        return await self.process_members("response_headers", headers, context, request, response)
+
+    async def process_response_body(
+        self,
+        body: ext_api.HttpBody,
+        context: ServicerContext,
+        request: ChainContext,
+        response: ext_api.CommonResponse,
+    ) -> ext_api.CommonResponse:
+        return await self.process_members("response_body", body, context, request, response)
+
+    async def process_response_trailers(
+        self,
+        trailers: ext_api.HttpTrailers,
+        context: ServicerContext,
+        request: ChainContext,
+        response: ext_api.HeaderMutation,
+    ) -> ext_api.HeaderMutation:
+        return await self.process_members("response_trailers", trailers, context, request, response)
+
+
+def unwrap_response(phase: str, response: bytes) -> PhaseResponse:
+    """the phase response in a pre-serialized ProcessingResponse"""
+    wrapped = getattr(ext_api.ProcessingResponse.FromString(response), phase)
+    return wrapped.header_mutation if phase.endswith("trailers") else wrapped.response
+
+
+def merge_header_mutation(into: ext_api.HeaderMutation, mutation: ext_api.HeaderMutation) -> None:
+    """
+    Merge a later mutation into an earlier one. Envoy applies a mutation's
+    removals before its sets, so a later removal also drops any earlier
+    sets of that header (and a later set after an earlier removal works
+    as is).
+    """
+    if mutation.remove_headers:
+        removed = set(mutation.remove_headers)
+        kept = [option for option in into.set_headers if option.header.key not in removed]
+        if len(kept) < len(into.set_headers):
+            del into.set_headers[:]
+            into.set_headers.extend(kept)
+        already = set(into.remove_headers)
+        into.remove_headers.extend(name for name in mutation.remove_headers if name not in already)
+    into.set_headers.extend(mutation.set_headers)
+
+
+def merge_response(into: PhaseResponse, response: PhaseResponse) -> None:
+    """Merge a later member's response for a phase into the chain's"""
+    if isinstance(into, ext_api.HeaderMutation):
+        merge_header_mutation(into, response)
+        return
+    if response.status == ext_api.CommonResponse.ResponseStatus.CONTINUE_AND_REPLACE:
+        into.status = response.status
+    if response.HasField("header_mutation"):
+        merge_header_mutation(into.header_mutation, response.header_mutation)
+    if response.HasField("body_mutation"):
+        # later members saw (and so mutated) the already mutated body
+        into.body_mutation.CopyFrom(response.body_mutation)
+    if response.HasField("trailers"):
+        into.trailers.headers.extend(response.trailers.headers)
+    if response.clear_route_cache:
+        into.clear_route_cache = True
+
+
+def _append_action(option: EnvoyHeaderValueOption) -> int:
+    # ext_proc overwrites unless told to append (the deprecated append
+    # field) or given another action
+    if option.HasField("append"):
+        if option.append.value:
+            return EnvoyHeaderValueOption.APPEND_IF_EXISTS_OR_ADD
+        return EnvoyHeaderValueOption.OVERWRITE_IF_EXISTS_OR_ADD
+    if option.append_action != EnvoyHeaderValueOption.APPEND_IF_EXISTS_OR_ADD:
+        return option.append_action
+    return EnvoyHeaderValueOption.OVERWRITE_IF_EXISTS_OR_ADD
+
+
+def apply_header_mutation(headers: EnvoyHeaderMap, mutation: ext_api.HeaderMutation) -> None:
+    """Apply a mutation to a header map (in place), as envoy would"""
+    removed = set(mutation.remove_headers)
+    values = [header for header in headers.headers if header.key not in removed]
+    for option in mutation.set_headers:
+        key = option.header.key
+        action = _append_action(option)
+        exists = any(header.key == key for header in values)
+        if (action == EnvoyHeaderValueOption.ADD_IF_ABSENT) and exists:
+            continue
+        if (action == EnvoyHeaderValueOption.OVERWRITE_IF_EXISTS) and not exists:
+            continue
+        if action != EnvoyHeaderValueOption.APPEND_IF_EXISTS_OR_ADD:
+            values = [header for header in values if header.key != key]
+        values.append(option.header)
+    del headers.headers[:]
+    headers.headers.extend(values)
+
+
+def apply_response(data: PhaseData, response: PhaseResponse) -> PhaseData:
+    """The phase data as the next member should see it: a mutated copy, or
+    data itself if the response doesn't change it (data isn't changed in
+    place, as earlier members may hold on to it)"""
+
+    if isinstance(response, ext_api.HeaderMutation):
+        mutation, body_mutation = response, None
+    else:
+        mutation = response.header_mutation if response.HasField("header_mutation") else None
+        body_mutation = response.body_mutation if response.HasField("body_mutation") else None
+
+    if isinstance(data, (ext_api.HttpBody, LazyHttpBody)):
+        if body_mutation is None:
+            return data
+        mutated = ext_api.HttpBody()
+        if isinstance(data, ext_api.HttpBody):
+            mutated.CopyFrom(data)
+        else:
+            mutated.end_of_stream = data.end_of_stream
+        mutated.body = body_mutation.body if body_mutation.WhichOneof("mutation") == "body" else b""
+        return mutated
+
+    if (mutation is None) or not (mutation.set_headers or mutation.remove_headers):
+        return data
+    mutated = data.__class__()
+    mutated.CopyFrom(data)
+    headers = mutated.headers if isinstance(mutated, ext_api.HttpHeaders) else mutated.trailers
+    apply_header_mutation(headers, mutation)
+    return mutated
@@ -0,0 +1,274 @@
+from __future__ import annotations
+
+from collections.abc import MutableMapping
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    FrozenSet,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+
+from .body import Body, BodyCache, content_charset, parse_form, parse_json
+from .mutation import MutationBuilder
+from .util.headers import HeaderView
+
+# phases handlers can ask envoy to skip for a request (see `skip`)
+SKIPPABLE_PHASES = (
+    "response_headers",
+    "request_body",
+    "response_body",
+    "request_trailers",
+    "response_trailers",
+)
+
+# mapping keys for the SDK-owned fields, kept for backwards compatibility
+# with the plain dict requests used to be, and the slot each is stored in
+SDK_KEYS = {
+    "__overhead_ns": "overhead_ns",
+    "__phase": "phase",
+    "__id": "_id",
+}
+
+
+class BodyChunk:
+    """
+    Where the body message being processed falls in its body. With envoy's
+    STREAMED body modes a body arrives as a series of messages ("chunks");
+    otherwise (BUFFERED) it arrives as a single chunk with end_of_stream set.
+
+    index: the chunk's position in the body (0 for the first)
+    offset: the number of body bytes before this chunk
+    size: the chunk's size in bytes
+    end_of_stream: whether this is the last chunk
+    """
+
+    __slots__ = ("phase", "index", "offset", "size", "end_of_stream")
+
+    def __init__(self, phase: str) -> None:
+        self.phase = phase
+        self.index = 0
+        self.offset = 0
+        self.size = 0
+        self.end_of_stream = False
+
+    def __repr__(self) -> str:
+        return (
+            f"BodyChunk({self.phase}, index={self.index}, offset={self.offset}, "
+            f"size={self.size}, end_of_stream={self.end_of_stream})"
+        )
+
+
+class RequestContext(MutableMapping):
+    """
+    The "local" ("request") context for a single Process stream, passed to
+    every phase handler as `request`.
+
+    Fields the SDK owns live in slots: `overhead_ns` (time spent in
+    handlers), `phase` (the phase being processed), `id` (the request's
+    x-request-id) and `sampled` (whether the stream is traced). They can
+    also be read or written with the legacy keys "__overhead_ns", "__phase",
+    and "__id".
+
+    `headers` is an indexed view (see HeaderView) of the headers from the
+    most recent header phase, built once per phase. In body phases, `chunk`
+    describes the body message being processed (see BodyChunk). `skipped`
+    holds phases handlers asked envoy to skip for the request (see `skip`).
+    `body_json`, `body_text` and `body_form` parse the body being processed
+    once (see BodyCache). `mutations` collects header changes for the
+    phase's response (see MutationBuilder).
+
+    Anything else is user data, and the context behaves like a dict for it.
+    The user dict is only allocated on first write.
+
+    Values extracted from headers (like the "standard" request headers)
+    can be deferred with `defer`, and are only computed on first access to
+    the context. At most one extraction is held pending, so a context never
+    keeps more than one phase's data alive.
+    """
+
+    __slots__ = (
+        "overhead_ns",
+        "phase",
+        "sampled",
+        "headers",
+        "chunk",
+        "skipped",
+        "body_cache",
+        "mutation_builder",
+        "_id",
+        "_data",
+        "_pending",
+    )
+
+    def __init__(self, data: Optional[Dict[str, Any]] = None) -> None:
+        self.overhead_ns = 0
+        self.phase = "unknown"
+        self.sampled: Optional[bool] = None
+        self.headers: Optional[HeaderView] = None
+        self.chunk: Optional[BodyChunk] = None
+        self.skipped: Optional[FrozenSet[str]] = None
+        self.body_cache: Optional[BodyCache] = None
+        self.mutation_builder: Optional[MutationBuilder] = None
+        self._id: Optional[str] = "unknown"
+        self._data: Optional[Dict[str, Any]] = None
+        self._pending: Optional[Tuple[Callable, Any]] = None
+        if data:
+            self.update(data)
+
+    def __repr__(self) -> str:
+        return f"RequestContext({dict(self.items())})"
+
+    @property
+    def id(self) -> Optional[str]:
+        if self._pending is not None:
+            self._materialize()
+        return self._id
+
+    @id.setter
+    def id(self, value: Optional[str]) -> None:
+        self._id = value
+
+    @property
+    def mutations(self) -> MutationBuilder:
+        """Header changes for the current phase's response, coalesced and
+        added to it when the handler returns, as in
+
+            request.mutations.set("x-tenant", tenant).remove("x-internal")
+        """
+        if self.mutation_builder is None:
+            self.mutation_builder = MutationBuilder()
+        return self.mutation_builder
+
+    def skip(self, *phases: str) -> None:
+        """Ask envoy not to send phases for this request, as in
+
+            request.skip("response_body")
+
+        Envoy only takes this from the request headers phase (see
+        MODE_OVERRIDE), so skip from a request headers handler."""
+        for phase in phases:
+            if phase not in SKIPPABLE_PHASES:
+                raise ValueError(f"Can't skip {phase}; skippable are {SKIPPABLE_PHASES}")
+        self.skipped = (self.skipped or frozenset()).union(phases)
+
+    def merge(self, other: RequestContext) -> None:
+        """Take back what a handler could change in a copy of this context
+        (as handlers offloaded to processes get): its data, and the phases
+        it asked to skip"""
+        self.update(other)
+        self.skipped = other.skipped
+
+    def next_chunk(self, body: Body) -> BodyChunk:
+        """Record (in `chunk`) the next message of the current phase's body"""
+        if self.body_cache is None:
+            self.body_cache = BodyCache()
+        self.body_cache.set(body)
+        chunk = self.chunk
+        if (chunk is None) or (chunk.phase != self.phase):
+            chunk = self.chunk = BodyChunk(self.phase)
+        else:
+            chunk.index += 1
+            chunk.offset += chunk.size
+        chunk.size = len(body.body)
+        chunk.end_of_stream = body.end_of_stream
+        return chunk
+
+    # parsed bodies: these parse the body message being processed once,
+    # however often they're called (or, in a chain, by however many members)
+
+    def body_json(self) -> Any:
+        """the body parsed as JSON (see JSON_BACKEND)"""
+        return self._body_cache().parsed("json", parse_json)
+
+    def body_text(self, encoding: Optional[str] = None) -> str:
+        """the body decoded as text, by default in the content-type's charset"""
+        if encoding is None:
+            content_type = self.headers.get("content-type") if self.headers else None
+            encoding = content_charset(content_type)
+        return self._body_cache().parsed(("text", encoding), lambda data: str(data, encoding))
+
+    def body_form(self) -> Dict[str, List[str]]:
+        """the body parsed as a (application/x-www-form-urlencoded) form"""
+        return self._body_cache().parsed("form", parse_form)
+
+    def _body_cache(self) -> BodyCache:
+        if self.body_cache is None:
+            raise ValueError("There is no body to parse outside of body phases")
+        return self.body_cache
+
+    def defer(self, extract: Callable[[Any], Dict[str, Any]], data: Any) -> None:
+        """Update the context with extract(data), but only when (if) the
+        context is next accessed"""
+        if self._pending is not None:
+            self._materialize()
+        self._pending = (extract, data)
+
+    def resolve(self) -> RequestContext:
+        """apply any deferred extraction now"""
+        if self._pending is not None:
+            self._materialize()
+        return self
+
+    def _materialize(self) -> None:
+        extract, data = self._pending
+        self._pending = None
+        for key, value in extract(data).items():
+            self[key] = value
+
+    # MutableMapping interface (get and __contains__ are also defined
+    # directly, as they are the most commonly used)
+
+    def __getitem__(self, key: str) -> Any:
+        if self._pending is not None:
+            self._materialize()
+        attr = SDK_KEYS.get(key)
+        if attr is not None:
+            return getattr(self, attr)
+        if self._data is None:
+            raise KeyError(key)
+        return self._data[key]
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        if self._pending is not None:
+            self._materialize()
+        attr = SDK_KEYS.get(key)
+        if attr is not None:
+            setattr(self, attr, value)
+        elif self._data is None:
+            self._data = {key: value}
+        else:
+            self._data[key] = value
+
+    def __delitem__(self, key: str) -> None:
+        if self._pending is not None:
+            self._materialize()
+        if (key in SDK_KEYS) or (self._data is None):
+            raise KeyError(key)
+        del self._data[key]
+
+    def __iter__(self) -> Iterator[str]:
+        if self._pending is not None:
+            self._materialize()
+        yield from SDK_KEYS
+        if self._data is not None:
+            yield from self._data
+
+    def __len__(self) -> int:
+        if self._pending is not None:
+            self._materialize()
+        return len(SDK_KEYS) + (len(self._data) if self._data is not None else 0)
+
+    def __contains__(self, key: object) -> bool:
+        if self._pending is not None:
+            self._materialize()
+        return (key in SDK_KEYS) or ((self._data is not None) and (key in self._data))
+
+    def get(self, key: str, default: Any = None) -> Any:
+        try:
+            return self[key]
+        except KeyError:
+            return default
@@ -0,0 +1,50 @@
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from logging import getLogger
+from typing import Optional
+
+from .settings import OFFLOAD_PROCESSES, OFFLOAD_THREADS
+
+logger = getLogger(__name__)
+
+
+class Executors:
+    """
+    The pools offloaded handlers run in (see HandlerOptions). Pools are
+    created on first use, so a server that doesn't offload doesn't start
+    any threads or processes. The server owns these, and shuts them down
+    when it stops.
+    """
+
+    def __init__(
+        self,
+        threads: Optional[int] = OFFLOAD_THREADS,
+        processes: Optional[int] = OFFLOAD_PROCESSES,
+    ) -> None:
+        self.threads = threads
+        self.processes = processes
+        self._thread_pool: Optional[ThreadPoolExecutor] = None
+        self._process_pool: Optional[ProcessPoolExecutor] = None
+
+    def __repr__(self) -> str:
+        return f"Executors(threads={self.threads}, processes={self.processes})"
+
+    def get(self, offload: str) -> Executor:
+        """the pool for an offload policy ("thread" or "process")"""
+        if offload == "thread":
+            if self._thread_pool is None:
+                self._thread_pool = ThreadPoolExecutor(
+                    max_workers=self.threads, thread_name_prefix="extproc"
+                )
+            return self._thread_pool
+        if offload == "process":
+            if self._process_pool is None:
+                self._process_pool = ProcessPoolExecutor(max_workers=self.processes)
+            return self._process_pool
+        raise ValueError(f"No executor for {offload}")
+
+    def shutdown(self, wait: bool = True) -> None:
+        for pool in (self._thread_pool, self._process_pool):
+            if pool is not None:
+                logger.info(f"Shutting down {pool.__class__.__name__}")
+                pool.shutdown(wait=wait)
+        self._thread_pool, self._process_pool = None, None
@@ -1,17 +1,46 @@
 from __future__ import annotations
 
-from asyncio import CancelledError, iscoroutinefunction
+from asyncio import CancelledError, get_running_loop, iscoroutinefunction
+from asyncio import TimeoutError as DeadlineExceeded
+from asyncio import wait_for
+from collections import Counter
+from contextlib import ExitStack
+from contextvars import copy_context
 from enum import Enum
+from functools import partial
 from logging import getLogger
-from typing import Callable, Dict, Iterator, List, Optional, Tuple, Union
+from time import perf_counter_ns
+from typing import (
+    Any,
+    Callable,
+    Collection,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
 
-from ddtrace import tracer  # noqa: F401
 from grpc import ServicerContext, StatusCode
 
+from .context import RequestContext, SKIPPABLE_PHASES
+from .executors import Executors
+from .instrumentation import get_instrumentation, Instrumentation
+from .limits import AdmissionController, Bulkhead
+from .metrics import Metrics
+from .mutation import constant_header_option, omit_empty_mutation
+from .options import DEADLINE_FALLBACKS, HandlerOptions
+from .scheduler import PHASE_PRIORITIES, PhaseScheduler
 from .settings import (
+    DEADLINE_FALLBACK,
     ENVOY_SERVICE_NAME,
     EXTPROCS_APPLIED_HEADER,
+    HANDLER_DEADLINE,
+    LAZY_RESPONSES,
+    MODE_OVERRIDE,
     REVEAL_EXTPROC_CHAIN,
+    SCHEDULER_CONCURRENCY,
 )
 from .util.envoy import (
     EnvoyExtProcServicer,
@@ -19,9 +48,11 @@ from .util.envoy import (
     EnvoyHeaderValueOption,
     EnvoyHttpStatus,
     EnvoyHttpStatusCode,
+    EnvoyProcessingMode,
     ext_api,
 )
-from .util.timer import Timer
+from .util.headers import HeaderExtractor, HeaderSpec, HeaderView
+from .util.lazy import LazyResponse
 
 logger = getLogger(__name__)
 
@@ -38,6 +69,193 @@ class ExtProcPhase(str, Enum):
     response_trailers = "response_trailers"
 
 
+def _trailers_response(mutation: ext_api.HeaderMutation) -> ext_api.TrailersResponse:
+    # (empty mutations are left out of responses)
+    if mutation.set_headers or mutation.remove_headers:
+        return ext_api.TrailersResponse(header_mutation=mutation)
+    return ext_api.TrailersResponse()
+
+
+# How to wrap a handler's response for each phase in the ProcessingResponse
+# envoy expects. Written out (instead of built from the phase name) so the
+# per-message path does no string work.
+PHASE_RESPONSE_WRAPPERS: Dict[str, Callable] = {
+    "request_headers": lambda r: ext_api.ProcessingResponse(
+        request_headers=ext_api.HeadersResponse(response=r)
+    ),
+    "response_headers": lambda r: ext_api.ProcessingResponse(
+        response_headers=ext_api.HeadersResponse(response=r)
+    ),
+    "request_body": lambda r: ext_api.ProcessingResponse(
+        request_body=ext_api.BodyResponse(response=r)
+    ),
+    "response_body": lambda r: ext_api.ProcessingResponse(
+        response_body=ext_api.BodyResponse(response=r)
+    ),
+    "request_trailers": lambda r: ext_api.ProcessingResponse(
+        request_trailers=_trailers_response(r)
+    ),
+    "response_trailers": lambda r: ext_api.ProcessingResponse(
+        response_trailers=_trailers_response(r)
+    ),
+}
+
+
+# Handlers for the messages of a body as they arrive (see BodyChunk), named
+# by the body phase they handle. These take the place of a process_..._body
+# handler when defined.
+CHUNK_PHASES = {
+    "request_body_chunk": "request_body",
+    "response_body_chunk": "response_body",
+}
+
+
+# The ProcessingMode field for each phase envoy can be asked to skip (in a
+# mode_override; the request headers are always sent), and the value that
+# skips it.
+PHASE_MODES = {
+    "response_headers": ("response_header_mode", EnvoyProcessingMode.SKIP),
+    "request_body": ("request_body_mode", EnvoyProcessingMode.NONE),
+    "response_body": ("response_body_mode", EnvoyProcessingMode.NONE),
+    "request_trailers": ("request_trailer_mode", EnvoyProcessingMode.SKIP),
+    "response_trailers": ("response_trailer_mode", EnvoyProcessingMode.SKIP),
+}
+
+
+def phase_skipped(mode: EnvoyProcessingMode, phase: str) -> bool:
+    """whether a ProcessingMode skips a phase (trailers are skipped by default)"""
+    field, skip = PHASE_MODES[phase]
+    value = getattr(mode, field)
+    return (value == skip) or (phase.endswith("trailers") and value == EnvoyProcessingMode.DEFAULT)
+
+
+class PhaseHandler:
+    """Dispatch table entry for a single phase: the handler to call
+    and everything about the phase that would otherwise be recomputed
+    for every message (response types, tracing names, and so on)."""
+
+    __slots__ = (
+        "phase",
+        "action",
+        "is_async",
+        "is_headers",
+        "is_body",
+        "extract",
+        "noop",
+        "options",
+        "offload",
+        "offload_threshold",
+        "deadline",
+        "on_deadline",
+        "priority",
+        "bulkhead",
+        "response_type",
+        "new_response",
+        "wrap",
+        "reveal_chain",
+        "overrides_mode",
+        "continue_response",
+        "continue_serialized",
+        "unchanged_response",
+        "unchanged_serialized",
+        "span_name",
+        "resource",
+    )
+
+    def __init__(
+        self,
+        phase: str,
+        action: ExtProcHandler,
+        extract: Optional[Callable[[ext_api.HttpHeaders], Dict]] = None,
+        options: Optional[HandlerOptions] = None,
+        noop: bool = False,
+    ) -> None:
+        self.phase = phase
+        self.action = action
+        self.is_async = iscoroutinefunction(action)
+        self.is_headers = phase.endswith("headers")
+        self.is_body = phase.endswith("body")
+        self.extract = extract  # what to pull from the phase data into the context
+        self.noop = noop  # whether the handler is the base (do nothing) handler
+        self.options = options or HandlerOptions.of(action) or HandlerOptions()
+        self.offload = None if self.options.offload == "inline" else self.options.offload
+        self.offload_threshold = self.options.offload_threshold
+        if self.offload and self.is_async:
+            raise ValueError(f"Can't offload {action} for {phase}; only sync handlers offload")
+        deadline = self.options.deadline
+        self.deadline = (HANDLER_DEADLINE if deadline is None else deadline) or None
+        self.on_deadline = self.options.on_deadline or DEADLINE_FALLBACK
+        if self.on_deadline not in DEADLINE_FALLBACKS:
+            raise ValueError(
+                f"on_deadline must be one of {DEADLINE_FALLBACKS}, not {self.on_deadline}"
+            )
+        priority = self.options.priority
+        self.priority = PHASE_PRIORITIES[phase] if priority is None else priority
+        # the handler's own concurrency pool, if it has one
+        self.bulkhead = (
+            None
+            if self.options.max_concurrency is None
+            else Bulkhead(
+                self.options.max_concurrency,
+                max_queue=self.options.max_queue,
+                overflow=self.options.overflow,
+            )
+        )
+        self.response_type = (
+            ext_api.HeaderMutation if phase.endswith("trailers") else ext_api.CommonResponse
+        )
+        # handlers get the response message or, with LAZY_RESPONSES, a stand
+        # in for it built if it's used (see LazyResponse)
+        self.new_response = (
+            partial(LazyResponse, self.response_type) if LAZY_RESPONSES else self.response_type
+        )
+        self.wrap = PHASE_RESPONSE_WRAPPERS[phase]
+        # NOTE: this only applies if we process response_headers...
+        # that's an envoy configuration. To always capture this we
+        # could assert that the response headers ProcessingMode is
+        # always SEND
+        self.reveal_chain = REVEAL_EXTPROC_CHAIN and (phase == "response_headers")
+        # envoy only takes a mode_override in response to the request headers
+        self.overrides_mode = MODE_OVERRIDE and (phase == "request_headers")
+        # the response to a phase a handler changed nothing in is always
+        # "continue", so build it once; shared across streams, it must
+        # never be mutated (and, for servers that send bytes as they are,
+        # serialize it once too)
+        self.unchanged_response = self.wrap(self.response_type())
+        self.unchanged_serialized = self.unchanged_response.SerializeToString()
+        # a base (do nothing) handler's response is always unchanged, so
+        # it's sent without calling the handler
+        skip = noop and not (self.reveal_chain or self.overrides_mode)
+        self.continue_response = self.unchanged_response if skip else None
+        self.continue_serialized = self.unchanged_serialized if skip else None
+        camel_case_phase = "".join([w.title() for w in phase.split("_")])
+        self.span_name = f"process.{phase}"
+        self.resource = f"/{ENVOY_SERVICE_NAME}/Process/{camel_case_phase}"
+
+    def __repr__(self) -> str:
+        return f"PhaseHandler({self.phase}, {self.action})"
+
+    def offloads(self, data: Union[ext_api.HttpHeaders, ext_api.HttpBody]) -> bool:
+        """whether to offload handling data (assuming an offload policy)"""
+        return (not self.is_body) or (len(data.body) > self.offload_threshold)
+
+
+def _call_in_process(
+    action: ExtProcHandler,
+    data: Union[ext_api.HttpHeaders, ext_api.HttpBody, ext_api.HttpTrailers],
+    request: RequestContext,
+    response: Union[ext_api.CommonResponse, ext_api.HeaderMutation],
+) -> Tuple[Union[ext_api.CommonResponse, ext_api.HeaderMutation], RequestContext]:
+    """run a handler in a process pool worker, returning the (copied) context too"""
+    response = action(data, None, request, response)
+    if request.mutation_builder:
+        if isinstance(response, bytes):
+            request.mutation_builder.clear()
+        else:
+            request.mutation_builder.apply(response)
+    return response, request
+
+
 class StopRequestProcessing(Exception):
     """Raise this exception to stop processing the request
     altogether, concluding processing with the `response`
@@ -46,9 +264,12 @@ class StopRequestProcessing(Exception):
     just be a mechanism to stop processing even when the
     request was processed _successfully_. EG, maybe we can
     respond from cache after seeing the request headers and
-    body."""
+    body. A canned response can be given pre-serialized (see
+    `preserialize`), and is then sent as it is."""
 
-    def __init__(self, response: ext_api.ImmediateResponse, reason: Optional[str] = None) -> None:
+    def __init__(
+        self, response: Union[ext_api.ImmediateResponse, bytes], reason: Optional[str] = None
+    ) -> None:
         self.response = response
         self.reason = reason
 
@@ -73,8 +294,82 @@ class BaseExtProcService(EnvoyExtProcServicer):
         "content-length": "content_length",
     }
 
-    def __init__(self, name: Optional[str] = None) -> None:
+    # Headers a processor wants pulled into the request context, by the
+    # field to store them at and optionally a conversion (see HeaderExtractor):
+    #
+    #   REQUEST_HEADERS = {
+    #       "x-tenant-id": "tenant",
+    #       "content-length": ("content_length", int),
+    #   }
+    #
+    # These are merged with the standard headers (and any declared by
+    # parent classes) when a class is created, into one extractor per
+    # header phase.
+    REQUEST_HEADERS: HeaderSpec = {}
+    RESPONSE_HEADERS: HeaderSpec = {}
+
+    # Whether this processor is independent of the mutations other processors
+    # make (and they of its). In a ChainedExtProcService, independent members
+    # that run next to each other in a phase run concurrently.
+    INDEPENDENT: bool = False
+
+    # How envoy is configured to send phases to this processor: the filter's
+    # processing_mode, as in envoy.yaml (envoy's own ProcessingRequests say
+    # how bodies are sent, when it sends that). With MODE_OVERRIDE on, the
+    # response to the request headers asks envoy for this mode less any
+    # phases this processor doesn't handle (or handlers asked to skip for the
+    # request with `request.skip`), saving a round trip for each. Envoy takes
+    # the override as the whole mode, so a PROCESSING_MODE sending phases the
+    # filter doesn't would turn them on.
+    PROCESSING_MODE = EnvoyProcessingMode(
+        request_header_mode=EnvoyProcessingMode.SEND,
+        response_header_mode=EnvoyProcessingMode.SEND,
+        request_body_mode=EnvoyProcessingMode.BUFFERED,
+        response_body_mode=EnvoyProcessingMode.BUFFERED,
+        request_trailer_mode=EnvoyProcessingMode.SKIP,
+        response_trailer_mode=EnvoyProcessingMode.SKIP,
+    )
+
+    request_header_extractor: HeaderExtractor
+    response_header_extractor: HeaderExtractor
+
+    def __init_subclass__(cls, **kwargs) -> None:
+        super().__init_subclass__(**kwargs)
+        cls._compile_header_extractors()
+
+    @classmethod
+    def _compile_header_extractors(cls) -> None:
+        request, response = HeaderExtractor(), HeaderExtractor()
+        for klass in reversed(cls.__mro__):
+            attrs = vars(klass)
+            request = request.merge(attrs.get("STANDARD_REQUEST_HEADERS"))
+            request = request.merge(attrs.get("REQUEST_HEADERS"))
+            response = response.merge(attrs.get("STANDARD_RESPONSE_HEADERS"))
+            response = response.merge(attrs.get("RESPONSE_HEADERS"))
+        cls.request_header_extractor = request
+        cls.response_header_extractor = response
+
+    def __init__(
+        self,
+        name: Optional[str] = None,
+        instrumentation: Union[str, Instrumentation, None] = None,
+        request_headers: Optional[HeaderSpec] = None,
+        response_headers: Optional[HeaderSpec] = None,
+    ) -> None:
         self.name = name or self.__class__.__name__
+        self.executors = Executors()
+        # whether the server sends bytes as they are (see create_server)
+        self.preserialized = False
+        # handlers that ran past their deadlines, by phase
+        self.deadlines_expired: Dict[str, int] = Counter()
+        # server-wide limits, past which work is shed (see create_server)
+        self.admission: Optional[AdmissionController] = None
+        # runs handlers in priority order, if they're to be scheduled
+        self.scheduler = PhaseScheduler() if SCHEDULER_CONCURRENCY else None
+        # latencies and outcomes, if they're measured (see create_server)
+        self.metrics: Optional[Metrics] = None
+        self.instrument(instrumentation)
+        self.declare_headers(request_headers, response_headers)
 
     def __repr__(self) -> str:
         """Get this object's \"name\", either class name or overriden"""
@@ -84,6 +379,41 @@ class BaseExtProcService(EnvoyExtProcServicer):
         """This no-op makes symbol importing and decorating work together"""
         return self
 
+    def __getstate__(self) -> Dict:
+        """Pickle (for handlers offloaded to processes) without runtime state"""
+        state = self.__dict__.copy()
+        runtime = ("_dispatch", "executors", "instrumentation", "admission", "scheduler", "metrics")
+        for key in runtime:
+            state.pop(key, None)
+        return state
+
+    def __setstate__(self, state: Dict) -> None:
+        self.__dict__.update(state)
+        self.executors = Executors()
+        self.admission = None
+        self.scheduler = None
+        self.metrics = None
+        self.instrument("noop")
+        self._build_dispatch()
+
+    def declare_headers(
+        self,
+        request_headers: Optional[HeaderSpec] = None,
+        response_headers: Optional[HeaderSpec] = None,
+    ) -> None:
+        """Declare (more) headers to pull into the request context for
+        this processor, as with REQUEST_HEADERS/RESPONSE_HEADERS"""
+        if request_headers:
+            self.request_header_extractor = self.request_header_extractor.merge(request_headers)
+        if response_headers:
+            self.response_header_extractor = self.response_header_extractor.merge(response_headers)
+        self._build_dispatch()
+
+    def instrument(self, instrumentation: Union[str, Instrumentation, None] = None) -> None:
+        """Choose how streams and phases are traced/timed/logged; either an
+        Instrumentation or one of the names in INSTRUMENTATIONS"""
+        self.instrumentation = get_instrumentation(instrumentation)
+
     async def Process(
         self,
         request_iterator: Iterator[ext_api.ProcessingRequest],
@@ -114,103 +444,295 @@ class BaseExtProcService(EnvoyExtProcServicer):
         headers.
         """
 
-        with tracer.trace(
-            "process",
-            resource=f"/{ENVOY_SERVICE_NAME}/Process",
-            span_type="grpc",
-        ):
+        dispatch = self._dispatch
+        instrumentation = self.instrumentation
+        preserialized = self.preserialized
+        admission = self.admission
+        metrics = self.metrics
+
+        # past the server's limits, streams are shed (see AdmissionController)
+        trace = ExitStack()
+        if admission is not None:
+            if not admission.admit_stream():
+                async for response in self.shed_stream(request_iterator, context):
+                    yield response
+                return
+            trace.callback(admission.release_stream)
+        if metrics is not None:
+            metrics.streams[self.name] += 1
+
+        # holds the stream's span open (if the stream is sampled) and its
+        # admission
+        with trace:
 
             # for each stream invocation, define a new "call" context/"request"
-            request = {"__overhead_ns": 0, "__phase": "unknown", "__id": "unknown"}
+            request = self.new_context()
 
             async for req in self.safe_iterator(request_iterator, context, request):
 
                 phase = req.WhichOneof("request")
-                request["__phase"] = phase
+                request.phase = phase
 
-                # get the request-phase's data
-                data = getattr(req, phase)
-
-                # get the "action" to apply
-                action_name = f"process_{phase}"
-                action = getattr(self, action_name, None)
-
-                if phase == "request_headers":
-                    request.update(self.get_standard_request_headers(data))
-                elif phase == "response_headers":
-                    request.update(self.get_standard_response_headers(data))
-
-                if (action is None) or (not callable(action)):
+                # get the "handler" to apply, which is None for anything
+                # we don't recognize as a phase
+                handler = dispatch.get(phase)
+                if handler is None:
                     msg = f"{self.name} does not implement a callable for {phase}"
                     logger.error(msg)
                     context.abort(StatusCode.UNIMPLEMENTED, msg)
 
+                # get the request-phase's data
+                data = getattr(req, phase)
+
+                # index headers (once, on first lookup) for any header
+                # helpers used in this phase
+                if handler.is_headers:
+                    request.headers = HeaderView(data).activate()
+
+                # sample (once) from the first message in the stream, which
+                # is the request headers unless envoy is configured to skip them
+                if instrumentation.enabled and (request.sampled is None):
+                    request.sampled = instrumentation.sample(req)
+                    if request.sampled:
+                        trace.enter_context(instrumentation.stream(self))
+
+                # keep track of where in the body (streamed) body messages fall
+                if handler.is_body:
+                    request.next_chunk(data)
+
+                # (lazily) pull any "standard" headers into the context
+                if handler.extract is not None:
+                    request.defer(handler.extract, data)
+
+                # phases this processor doesn't handle just continue
+                if handler.continue_response is not None:
+                    if preserialized:
+                        yield handler.continue_serialized
+                    else:
+                        yield handler.continue_response
+                    continue
+
                 # get a response object to pass (convenience)
-                response = (
-                    ext_api.HeaderMutation() 
-                    if phase.endswith("trailers")
-                    else ext_api.CommonResponse()
-                )
+                response = handler.new_response()
 
-                # NOTE: this only applies if we process response_headers...
-                # that's an envoy configuration. To always capture this we
-                # could assert that the response headers ProcessingMode is
-                # always SEND
-                if REVEAL_EXTPROC_CHAIN and (phase == "response_headers"):
+                if handler.reveal_chain:
                     response = self.add_extprocs_chain_header(data, response)
 
                 # actually process the phase, wrapped for timing and tracing
                 try:
-                    response = await self.process_phase(
-                        phase, data, context, request, response, action
-                    )
-                    if phase.endswith("headers"):
-                        yield ext_api.ProcessingResponse(**{
-                            phase: ext_api.HeadersResponse(response=response)
-                        })
-                    elif phase.endswith("body"):
-                        yield ext_api.ProcessingResponse(**{
-                            phase: ext_api.BodyResponse(response=response)
-                        })
-                    else: # endswith("trailers") == True
-                        yield ext_api.ProcessingResponse(**{
-                            phase: ext_api.TrailersResponse(header_mutation=response)
-                        })
+                    if metrics is not None:
+                        start = perf_counter_ns()
+                    if admission is not None:
+                        response = await self.admit_phase(
+                            phase, data, context, request, response, handler
+                        )
+                    elif self.scheduler is not None:
+                        response = await self.schedule_phase(
+                            phase, data, context, request, response, handler
+                        )
+                    else:
+                        response = await self.process_phase(
+                            phase, data, context, request, response, handler
+                        )
+                    if metrics is not None:
+                        metrics.observe(self.name, phase, perf_counter_ns() - start)
+                    # pre-serialized responses are sent as they are (so any
+                    # mutations collected are dropped, not left for the next phase)
+                    if isinstance(response, bytes):
+                        if request.mutation_builder:
+                            request.mutation_builder.clear()
+                        yield self.deserialize(response, preserialized)
+                        continue
+                    # responses handlers left empty (or, with LAZY_RESPONSES,
+                    # didn't use) changed nothing
+                    message = response.message if type(response) is LazyResponse else response
+                    if not (
+                        ((message is not None) and message.ListFields())
+                        or request.mutation_builder
+                        or handler.overrides_mode
+                    ):
+                        if preserialized:
+                            yield handler.unchanged_serialized
+                        else:
+                            yield handler.unchanged_response
+                        continue
+                    if type(response) is LazyResponse:
+                        response = response.materialize()
+                    if request.mutation_builder:
+                        request.mutation_builder.apply(response)
+                    omit_empty_mutation(response)
+                    wrapped = handler.wrap(response)
+                    if handler.overrides_mode:
+                        mode = self.mode_override(req, request)
+                        if mode is not None:
+                            wrapped.mode_override.CopyFrom(mode)
+                    yield wrapped
 
                 except StopRequestProcessing as err:
-                    logger.debug(
-                        "Caught StopRequestProcessing; sending ImmediateResponse",
-                        extra={
-                            "processor": self.name,
-                            "phase": request.get("__phase", "unknown"),
-                            "request": request.get("__id", "unknown"),
-                            "status": err.response.status.code,
-                            "reason": err.reason or "none supplied",
-                        },
+                    if request.mutation_builder:
+                        request.mutation_builder.clear()  # (not for immediate responses)
+                    if instrumentation.enabled:
+                        instrumentation.stopped(self, request, err)
+                    if metrics is not None:
+                        metrics.observe(self.name, phase, perf_counter_ns() - start)
+                        metrics.stop(self.name, phase, err)
+                    response = self.stop_response(request, err)
+                    if isinstance(response, bytes):
+                        yield self.deserialize(response, preserialized)
+                    else:
+                        yield ext_api.ProcessingResponse(immediate_response=response)
+
+                # (errors end the stream)
+                except Exception as err:
+                    if metrics is not None:
+                        metrics.error(self.name, phase, err)
+                    raise
+
+    def stop_response(
+        self, request: RequestContext, err: StopRequestProcessing
+    ) -> Union[ext_api.ImmediateResponse, bytes]:
+        """the ImmediateResponse to send when a handler stops processing"""
+        if REVEAL_EXTPROC_CHAIN and not isinstance(err.response, bytes):
+            return self.add_extprocs_chain_header(request.headers, err.response)
+        return err.response
+
+    async def shed_stream(
+        self,
+        request_iterator: Iterator[ext_api.ProcessingRequest],
+        context: ServicerContext,
+    ) -> Iterator[Union[ext_api.ProcessingResponse, bytes]]:
+        """Answer a stream the server had no room for without processing it
+        (see AdmissionController.on_overload)"""
+        request = self.new_context()
+        if self.instrumentation.enabled:
+            self.instrumentation.shed(self, request, "stream")
+        async for req in self.safe_iterator(request_iterator, context, request):
+            request.phase = req.WhichOneof("request")
+            yield self.overload_response(request.phase)
+            if self.admission.on_overload == "error":
+                return  # (envoy ends the stream)
+
+    async def admit_phase(
+        self,
+        phase: str,
+        data: Union[ext_api.HttpHeaders, ext_api.HttpBody, ext_api.HttpTrailers],
+        context: ServicerContext,
+        request: RequestContext,
+        response: Union[ext_api.CommonResponse, ext_api.HeaderMutation],
+        handler: PhaseHandler,
+    ) -> Optional[
+        Union[
+            ext_api.CommonResponse,
+            ext_api.HeaderMutation,
+            ext_api.ImmediateResponse,
+            bytes,
+        ]
+    ]:
+        """Process a phase if the server has room for it, falling back (see
+        AdmissionController.on_overload) if not"""
+        admission = self.admission
+        if admission.admit_phase(phase):
+            start = perf_counter_ns()
+            try:
+                if self.scheduler is not None:
+                    return await self.schedule_phase(
+                        phase, data, context, request, response, handler
                     )
-                    response = err.response
-                    if REVEAL_EXTPROC_CHAIN:
-                        response = self.add_extprocs_chain_header(data, response)
-                    yield ext_api.ProcessingResponse(immediate_response=response)
+                return await self.process_phase(phase, data, context, request, response, handler)
+            finally:
+                admission.release_phase(phase, perf_counter_ns() - start)
+
+        if self.instrumentation.enabled:
+            self.instrumentation.shed(self, request, "phase")
+        if admission.on_overload == "error":
+            raise StopRequestProcessing(response=self.overloaded_response(), reason="overloaded")
+        return self.fallback_response(data, response, handler)
+
+    async def schedule_phase(
+        self,
+        phase: str,
+        data: Union[ext_api.HttpHeaders, ext_api.HttpBody, ext_api.HttpTrailers],
+        context: ServicerContext,
+        request: RequestContext,
+        response: Union[ext_api.CommonResponse, ext_api.HeaderMutation],
+        handler: PhaseHandler,
+    ) -> Optional[
+        Union[
+            ext_api.CommonResponse,
+            ext_api.HeaderMutation,
+            ext_api.ImmediateResponse,
+            bytes,
+        ]
+    ]:
+        """Process a phase when the scheduler gets to it (see PhaseScheduler),
+        with envoy's connection (the RPC's peer) taking turns with others"""
+        scheduler = self.scheduler
+        connection = None if context is None else context.peer()
+        await scheduler.acquire(phase, handler.priority, connection)
+        try:
+            return await self.process_phase(phase, data, context, request, response, handler)
+        finally:
+            scheduler.release()
+
+    def overloaded_response(self) -> ext_api.ImmediateResponse:
+        """the ImmediateResponse (a 503) for work shed with on_overload "error"""
+        return self.form_immediate_response(
+            EnvoyHttpStatusCode.ServiceUnavailable, {}, f"{self.name} overloaded".encode()
+        )
+
+    def fallback_response(
+        self,
+        data: Union[ext_api.HttpHeaders, ext_api.HttpBody, ext_api.HttpTrailers],
+        response: Union[ext_api.CommonResponse, ext_api.HeaderMutation],
+        handler: PhaseHandler,
+    ) -> Union[ext_api.CommonResponse, ext_api.HeaderMutation]:
+        """The "continue" response for a phase a handler didn't respond to (shed,
+        or past its deadline): a new response (the handler may have changed the
+        one it was given), revealing the chain if the one prepared for it did"""
+        fallback = handler.new_response()
+        if handler.reveal_chain and any(
+            option.header.key == EXTPROCS_APPLIED_HEADER
+            for option in response.header_mutation.set_headers
+        ):
+            fallback = self.add_extprocs_chain_header(data, fallback)
+        return fallback
+
+    def overload_response(self, phase: str) -> Union[ext_api.ProcessingResponse, bytes]:
+        """The response to a message of a shed stream: either "continue" (and,
+        for the request headers, skip the rest) or a 503. These are the same
+        for every shed stream, so are built once."""
+        key = (phase, self.admission.on_overload, self.preserialized)
+        response = self._overload_responses.get(key)
+        if response is not None:
+            return response
+        if self.admission.on_overload == "error":
+            response = ext_api.ProcessingResponse(immediate_response=self.overloaded_response())
+        else:
+            response = PHASE_RESPONSE_WRAPPERS[phase](
+                ext_api.HeaderMutation() if phase.endswith("trailers") else ext_api.CommonResponse()
+            )
+            if MODE_OVERRIDE and (phase == "request_headers"):
+                for field, off in PHASE_MODES.values():
+                    setattr(response.mode_override, field, off)
+        if self.preserialized:
+            response = response.SerializeToString()
+        self._overload_responses[key] = response
+        return response
 
     async def safe_iterator(
         self,
         request_iterator: Iterator[ext_api.ProcessingRequest],
         context: ServicerContext,
-        request: Dict,
+        request: RequestContext,
     ) -> Iterator[ext_api.ProcessingResponse]:
         try:
             async for req in request_iterator:
                 yield req
         except CancelledError:
-            logger.debug(
-                "RPC cancelled by client",
-                extra={
-                    "processor": self.name,
-                    "phase": request.get("__phase", "unknown"),
-                    "request": request.get("__id", "unknown"),
-                },
-            )
+            if self.instrumentation.enabled:
+                self.instrumentation.cancelled(self, request)
+            if self.metrics is not None:
+                self.metrics.cancelled[self.name] += 1
             return
 
     async def process_phase(
@@ -218,54 +740,165 @@ class BaseExtProcService(EnvoyExtProcServicer):
         phase: str,
         data: Union[ext_api.HttpHeaders, ext_api.HttpBody, ext_api.HttpTrailers],
         context: ServicerContext,
-        request: Dict,
+        request: RequestContext,
         response: Union[ext_api.CommonResponse, ext_api.HeaderMutation],
-        action: Callable,
+        handler: PhaseHandler,
     ) -> Optional[
         Union[
             ext_api.CommonResponse,
             ext_api.HeaderMutation,
             ext_api.ImmediateResponse,
+            bytes,
         ]
     ]:
 
-        # actually process the request phase
-        logger.debug(
-            f"{self.name} started {phase}",
-            extra={
-                "processor": self.name,
-                "phase": request.get("__phase", "unknown"),
-                "request": request.get("__id", "unknown"),
-            },
-        )
+        # handlers with deadlines run as tasks that can be cancelled
+        if handler.deadline is not None:
+            return await self.process_phase_by_deadline(
+                phase, data, context, request, response, handler
+            )
 
-        T = Timer().tic()
+        return await self.call_handler(phase, data, context, request, response, handler)
 
-        camel_case_phase = "".join([w.title() for w in phase.split("_")])
-        resource_name = f"/{ENVOY_SERVICE_NAME}/Process/{camel_case_phase}"
-        with tracer.trace(f"process.{phase}", resource=resource_name, span_type="grpc"):
-            if iscoroutinefunction(action):
-                response = await action(data, context, request, response)
-            else:
-                response = action(data, context, request, response)
-
-        T.toc()
-        duration = T.duration().ToNanoseconds()
-        request["__overhead_ns"] += duration
-
-        # how to store the data in the headers for chaining?
-        # write events to kafka? Automatically impose headers?
-
-        logger.debug(
-            f"{self.name} finished {phase}",
-            extra={
-                "processor": self.name,
-                "phase": request.get("__phase", "unknown"),
-                "request": request.get("__id", "unknown"),
-                "duration_ns": duration,
-            },
-        )
+    async def process_phase_by_deadline(
+        self,
+        phase: str,
+        data: Union[ext_api.HttpHeaders, ext_api.HttpBody, ext_api.HttpTrailers],
+        context: ServicerContext,
+        request: RequestContext,
+        response: Union[ext_api.CommonResponse, ext_api.HeaderMutation],
+        handler: PhaseHandler,
+    ) -> Optional[
+        Union[
+            ext_api.CommonResponse,
+            ext_api.HeaderMutation,
+            ext_api.ImmediateResponse,
+            bytes,
+        ]
+    ]:
+        """Process a phase, falling back (see HandlerOptions.on_deadline)
+        if the handler doesn't respond within its deadline"""
+        try:
+            return await wait_for(
+                self.call_handler(phase, data, context, request, response, handler),
+                handler.deadline,
+            )
+        except DeadlineExceeded:
+            pass
+
+        self.deadlines_expired[phase] += 1
+        if self.instrumentation.enabled:
+            self.instrumentation.expired(self, handler, request)
+        if request.mutation_builder:
+            request.mutation_builder.clear()  # (the handler didn't finish)
+
+        if handler.on_deadline == "error":
+            response = self.form_immediate_response(
+                EnvoyHttpStatusCode.GatewayTimeout, {}, f"{self.name} timed out".encode()
+            )
+            raise StopRequestProcessing(response=response, reason=f"{phase} deadline expired")
+        if handler.on_deadline == "skip":
+            request.skip(*SKIPPABLE_PHASES)
+        return self.fallback_response(data, response, handler)
+
+    async def call_handler(
+        self,
+        phase: str,
+        data: Union[ext_api.HttpHeaders, ext_api.HttpBody, ext_api.HttpTrailers],
+        context: ServicerContext,
+        request: RequestContext,
+        response: Union[ext_api.CommonResponse, ext_api.HeaderMutation],
+        handler: PhaseHandler,
+    ) -> Optional[
+        Union[
+            ext_api.CommonResponse,
+            ext_api.HeaderMutation,
+            ext_api.ImmediateResponse,
+            bytes,
+        ]
+    ]:
+        # handlers with their own concurrency pools wait their turn
+        bulkhead = handler.bulkhead
+        if (bulkhead is not None) and not await bulkhead.acquire():
+            return self.bulkhead_overflow(phase, data, request, response, handler)
+
+        try:
+            offload = (handler.offload is not None) and handler.offloads(data)
+
+            # without instrumentation, just call the handler
+            if not self.instrumentation.enabled:
+                if offload:
+                    return await self.offload(handler, data, context, request, response)
+                if handler.is_async:
+                    return await handler.action(data, context, request, response)
+                return handler.action(data, context, request, response)
+
+            # otherwise actually process the request phase, wrapped for
+            # timing and tracing (see Instrumentation.phase)
+            with self.instrumentation.phase(self, handler, request):
+                if offload:
+                    response = await self.offload(handler, data, context, request, response)
+                elif handler.is_async:
+                    response = await handler.action(data, context, request, response)
+                else:
+                    response = handler.action(data, context, request, response)
+
+            return response
+
+        finally:
+            if bulkhead is not None:
+                bulkhead.release()
+
+    def bulkhead_overflow(
+        self,
+        phase: str,
+        data: Union[ext_api.HttpHeaders, ext_api.HttpBody, ext_api.HttpTrailers],
+        request: RequestContext,
+        response: Union[ext_api.CommonResponse, ext_api.HeaderMutation],
+        handler: PhaseHandler,
+    ) -> Union[ext_api.CommonResponse, ext_api.HeaderMutation]:
+        """The response for a phase a handler's bulkhead had no room for (see
+        HandlerOptions.overflow)"""
+        if self.instrumentation.enabled:
+            self.instrumentation.shed(self, request, "handler")
+        if handler.bulkhead.overflow == "error":
+            raise StopRequestProcessing(
+                response=self.overloaded_response(), reason=f"{phase} handler overloaded"
+            )
+        return self.fallback_response(data, response, handler)
+
+    def bulkhead_stats(self) -> Dict[str, Dict[str, Any]]:
+        """each handler's bulkhead's stats (see Bulkhead), by phase"""
+        return {
+            phase: handler.bulkhead.stats()
+            for phase, handler in self._dispatch.items()
+            if handler.bulkhead is not None
+        }
+
+    async def offload(
+        self,
+        handler: PhaseHandler,
+        data: Union[ext_api.HttpHeaders, ext_api.HttpBody, ext_api.HttpTrailers],
+        context: ServicerContext,
+        request: RequestContext,
+        response: Union[ext_api.CommonResponse, ext_api.HeaderMutation],
+    ) -> Union[ext_api.CommonResponse, ext_api.HeaderMutation]:
+        """Run a (sync) handler in the pool its options say to, so it
+        doesn't block other streams on the event loop"""
+
+        loop = get_running_loop()
+        pool = self.executors.get(handler.offload)
+
+        if handler.offload == "thread":
+            call = partial(copy_context().run, handler.action, data, context, request, response)
+            return await loop.run_in_executor(pool, call)
 
+        # a process gets a copy of the context, so copy back what changed
+        request.resolve()
+        response, remote = await loop.run_in_executor(
+            pool, _call_in_process, handler.action, data, request, response
+        )
+        request.merge(remote)
         return response
 
     # decorator-based assignment; use as
@@ -276,14 +909,120 @@ class BaseExtProcService(EnvoyExtProcServicer):
     #   async def some_func(headers, context, request):
     #       ...
     #
+    # Handler options (see HandlerOptions) can be passed too, as in
+    #
+    #   @P.process("request_body", offload="thread")
+    #
+    # and body chunk handlers (see CHUNK_PHASES) are assigned the same way:
+    #
+    #   @P.process("request_body_chunk")
+    #
+
+    def process(self, phase: ExtProcPhase, **options: Any) -> Callable:
+        if phase in CHUNK_PHASES:
+            name, phase = phase, CHUNK_PHASES[phase]
+        else:
+            name = phase = ExtProcPhase(phase).value
 
-    def process(self, phase: ExtProcPhase) -> Callable:
         def wrapper(func: ExtProcHandler) -> ExtProcHandler:
-            setattr(self, f"process_{phase}", func)
-            return getattr(self, f"process_{phase}")
+            if options:
+                func.__extproc_options__ = HandlerOptions(**options)
+            setattr(self, f"process_{name}", func)
+            self._dispatch[phase] = self._phase_handler(phase, self._phase_action(phase))
+            self._mode_overrides = {}
+            return getattr(self, f"process_{name}")
 
         return wrapper
 
+    def _phase_action(self, phase: str) -> Optional[ExtProcHandler]:
+        """the callable that handles a phase (a body's chunk handler, if it
+        has one, or the process_{phase} callable)"""
+        if phase.endswith("body"):
+            action = getattr(self, f"process_{phase}_chunk", None)
+            if (action is not None) and callable(action):
+                return action
+        action = getattr(self, f"process_{phase}", None)
+        return action if callable(action) else None
+
+    def _build_dispatch(self) -> Dict[str, PhaseHandler]:
+        """(Re)build the phase -> PhaseHandler table from whatever
+        process_{phase} callables this object currently has"""
+        dispatch = {}
+        for phase in ExtProcPhase:
+            action = self._phase_action(phase.value)
+            if action is not None:
+                dispatch[phase.value] = self._phase_handler(phase.value, action)
+        self._dispatch = dispatch
+        self._mode_overrides: Dict[Tuple[int, int], Optional[EnvoyProcessingMode]] = {}
+        self._overload_responses: Dict[Tuple[str, str, bool], Any] = {}
+        return dispatch
+
+    def _phase_handler(self, phase: str, action: ExtProcHandler) -> PhaseHandler:
+        noop = getattr(action, "__func__", None) is vars(BaseExtProcService).get(f"process_{phase}")
+        if phase == "request_headers":
+            extract = self.request_header_extractor
+        elif phase == "response_headers":
+            extract = self.response_header_extractor
+        else:
+            extract = None
+        return PhaseHandler(phase, action, extract=extract, noop=noop)
+
+    def handles(self, phase: str) -> bool:
+        """whether this processor does anything in a phase"""
+        handler = self._dispatch.get(phase)
+        return (handler is not None) and not handler.noop
+
+    def skipped_phases(self, request: RequestContext) -> Collection[str]:
+        """the phases handlers asked to skip for a request"""
+        return request.skipped or ()
+
+    def mode_override(
+        self, req: ext_api.ProcessingRequest, request: RequestContext
+    ) -> Optional[EnvoyProcessingMode]:
+        """The ProcessingMode to ask envoy for in response to the request
+        headers (see PROCESSING_MODE), or None to leave it as it is"""
+
+        configured = self.PROCESSING_MODE
+        if req.HasField("protocol_config"):
+            body_modes = (
+                req.protocol_config.request_body_mode,
+                req.protocol_config.response_body_mode,
+            )
+            configured = EnvoyProcessingMode()
+            configured.CopyFrom(self.PROCESSING_MODE)
+            configured.request_body_mode, configured.response_body_mode = body_modes
+        else:
+            body_modes = (configured.request_body_mode, configured.response_body_mode)
+
+        skip = self.skipped_phases(request)
+        if skip:
+            return self._build_mode_override(configured, skip)
+
+        # without per-request skips, the override only depends on the body modes
+        if body_modes not in self._mode_overrides:
+            self._mode_overrides[body_modes] = self._build_mode_override(configured)
+        return self._mode_overrides[body_modes]
+
+    def _build_mode_override(
+        self, configured: EnvoyProcessingMode, skip: Collection[str] = ()
+    ) -> Optional[EnvoyProcessingMode]:
+        mode = EnvoyProcessingMode()
+        mode.CopyFrom(configured)
+        changed = False
+        for phase, (field, off) in PHASE_MODES.items():
+            if phase_skipped(mode, phase):
+                continue
+            # the chain header is added in the response headers phase
+            needed = self.handles(phase) or (REVEAL_EXTPROC_CHAIN and (phase == "response_headers"))
+            if (phase in skip) or not needed:
+                setattr(mode, field, off)
+                changed = True
+        return mode if changed else None
+
+    def new_context(self) -> RequestContext:
+        """the "request" context to use for a new stream"""
+        return RequestContext()
+
     # Phase-specific methods are below. When using subclasses
     # define these to specialize filter behavior. Note these
     # aren't "NotImplemented", but rather no-ops.
@@ -348,10 +1087,7 @@ class BaseExtProcService(EnvoyExtProcServicer):
     @staticmethod
     def just_continue_response() -> ext_api.CommonResponse:
         """generic "move on" response object (can be modified)"""
-        return ext_api.CommonResponse(
-            status=ext_api.CommonResponse.ResponseStatus.CONTINUE,
-            header_mutation=ext_api.HeaderMutation(),
-        )
+        return ext_api.CommonResponse(status=ext_api.CommonResponse.ResponseStatus.CONTINUE)
 
     @staticmethod
     def just_continue_headers() -> ext_api.HeadersResponse:
@@ -366,7 +1102,36 @@ class BaseExtProcService(EnvoyExtProcServicer):
     @staticmethod
     def just_continue_trailers() -> ext_api.TrailersResponse:
         """generic "move on" trailers response object (can be modified)"""
-        return ext_api.TrailersResponse(header_mutation=ext_api.HeaderMutation())
+        return ext_api.TrailersResponse()
+
+    @staticmethod
+    def preserialize(
+        phase: str,
+        response: Union[ext_api.CommonResponse, ext_api.HeaderMutation, ext_api.ImmediateResponse],
+    ) -> bytes:
+        """
+        Serialize a constant response once, for a handler to return (or,
+        for an "immediate_response", raise in a StopRequestProcessing) for
+        every request, as in
+
+            CONTINUE = BaseExtProcService.preserialize(
+                "request_body", BaseExtProcService.just_continue_response()
+            )
+
+        Bytes are sent as they are (see create_server's `generic`), so these
+        are never changed by the SDK: they don't reveal the chain, and
+        can't carry a mode_override.
+        """
+        if phase == "immediate_response":
+            return ext_api.ProcessingResponse(immediate_response=response).SerializeToString()
+        return PHASE_RESPONSE_WRAPPERS[phase](response).SerializeToString()
+
+    @staticmethod
+    def deserialize(
+        response: bytes, preserialized: bool
+    ) -> Union[ext_api.ProcessingResponse, bytes]:
+        """a pre-serialized response, as the server expects it"""
+        return response if preserialized else ext_api.ProcessingResponse.FromString(response)
 
     @staticmethod
     def form_immediate_response(
@@ -406,9 +1171,14 @@ class BaseExtProcService(EnvoyExtProcServicer):
     # pattern, yet be instance methods for convenience when subclassing
 
     @staticmethod
-    def get_header(headers: ext_api.HttpHeaders, name: str, lower_cased: bool = False) -> str:
+    def get_header(
+        headers: Union[ext_api.HttpHeaders, HeaderView], name: str, lower_cased: bool = False
+    ) -> str:
         """get a header value by name (envoy uses lower cased names)"""
         _name = name if lower_cased else name.lower()
+        view = HeaderView.cached(headers)
+        if view is not None:
+            return view.get(_name)
         for header in headers.headers.headers:
             if header.key == _name:
                 return header.value
@@ -416,7 +1186,7 @@ class BaseExtProcService(EnvoyExtProcServicer):
 
     @staticmethod
     def get_headers(
-        headers: ext_api.HttpHeaders,
+        headers: Union[ext_api.HttpHeaders, HeaderView],
         names: Union[Dict[str, str], List[Tuple[str, str]]],
         lower_cased: bool = False,
     ) -> Dict[str, str]:
@@ -429,6 +1199,10 @@ class BaseExtProcService(EnvoyExtProcServicer):
             keys = {k.lower(): v for k, v in names.items()}
             return BaseExtProcService.get_headers(headers, keys, lower_cased=True)
 
+        view = HeaderView.cached(headers)
+        if view is not None:
+            return {name: view.get_last(key) for key, name in names.items()}
+
         results = {name: None for _, name in names.items()}  # initialize to None
         for header in headers.headers.headers:
             if header.key in names:
@@ -494,29 +1268,33 @@ class BaseExtProcService(EnvoyExtProcServicer):
 
     def add_extprocs_chain_header(
         self,
-        headers: ext_api.HttpHeaders,
+        headers: Optional[Union[ext_api.HttpHeaders, HeaderView]],
         response: Union[ext_api.CommonResponse, ext_api.ImmediateResponse],
+        name: Optional[str] = None,
     ) -> Union[ext_api.CommonResponse, ext_api.ImmediateResponse]:
         """
         This function helps provide visibility into the customized filter chain.
         Not a helper, this should stay in the base processor logic.
         """
 
+        name = name or self.name
+
         header: EnvoyHeaderValueOption
-        filters_header = self.get_header(headers, EXTPROCS_APPLIED_HEADER, lower_cased=True)
+        filters_header = (
+            None
+            if headers is None
+            else self.get_header(headers, EXTPROCS_APPLIED_HEADER, lower_cased=True)
+        )
         if filters_header:
             header = EnvoyHeaderValueOption(
                 header=EnvoyHeaderValue(
                     key=EXTPROCS_APPLIED_HEADER,
-                    value=f"{self.name},{filters_header}",
+                    value=f"{name},{filters_header}",
                 )
             )
         else:
-            header = EnvoyHeaderValueOption(
-                header=EnvoyHeaderValue(
-                    key=EXTPROCS_APPLIED_HEADER, value=f"{self.name}"
-                )
-            )
+            # (the same for every request, so built once)
+            header = constant_header_option(EXTPROCS_APPLIED_HEADER, name)
 
         if isinstance(response, ext_api.ImmediateResponse):
             response.headers.set_headers.append(header)
@@ -524,3 +1302,6 @@ class BaseExtProcService(EnvoyExtProcServicer):
             response.header_mutation.set_headers.append(header)
 
         return response
+
+
+BaseExtProcService._compile_header_extractors()
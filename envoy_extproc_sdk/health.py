@@ -1,4 +1,4 @@
-from typing import List, Optional
+from typing import Callable, List, Optional
 
 from ddtrace import Span
 from ddtrace.filters import TraceFilter
@@ -34,7 +34,17 @@ class FilterOutHealthChecks(TraceFilter):
 
 
 class HealthService(HealthServicer):
+    """
+    Reports SERVING, or if given a readiness check (as for the workers
+    of a multi-process server) SERVING only while that check passes.
+    """
+
+    def __init__(self, ready: Optional[Callable[[], bool]] = None) -> None:
+        self.ready = ready
+
     async def Check(
         self, request: HealthCheckRequest, context: ServicerContext
     ) -> HealthCheckResponse:
-        return HealthCheckResponse(status=HealthCheckResponse.ServingStatus.SERVING)
+        if (self.ready is None) or self.ready():
+            return HealthCheckResponse(status=HealthCheckResponse.ServingStatus.SERVING)
+        return HealthCheckResponse(status=HealthCheckResponse.ServingStatus.NOT_SERVING)
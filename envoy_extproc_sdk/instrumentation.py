@@ -0,0 +1,331 @@
+from __future__ import annotations
+
+from contextlib import contextmanager, nullcontext
+from logging import DEBUG, getLogger
+from random import random
+from time import perf_counter_ns
+from typing import (
+    Any,
+    ContextManager,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    TYPE_CHECKING,
+    Union,
+)
+from zlib import crc32
+
+from .settings import (
+    ENVOY_SERVICE_NAME,
+    INSTRUMENTATION,
+    TRACE_SAMPLE_BY_REQUEST_ID,
+    TRACE_SAMPLE_RATE,
+    TRACE_SAMPLING_PRIORITY_HEADER,
+)
+from .util.envoy import ext_api
+from .util.headers import HeaderView
+
+if TYPE_CHECKING:
+    from .context import RequestContext
+
+logger = getLogger(__name__)
+
+
+class Sampler:
+    """
+    Head-based sampling: decides once per Process stream, from its first
+    message, whether that stream is traced. In order of precedence,
+
+    * an upstream sampling priority header (if configured and present)
+      keeps the stream when > 0 and drops it otherwise;
+    * with `by_request_id`, a hash of the x-request-id is compared to
+      the rate, so every processor sees the same decision for a request;
+    * otherwise a random draw is compared to the rate.
+
+    Counts of sampled and dropped streams are kept for verification.
+    """
+
+    def __init__(
+        self,
+        rate: float = TRACE_SAMPLE_RATE,
+        by_request_id: bool = TRACE_SAMPLE_BY_REQUEST_ID,
+        priority_header: Optional[str] = TRACE_SAMPLING_PRIORITY_HEADER,
+    ) -> None:
+        if not (0.0 <= rate <= 1.0):
+            raise ValueError(f"Sample rate must be in [0, 1], not {rate}")
+        self.rate = rate
+        self.by_request_id = by_request_id
+        self.priority_header = priority_header or None
+        self._threshold = int(rate * 0xFFFFFFFF)
+        self.sampled = 0
+        self.dropped = 0
+
+    def __repr__(self) -> str:
+        return f"Sampler({self.rate}, sampled={self.sampled}, dropped={self.dropped})"
+
+    def decide(self, req: ext_api.ProcessingRequest) -> bool:
+        """decide (without counting) whether to trace the stream req starts"""
+
+        request_id, priority = None, None
+        if req.WhichOneof("request") == "request_headers":
+            headers = HeaderView.of(req.request_headers)
+            request_id = headers.get("x-request-id")
+            if self.priority_header:
+                priority = headers.get(self.priority_header)
+
+        if priority is not None:
+            try:
+                return int(priority) > 0
+            except ValueError:
+                pass  # ignore garbage, fall through to the rate
+
+        if self.rate >= 1.0:
+            return True
+        if self.rate <= 0.0:
+            return False
+        if self.by_request_id and request_id:
+            return crc32(request_id.encode()) <= self._threshold
+        return random() < self.rate
+
+    def sample(self, req: ext_api.ProcessingRequest) -> bool:
+        """decide whether to trace the stream req starts, and count it"""
+        if self.decide(req):
+            self.sampled += 1
+            return True
+        self.dropped += 1
+        return False
+
+    def stats(self) -> Dict[str, int]:
+        return {"sampled": self.sampled, "dropped": self.dropped}
+
+
+class Instrumentation:
+    """
+    Observability for ExternalProcessors: what (if anything) to do
+    around each Process stream and each phase handler. This base class
+    times phases (feeding the request's `overhead_ns`) and writes
+    debug logs; subclasses add tracing or recording.
+
+    The service only calls into an instrumentation when `enabled` is
+    True, so a disabled instrumentation costs nothing per message.
+
+    Streams are sampled (see Sampler) from their first message; only
+    sampled streams open stream and phase spans.
+    """
+
+    enabled = True
+
+    def __init__(self, sampler: Optional[Sampler] = None) -> None:
+        self.sampler = sampler or Sampler()
+
+    def sample(self, req: ext_api.ProcessingRequest) -> bool:
+        """whether to trace the stream starting with req"""
+        return self.sampler.sample(req)
+
+    def stream(self, service: Any) -> ContextManager:
+        """context to hold open for a whole Process stream"""
+        return nullcontext()
+
+    def span(self, name: str, resource: str) -> ContextManager:
+        """context to hold open around a single phase handler"""
+        return nullcontext()
+
+    @contextmanager
+    def phase(self, service: Any, handler: Any, request: RequestContext) -> Iterator[None]:
+        """time, log, and trace a phase handler"""
+
+        debug = logger.isEnabledFor(DEBUG)
+        if debug:
+            logger.debug(
+                f"{service.name} started {handler.phase}",
+                extra={
+                    "processor": service.name,
+                    "phase": request.phase,
+                    "request": request.id,
+                },
+            )
+
+        start = perf_counter_ns()
+        if request.sampled is not False:
+            with self.span(handler.span_name, handler.resource):
+                yield
+        else:
+            yield
+        duration = perf_counter_ns() - start
+        request.overhead_ns += duration
+        self.record(service, handler.phase, request, duration)
+
+        if debug:
+            logger.debug(
+                f"{service.name} finished {handler.phase}",
+                extra={
+                    "processor": service.name,
+                    "phase": request.phase,
+                    "request": request.id,
+                    "duration_ns": duration,
+                },
+            )
+
+    def record(self, service: Any, phase: str, request: RequestContext, duration_ns: int) -> None:
+        """hook for a completed phase; a no-op here"""
+        pass
+
+    def stopped(self, service: Any, request: RequestContext, err: Exception) -> None:
+        """a handler raised StopRequestProcessing"""
+        # (pre-serialized responses aren't parsed just to log their status)
+        response = err.response
+        status = None if isinstance(response, bytes) else response.status.code
+        logger.debug(
+            "Caught StopRequestProcessing; sending ImmediateResponse",
+            extra={
+                "processor": service.name,
+                "phase": request.phase,
+                "request": request.id,
+                "status": status,
+                "reason": err.reason or "none supplied",
+            },
+        )
+
+    def expired(self, service: Any, handler: Any, request: RequestContext) -> None:
+        """a handler ran past its deadline (and was cancelled)"""
+        logger.warning(
+            f"{service.name} {handler.phase} handler ran past its {handler.deadline}s deadline",
+            extra={
+                "processor": service.name,
+                "phase": request.phase,
+                "request": request.id,
+                "deadline": handler.deadline,
+                "fallback": handler.on_deadline,
+            },
+        )
+
+    def shed(self, service: Any, request: RequestContext, what: str) -> None:
+        """a "stream" or "phase" was shed for lack of room (see AdmissionController),
+        or a "handler" had no room for a phase (see Bulkhead)"""
+        logger.debug(
+            f"{service.name} shed a {what}",
+            extra={
+                "processor": service.name,
+                "phase": request.phase,
+                "request": request.id,
+                "shed": what,
+            },
+        )
+
+    def cancelled(self, service: Any, request: RequestContext) -> None:
+        """the client (envoy) cancelled the stream"""
+        logger.debug(
+            "RPC cancelled by client",
+            extra={
+                "processor": service.name,
+                "phase": request.phase,
+                "request": request.id,
+            },
+        )
+
+
+class NoopInstrumentation(Instrumentation):
+    """No spans, no timers, no logs: handlers are called directly"""
+
+    enabled = False
+
+
+class DatadogInstrumentation(Instrumentation):
+    """Traces streams and phases with ddtrace (the original behavior)"""
+
+    def __init__(self, sampler: Optional[Sampler] = None, tracer: Optional[Any] = None) -> None:
+        super().__init__(sampler=sampler)
+        if tracer is None:
+            from ddtrace import tracer
+        self.tracer = tracer
+
+    def stream(self, service: Any) -> ContextManager:
+        return self.tracer.trace(
+            "process",
+            resource=f"/{ENVOY_SERVICE_NAME}/Process",
+            span_type="grpc",
+        )
+
+    def span(self, name: str, resource: str) -> ContextManager:
+        return self.tracer.trace(name, resource=resource, span_type="grpc")
+
+
+class RecordedPhase:
+    """A phase as seen by InMemoryInstrumentation"""
+
+    __slots__ = ("processor", "phase", "request", "duration_ns")
+
+    def __init__(self, processor: str, phase: str, request: str, duration_ns: int) -> None:
+        self.processor = processor
+        self.phase = phase
+        self.request = request
+        self.duration_ns = duration_ns
+
+    def __repr__(self) -> str:
+        return f"{self.processor}:{self.phase}:{self.request} ({self.duration_ns}ns)"
+
+
+class InMemoryInstrumentation(Instrumentation):
+    """Keeps what it sees in lists; mostly useful for tests"""
+
+    def __init__(self, sampler: Optional[Sampler] = None) -> None:
+        super().__init__(sampler=sampler)
+        self.streams = 0
+        self.phases: List[RecordedPhase] = []
+        self.stops: List[RecordedPhase] = []
+        self.expirations: List[RecordedPhase] = []
+        self.sheds: List[RecordedPhase] = []
+        self.cancellations: List[RecordedPhase] = []
+
+    def stream(self, service: Any) -> ContextManager:
+        self.streams += 1
+        return nullcontext()
+
+    def record(self, service: Any, phase: str, request: RequestContext, duration_ns: int) -> None:
+        self.phases.append(RecordedPhase(service.name, phase, request.id, duration_ns))
+
+    def stopped(self, service: Any, request: RequestContext, err: Exception) -> None:
+        super().stopped(service, request, err)
+        self.stops.append(RecordedPhase(service.name, request.phase, request.id, 0))
+
+    def expired(self, service: Any, handler: Any, request: RequestContext) -> None:
+        super().expired(service, handler, request)
+        self.expirations.append(RecordedPhase(service.name, handler.phase, request.id, 0))
+
+    def shed(self, service: Any, request: RequestContext, what: str) -> None:
+        super().shed(service, request, what)
+        self.sheds.append(RecordedPhase(service.name, request.phase, request.id, 0))
+
+    def cancelled(self, service: Any, request: RequestContext) -> None:
+        super().cancelled(service, request)
+        self.cancellations.append(RecordedPhase(service.name, request.phase, request.id, 0))
+
+    def clear(self) -> None:
+        self.streams = 0
+        self.phases.clear()
+        self.stops.clear()
+        self.expirations.clear()
+        self.sheds.clear()
+        self.cancellations.clear()
+
+
+INSTRUMENTATIONS = {
+    "ddtrace": DatadogInstrumentation,
+    "datadog": DatadogInstrumentation,
+    "logging": Instrumentation,
+    "memory": InMemoryInstrumentation,
+    "noop": NoopInstrumentation,
+    "none": NoopInstrumentation,
+}
+
+
+def get_instrumentation(spec: Union[str, Instrumentation, None] = None) -> Instrumentation:
+    """get an Instrumentation from an instance or a name in INSTRUMENTATIONS"""
+    if spec is None:
+        spec = INSTRUMENTATION
+    if isinstance(spec, Instrumentation):
+        return spec
+    if spec.lower() in INSTRUMENTATIONS:
+        return INSTRUMENTATIONS[spec.lower()]()
+    raise ValueError(f"Unknown instrumentation {spec}, use one of {list(INSTRUMENTATIONS)}")
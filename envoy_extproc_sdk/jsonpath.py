@@ -0,0 +1,334 @@
+from __future__ import annotations
+
+from asyncio import Future, get_event_loop
+import json
+import re
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+from .util.envoy import ext_api
+from .util.lazy import LazyHttpBody
+
+Path = Tuple[Union[str, int], ...]
+
+# what the extractor expects next
+VALUE, VALUE_OR_END, KEY, KEY_OR_END, COLON, COMMA_OR_END = range(6)
+
+OBJECT, ARRAY = 0, 1
+
+WHITESPACE = re.compile(rb"[ \t\r\n]*")
+STRING = re.compile(rb'"[^"\\]*(?:\\.[^"\\]*)*"', re.DOTALL)
+TOKEN = re.compile(rb"[0-9A-Za-z.+-]*")
+SCALAR = re.compile(rb"-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][+-]?[0-9]+)?|true|false|null")
+# anything but brackets and the start of an unfinished string
+SKIPPABLE = re.compile(rb'(?:[^"\[\]{}]+|"[^"\\]*(?:\\.[^"\\]*)*")*', re.DOTALL)
+STRING_END = re.compile(rb'["\\]')
+PATH_PART = re.compile(r"([^.\[\]]+)|\[(\d+)\]")
+
+QUOTE, BACKSLASH = ord('"'), ord("\\")
+OPENS, CLOSES = b"{[", b"}]"
+
+
+def parse_path(path: str) -> Path:
+    """
+    Parse a JSON path: keys separated by dots, and array indices in
+    brackets, optionally starting at the root ("$"), as in
+
+        $.meta.idempotency_key
+        items[0].id
+    """
+    if path.startswith("$"):
+        path = path[1:].lstrip(".")
+    parts: List[Union[str, int]] = []
+    end = 0
+    for match in PATH_PART.finditer(path):
+        if match.start() not in (end, end + 1) or (match.start() == end + 1 and path[end] != "."):
+            raise ValueError(f"Invalid JSON path {path}")
+        key, index = match.groups()
+        parts.append(key if key is not None else int(index))
+        end = match.end()
+    if end != len(path) or not parts:
+        raise ValueError(f"Invalid JSON path {path}")
+    return tuple(parts)
+
+
+def lookup(value: Any, path: Path) -> Tuple[bool, Any]:
+    """(whether it's there, and) the value at path within value"""
+    for part in path:
+        try:
+            value = value[part]
+        except (KeyError, IndexError, TypeError):
+            return False, None
+    return True, value
+
+
+class JsonFieldExtractor:
+    """
+    Pulls a few fields out of a JSON document as it arrives in pieces
+    (say, the chunks of a STREAMED body), without buffering or parsing the
+    whole document:
+
+        extractor = JsonFieldExtractor(["tenant_id", "meta.idempotency_key"])
+        ...
+        if extractor.feed(chunk):  # (an HttpBody, or bytes)
+            tenant = extractor.found.get("tenant_id")
+
+    The extractor scans the document, only decoding the requested values
+    (and the keys on the way to them), and skipping any object, array, or
+    string that can't hold one as it arrives; only the requested values
+    are kept (however many pieces they span) until they're complete. It's `done` as soon as every field is found, or
+    the document ends (or the body does, with end_of_stream), whichever is
+    first; after that anything fed is ignored. `found` holds the values
+    found (by path) and `missing` the paths that weren't; `future` is
+    resolved with `found` when done. Malformed JSON raises ValueError.
+    """
+
+    def __init__(self, paths: Iterable[str]) -> None:
+        self.paths: Dict[Path, str] = {parse_path(path): path for path in paths}
+        self.found: Dict[str, Any] = {}
+        self.done = False
+        self._remaining = set(self.paths)
+        self._prefixes = {path[:i] for path in self._remaining for i in range(len(path))}
+        self._buffer = bytearray()
+        self._stack: List[List[Any]] = []  # [OBJECT, key] or [ARRAY, index]
+        self._expect = VALUE
+        # skipping (or capturing) an object, array, or string
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._capture: Optional[bytearray] = None
+        self._capture_path: Path = ()
+        self._future: Optional[Future] = None
+        if not self._remaining:
+            self.done = True
+
+    def __repr__(self) -> str:
+        return f"JsonFieldExtractor({list(self.paths.values())}, found={self.found})"
+
+    @property
+    def missing(self) -> List[str]:
+        return [self.paths[path] for path in self._remaining]
+
+    @property
+    def future(self) -> Future:
+        """resolved with `found` when done"""
+        if self._future is None:
+            self._future = get_event_loop().create_future()
+            if self.done:
+                self._future.set_result(self.found)
+        return self._future
+
+    def feed(
+        self, data: Union[bytes, memoryview, ext_api.HttpBody, LazyHttpBody], final: bool = False
+    ) -> bool:
+        """Scan the next piece of the document (the last if final, or if
+        it's a body with end_of_stream), returning whether done"""
+        if isinstance(data, (ext_api.HttpBody, LazyHttpBody)):
+            final = final or data.end_of_stream
+            data = data.body
+        if self.done:
+            return True
+        self._buffer += data
+        try:
+            consumed = self._scan(final)
+        except ValueError as err:
+            self._finish()
+            raise ValueError(f"Malformed JSON: {err}") from None
+        del self._buffer[:consumed]
+        if final:
+            self._finish()
+        return self.done
+
+    def _finish(self) -> None:
+        if not self.done:
+            self.done = True
+            self._buffer = bytearray()
+            if (self._future is not None) and not self._future.done():
+                self._future.set_result(self.found)
+
+    def _found(self, path: Path, value: Any) -> None:
+        self.found[self.paths[path]] = value
+        self._remaining.discard(path)
+        if not self._remaining:
+            self._finish()
+
+    def _path(self) -> Path:
+        return tuple(frame[1] for frame in self._stack)
+
+    def _scan(self, final: bool) -> int:
+        buf = self._buffer
+        n = len(buf)
+        pos = 0
+        while (pos < n) and not self.done:
+
+            if self._depth or self._in_string:
+                pos = self._skip(buf, pos, n)
+                continue
+
+            pos = WHITESPACE.match(buf, pos).end()
+            if pos >= n:
+                break
+            char = buf[pos]
+            expect = self._expect
+
+            if expect == VALUE or expect == VALUE_OR_END:
+                if (char == CLOSES[1]) and (expect == VALUE_OR_END):
+                    pos = self._close(ARRAY, pos)
+                    continue
+                end = self._value(buf, pos, n, final)
+                if end is None:
+                    break  # wait for the rest of the value
+                pos = end
+
+            elif expect == KEY or expect == KEY_OR_END:
+                if (char == CLOSES[0]) and (expect == KEY_OR_END):
+                    pos = self._close(OBJECT, pos)
+                    continue
+                if char != QUOTE:
+                    raise ValueError(f"expected a key at {buf[pos:pos + 16]!r}")
+                match = STRING.match(buf, pos)
+                if match is None:
+                    if final:
+                        raise ValueError("unterminated key")
+                    break
+                self._stack[-1][1] = self._string(match.group())
+                self._expect = COLON
+                pos = match.end()
+
+            elif expect == COLON:
+                if char != ord(":"):
+                    raise ValueError(f"expected ':' at {buf[pos:pos + 16]!r}")
+                self._expect = VALUE
+                pos += 1
+
+            else:  # COMMA_OR_END
+                if not self._stack:
+                    raise ValueError(f"unexpected data after the document at {buf[pos:pos + 16]!r}")
+                frame = self._stack[-1]
+                if char == ord(","):
+                    if frame[0] == OBJECT:
+                        self._expect = KEY
+                    else:
+                        frame[1] += 1
+                        self._expect = VALUE
+                    pos += 1
+                elif char in CLOSES:
+                    pos = self._close(CLOSES.index(char), pos)
+                else:
+                    raise ValueError(f"expected ',' at {buf[pos:pos + 16]!r}")
+
+        if final and self._in_string and not self._depth and not self.done:
+            raise ValueError("unterminated string")
+        return pos
+
+    def _value(self, buf: bytearray, pos: int, n: int, final: bool) -> Optional[int]:
+        """scan the value at pos, returning where it ends (or None if
+        it's incomplete)"""
+        path = self._path()
+        char = buf[pos]
+
+        if char in OPENS:
+            if path in self._remaining:
+                # capture the whole (object or array) value to parse
+                self._capture, self._capture_path = bytearray(buf[pos : pos + 1]), path
+                self._depth = 1
+            elif path in self._prefixes:
+                # look inside it for what's wanted
+                kind = OPENS.index(char)
+                self._stack.append([kind, None if kind == OBJECT else 0])
+                self._expect = KEY_OR_END if kind == OBJECT else VALUE_OR_END
+            else:
+                self._depth = 1  # skip it
+            return pos + 1
+
+        if char == QUOTE:
+            # strings are skipped as they arrive (or captured, if wanted),
+            # so a long one isn't held (or rescanned) until it ends
+            if path in self._remaining:
+                self._capture, self._capture_path = bytearray(b'"'), path
+            self._in_string = True
+            return pos + 1
+
+        # a number or literal ends where its token does, which might be in
+        # a later piece
+        end = TOKEN.match(buf, pos).end()
+        if (end == n) and not final:
+            return None
+        match = SCALAR.match(buf, pos)
+        if (match is None) or (match.end() != end):
+            raise ValueError(f"invalid value at {buf[pos:pos + 16]!r}")
+        self._expect = COMMA_OR_END
+        if path in self._remaining:
+            self._found(path, json.loads(match.group()))
+        if not self._stack:
+            self._finish()  # the document was just a value
+        return match.end()
+
+    def _close(self, kind: int, pos: int) -> int:
+        frame = self._stack.pop() if self._stack else None
+        if (frame is None) or (frame[0] != kind):
+            raise ValueError("mismatched brackets")
+        self._expect = COMMA_OR_END
+        if not self._stack:
+            self._finish()
+        return pos + 1
+
+    def _skip(self, buf: bytearray, pos: int, n: int) -> int:
+        """skip (capturing, if capturing) through an object, array, or string"""
+        start = pos
+        while pos < n:
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                    pos += 1
+                    continue
+                match = STRING_END.search(buf, pos)
+                if match is None:
+                    pos = n
+                    break
+                pos = match.start() + 1
+                if buf[match.start()] == BACKSLASH:
+                    self._escaped = True
+                else:
+                    self._in_string = False
+                    if not self._depth:
+                        break  # (a string value, not in an object or array)
+                continue
+            pos = SKIPPABLE.match(buf, pos).end()
+            if pos >= n:
+                break
+            char = buf[pos]
+            pos += 1
+            if char == QUOTE:
+                self._in_string = True  # (ending in a later piece)
+            elif char in OPENS:
+                self._depth += 1
+            else:
+                self._depth -= 1
+                if self._depth == 0:
+                    break
+
+        if self._capture is not None:
+            self._capture += buf[start:pos]
+        if (self._depth == 0) and not self._in_string:
+            self._expect = COMMA_OR_END
+            if self._capture is not None:
+                self._captured(json.loads(self._capture))
+            if not self._stack:
+                self._finish()
+        return pos
+
+    def _captured(self, value: Any) -> None:
+        path, self._capture = self._capture_path, None
+        # anything wanted inside the captured value is in it
+        for wanted in [p for p in self._remaining if p[: len(path)] == path]:
+            there, inner = lookup(value, wanted[len(path) :])
+            if there:
+                self._found(wanted, inner)
+        if path in self._remaining:
+            self._found(path, value)
+
+    @staticmethod
+    def _string(token: bytes) -> str:
+        if b"\\" in token:
+            return json.loads(token)
+        return token[1:-1].decode()
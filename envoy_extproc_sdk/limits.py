@@ -0,0 +1,330 @@
+from __future__ import annotations
+
+from asyncio import CancelledError, Future, get_running_loop
+from collections import Counter, defaultdict, deque
+from math import sqrt
+from time import perf_counter_ns
+from typing import Any, Callable, Deque, Dict, List, Optional, Union
+
+from .settings import (
+    ADAPTIVE_CONCURRENCY,
+    MAX_PHASES,
+    MAX_STREAMS,
+    OVERLOAD_FALLBACK,
+)
+
+# what to respond to work shed while overloaded
+OVERLOAD_FALLBACKS = ("continue", "error")
+
+
+class AdaptiveLimit:
+    """
+    A concurrency limit that follows handler latency, after envoy's
+    adaptive concurrency filter (its gradient controller). Latencies are
+    recorded as phases finish, and at the end of each `window` (seconds)
+    the limit is scaled by the gradient between the latency the handler
+    has with no queueing (the "min RTT", plus a `buffer` fraction of it)
+    and the latency measured over the window (its `percentile`),
+
+        gradient = clamp(min_rtt * (1 + buffer) / sample_rtt, 0.5, 2.0)
+        limit = gradient * limit + sqrt(gradient * limit)
+
+    so the limit grows while latency stays near the min RTT, and shrinks
+    (multiplicatively) as work queues; the square root leaves headroom
+    for bursts. The limit stays within [min_limit, max_limit], and only
+    grows in windows where at least half of it was used (so it stays
+    near the concurrency the load needs, ready to shrink quickly).
+
+    The min RTT is measured first, and then again every `min_rtt_interval`
+    seconds (as handler costs change), with the limit pinned at min_limit
+    until `min_rtt_samples` latencies are recorded with no more than that
+    in flight.
+    """
+
+    def __init__(
+        self,
+        initial: int = 16,
+        min_limit: int = 3,
+        max_limit: int = 1000,
+        window: float = 0.1,
+        percentile: float = 0.5,
+        buffer: float = 0.25,
+        min_rtt_interval: float = 60.0,
+        min_rtt_samples: int = 50,
+        clock: Callable[[], int] = perf_counter_ns,
+    ) -> None:
+        if not (1 <= min_limit <= initial <= max_limit):
+            raise ValueError(
+                f"Need 1 <= min_limit <= initial <= max_limit, not {min_limit}, {initial}, {max_limit}"
+            )
+        if not (0.0 < percentile < 1.0):
+            raise ValueError(f"percentile must be in (0, 1), not {percentile}")
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.window_ns = int(window * 1e9)
+        self.percentile = percentile
+        self.buffer = buffer
+        self.min_rtt_interval_ns = int(min_rtt_interval * 1e9)
+        self.min_rtt_samples = min_rtt_samples
+        self.clock = clock
+        self.min_rtt_ns: Optional[int] = None
+        self.sample_rtt_ns: Optional[int] = None
+        self.updates = 0
+        self._samples: List[int] = []
+        self._peak = 0  # (the most in flight in the window)
+        self._window_end = 0
+        self._next_min_rtt = 0
+        # start by measuring the min RTT
+        self._restore = initial
+        self.limit = min_limit
+        self.measuring = True
+
+    def __repr__(self) -> str:
+        return (
+            f"AdaptiveLimit({self.limit}, min_rtt={self.min_rtt_ns}, sample={self.sample_rtt_ns})"
+        )
+
+    def record(self, latency_ns: int, in_flight: int) -> None:
+        """a phase's latency (from its admission to its response), and how
+        many phases were in flight (with it)"""
+        samples = self._samples
+
+        if self.measuring:
+            # (phases admitted before the limit was pinned queued)
+            if in_flight <= self.min_limit:
+                samples.append(latency_ns)
+            if len(samples) >= self.min_rtt_samples:
+                now = self.clock()
+                self.min_rtt_ns = self._aggregate()
+                self.limit, self.measuring = self._restore, False
+                self._next_min_rtt = now + self.min_rtt_interval_ns
+                self._window_end = now + self.window_ns
+            return
+
+        samples.append(latency_ns)
+        if in_flight > self._peak:
+            self._peak = in_flight
+        now = self.clock()
+        if now < self._window_end:
+            return
+        if now >= self._next_min_rtt:
+            samples.clear()
+            self._restore, self.limit = self.limit, self.min_limit
+            self.measuring = True
+            return
+
+        self.sample_rtt_ns = self._aggregate()
+        gradient = min(2.0, max(0.5, self.min_rtt_ns * (1 + self.buffer) / self.sample_rtt_ns))
+        if (gradient < 1.0) or (2 * self._peak >= self.limit):
+            limit = gradient * self.limit
+            limit += sqrt(limit)
+            self.limit = int(min(self.max_limit, max(self.min_limit, limit)))
+        self.updates += 1
+        self._peak = 0
+        self._window_end = now + self.window_ns
+
+    def _aggregate(self) -> int:
+        """the percentile of (and clear) the samples"""
+        samples = sorted(self._samples)
+        self._samples.clear()
+        return samples[int(self.percentile * (len(samples) - 1))]
+
+    def stats(self) -> Dict[str, Optional[int]]:
+        return {
+            "limit": self.limit,
+            "min_rtt_ns": self.min_rtt_ns,
+            "sample_rtt_ns": self.sample_rtt_ns,
+        }
+
+
+class AdmissionController:
+    """
+    Server-wide admission control: limits on the Process streams open at
+    once, and on the phases being handled at once (across all streams),
+    past which work is shed rather than queued. gRPC would otherwise
+    accept every stream and the event loop queue every message, so under
+    overload every request slows down until envoy's message_timeout
+    expires them all; shed work is answered immediately instead, by the
+    `on_overload` fallback:
+
+    * "continue" (fail open) responds as if the processor changed
+      nothing; a shed stream also asks envoy (with a mode_override, see
+      MODE_OVERRIDE) to skip the request's remaining phases;
+    * "error" responds immediately with a 503.
+
+    A limit of 0 (or None) doesn't limit. Limits count the work on one
+    event loop, so with several WORKERS each worker has its own.
+
+    With `adaptive` (True, or a callable returning an AdaptiveLimit), each
+    phase also has a concurrency limit that adapts to its handlers'
+    latency (see AdaptiveLimit), within max_phases.
+
+    `streams` and `phases` are what's in flight (the queue the limits
+    bound), and `shed_streams` and `shed_phases` count what was shed.
+    """
+
+    def __init__(
+        self,
+        max_streams: Optional[int] = MAX_STREAMS,
+        max_phases: Optional[int] = MAX_PHASES,
+        on_overload: str = OVERLOAD_FALLBACK,
+        adaptive: Union[bool, Callable[[], AdaptiveLimit]] = ADAPTIVE_CONCURRENCY,
+    ) -> None:
+        for name, limit in (("max_streams", max_streams), ("max_phases", max_phases)):
+            if (limit is not None) and (limit < 0):
+                raise ValueError(f"{name} must be positive (or 0 for no limit), not {limit}")
+        if on_overload not in OVERLOAD_FALLBACKS:
+            raise ValueError(f"on_overload must be one of {OVERLOAD_FALLBACKS}, not {on_overload}")
+        self.max_streams = max_streams or None
+        self.max_phases = max_phases or None
+        self.on_overload = on_overload
+        self.streams = 0
+        self.phases = 0
+        self.shed_streams = 0
+        self.shed_phases = 0
+        # per phase adaptive limits, and what's in flight in each phase
+        self.adaptive: Optional[Dict[str, AdaptiveLimit]] = None
+        self.in_flight: Dict[str, int] = Counter()
+        if adaptive:
+            self.adaptive = defaultdict(AdaptiveLimit if adaptive is True else adaptive)
+
+    def __repr__(self) -> str:
+        return (
+            f"AdmissionController(streams={self.streams}/{self.max_streams}, "
+            f"phases={self.phases}/{self.max_phases}, on_overload={self.on_overload})"
+        )
+
+    def admit_stream(self) -> bool:
+        """whether to process a new stream (release it when it ends)"""
+        if (self.max_streams is not None) and (self.streams >= self.max_streams):
+            self.shed_streams += 1
+            return False
+        self.streams += 1
+        return True
+
+    def release_stream(self) -> None:
+        self.streams -= 1
+
+    def admit_phase(self, phase: str) -> bool:
+        """whether to handle a phase now (release it when it's handled)"""
+        if (self.max_phases is not None) and (self.phases >= self.max_phases):
+            self.shed_phases += 1
+            return False
+        if self.adaptive is not None:
+            if self.in_flight[phase] >= self.adaptive[phase].limit:
+                self.shed_phases += 1
+                return False
+            self.in_flight[phase] += 1
+        self.phases += 1
+        return True
+
+    def release_phase(self, phase: str, latency_ns: int) -> None:
+        """a phase admitted was handled (taking latency_ns)"""
+        self.phases -= 1
+        if self.adaptive is not None:
+            self.adaptive[phase].record(latency_ns, self.in_flight[phase])
+            self.in_flight[phase] -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        stats = {
+            "max_streams": self.max_streams,
+            "max_phases": self.max_phases,
+            "streams": self.streams,
+            "phases": self.phases,
+            "shed_streams": self.shed_streams,
+            "shed_phases": self.shed_phases,
+        }
+        if self.adaptive is not None:
+            stats["adaptive"] = {phase: limit.stats() for phase, limit in self.adaptive.items()}
+        return stats
+
+
+def get_admission() -> Optional[AdmissionController]:
+    """an AdmissionController from the settings, or None if nothing is limited"""
+    if MAX_STREAMS or MAX_PHASES or ADAPTIVE_CONCURRENCY:
+        return AdmissionController()
+    return None
+
+
+class Bulkhead:
+    """
+    A handler's own concurrency pool (see HandlerOptions.max_concurrency):
+    the handler runs at most `max_concurrency` phases at once, and up to
+    `max_queue` more wait (in order) for it. Past that, the `overflow`
+    says what to do: "continue" and "error" reject the phase (the service
+    responds as if the handler changed nothing, or with a 503), and
+    "wait" queues it anyway.
+
+    `running` and `queued` are the phases running and waiting now, and
+    `peak_queued`, `waited`, and `rejected` the most that waited at once,
+    and counts of phases that waited and that were rejected.
+    """
+
+    def __init__(
+        self, max_concurrency: int, max_queue: int = 0, overflow: str = "continue"
+    ) -> None:
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.overflow = overflow
+        self.running = 0
+        self.peak_queued = 0
+        self.waited = 0
+        self.rejected = 0
+        self._waiters: Deque[Future] = deque()
+
+    def __repr__(self) -> str:
+        return (
+            f"Bulkhead(running={self.running}/{self.max_concurrency}, "
+            f"queued={self.queued}/{self.max_queue}, overflow={self.overflow})"
+        )
+
+    @property
+    def queued(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self) -> bool:
+        """whether the handler can run a phase, waiting if it must (release
+        it when the phase is handled)"""
+        waiters = self._waiters
+        if (self.running < self.max_concurrency) and not waiters:
+            self.running += 1
+            return True
+        if (len(waiters) >= self.max_queue) and (self.overflow != "wait"):
+            self.rejected += 1
+            return False
+
+        future = get_running_loop().create_future()
+        waiters.append(future)
+        self.waited += 1
+        if len(waiters) > self.peak_queued:
+            self.peak_queued = len(waiters)
+        try:
+            await future
+        except CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()  # (handed a turn, but cancelled)
+            elif future in waiters:
+                waiters.remove(future)
+            raise
+        return True
+
+    def release(self) -> None:
+        """a phase was handled; its turn goes to the next waiting, if any"""
+        waiters = self._waiters
+        while waiters:
+            future = waiters.popleft()
+            if not future.cancelled():
+                future.set_result(None)
+                return
+        self.running -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "running": self.running,
+            "queued": self.queued,
+            "peak_queued": self.peak_queued,
+            "waited": self.waited,
+            "rejected": self.rejected,
+        }
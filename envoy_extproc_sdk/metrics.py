@@ -0,0 +1,279 @@
+from __future__ import annotations
+
+from asyncio import (
+    AbstractServer,
+    IncompleteReadError,
+    start_server,
+    StreamReader,
+    StreamWriter,
+)
+from bisect import bisect_left
+from collections import Counter
+from functools import partial
+from logging import getLogger
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from .settings import METRICS_PORT
+
+logger = getLogger(__name__)
+
+# histogram bucket bounds (in ns): 1, 2.5, and 5 times each power of ten
+# from 1us to 5s, and 10s
+LATENCY_BUCKETS_NS = tuple(int(m * 10**e) for e in range(3, 10) for m in (1, 2.5, 5)) + (10**10,)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+class Histogram:
+    """
+    Latencies counted into fixed buckets: `counts[i]` is the number of
+    observations no larger than `bounds[i]` (and larger than the bound
+    before it), with a last count for those larger than every bound. An
+    observation is a binary search and two additions, with no locks; it
+    is only safe from the one thread running the event loop.
+    """
+
+    __slots__ = ("bounds", "counts", "sum_ns")
+
+    def __init__(self, bounds: Sequence[int] = LATENCY_BUCKETS_NS) -> None:
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.sum_ns = 0
+
+    def __repr__(self) -> str:
+        return f"Histogram(count={self.count}, sum_ns={self.sum_ns})"
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def observe(self, value_ns: int) -> None:
+        self.counts[bisect_left(self.bounds, value_ns)] += 1
+        self.sum_ns += value_ns
+
+    def quantile(self, q: float) -> Optional[int]:
+        """an upper bound on the q quantile: the bound of the bucket it falls
+        in (None if it's past the last bound, or nothing was observed)"""
+        rank, seen = q * self.count, 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen and (seen >= rank):
+                return bound
+        return None
+
+
+class Metrics:
+    """
+    Metrics for the services on one event loop, exposed in the Prometheus
+    text format by `render` (see start_metrics_server):
+
+    * a latency Histogram for each processor's phases (`phases`), which
+      for a chain includes each member's;
+    * counts of the streams each processor opened (`streams`), streams
+      envoy cancelled (`cancelled`), StopRequestProcessing outcomes by
+      processor, phase, and status (`stopped`), and errors by processor,
+      phase, and exception type (`errors`);
+    * the state of every `register`ed service's limits and queues, read
+      as the metrics are rendered (admission control, bulkheads, the
+      scheduler, and expired deadlines).
+
+    Recording only updates counts in place on the event loop, so costs a
+    few hundred nanoseconds, and nothing until the metrics are rendered.
+    """
+
+    def __init__(
+        self, buckets: Sequence[int] = LATENCY_BUCKETS_NS, prefix: str = "extproc"
+    ) -> None:
+        self.buckets = tuple(buckets)
+        self.prefix = prefix
+        self.phases: Dict[Tuple[str, str], Histogram] = {}
+        self.streams: Dict[str, int] = Counter()
+        self.cancelled: Dict[str, int] = Counter()
+        self.stopped: Dict[Tuple[str, str, str], int] = Counter()
+        self.errors: Dict[Tuple[str, str, str], int] = Counter()
+        self.services: List[Any] = []
+
+    def __repr__(self) -> str:
+        return f"Metrics(processors={[service.name for service in self.services]})"
+
+    def register(self, service: Any) -> None:
+        """include a service's limits and queues in the metrics"""
+        if service not in self.services:
+            self.services.append(service)
+
+    def observe(self, processor: str, phase: str, duration_ns: int) -> None:
+        """a phase's latency"""
+        histogram = self.phases.get((processor, phase))
+        if histogram is None:
+            histogram = self.phases[(processor, phase)] = Histogram(self.buckets)
+        histogram.observe(duration_ns)
+
+    def stop(self, processor: str, phase: str, err: Exception) -> None:
+        """a handler raised StopRequestProcessing"""
+        # (pre-serialized responses aren't parsed just for their status)
+        response = err.response
+        status = "preserialized" if isinstance(response, bytes) else str(response.status.code)
+        self.stopped[(processor, phase, status)] += 1
+
+    def error(self, processor: str, phase: str, err: BaseException) -> None:
+        """a phase failed with an error"""
+        self.errors[(processor, phase, type(err).__name__)] += 1
+
+    def render(self) -> str:
+        """the metrics, in the Prometheus text format"""
+        out = _Exposition(self.prefix)
+
+        name = "phase_duration_seconds"
+        out.family(name, "histogram", "Time taken to handle a phase")
+        for (processor, phase), histogram in self.phases.items():
+            labels = {"processor": processor, "phase": phase}
+            seen = 0
+            for bound, count in zip(histogram.bounds, histogram.counts):
+                seen += count
+                out.sample(f"{name}_bucket", {**labels, "le": _seconds(bound)}, seen)
+            seen += histogram.counts[-1]
+            out.sample(f"{name}_bucket", {**labels, "le": "+Inf"}, seen)
+            out.sample(f"{name}_sum", labels, histogram.sum_ns / 1e9)
+            out.sample(f"{name}_count", labels, seen)
+
+        out.family("streams_total", "counter", "Process streams opened")
+        for processor, count in self.streams.items():
+            out.sample("streams_total", {"processor": processor}, count)
+        out.family("cancelled_total", "counter", "Process streams cancelled by envoy")
+        for processor, count in self.cancelled.items():
+            out.sample("cancelled_total", {"processor": processor}, count)
+        out.family("stopped_total", "counter", "Phases that stopped processing (and responded)")
+        for (processor, phase, status), count in self.stopped.items():
+            labels = {"processor": processor, "phase": phase, "status": status}
+            out.sample("stopped_total", labels, count)
+        out.family("errors_total", "counter", "Phases that failed with an error")
+        for (processor, phase, error), count in self.errors.items():
+            labels = {"processor": processor, "phase": phase, "error": error}
+            out.sample("errors_total", labels, count)
+
+        for service in self.services:
+            for member in [service, *getattr(service, "members", [])]:
+                _render_service(out, member)
+        # (the admission controller is shared by the server's services)
+        admissions = {id(s.admission): s.admission for s in self.services if s.admission}
+        for admission in admissions.values():
+            _render_admission(out, admission)
+
+        return out.render()
+
+
+class _Exposition:
+    """samples grouped by family (as the text format requires)"""
+
+    def __init__(self, prefix: str) -> None:
+        self.prefix = prefix
+        self.families: Dict[str, List[str]] = {}
+
+    def family(self, name: str, kind: str, help: str) -> None:
+        name = f"{self.prefix}_{name}"
+        if name not in self.families:
+            self.families[name] = [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+
+    def sample(self, name: str, labels: Dict[str, Any], value: Any) -> None:
+        family = f"{self.prefix}_{name}"
+        for suffix in ("_bucket", "_sum", "_count"):
+            if family not in self.families and family.endswith(suffix):
+                family = family[: -len(suffix)]
+        pairs = ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items())
+        pairs = f"{{{pairs}}}" if pairs else ""
+        self.families[family].append(f"{self.prefix}_{name}{pairs} {_number(value)}")
+
+    def render(self) -> str:
+        return "".join(
+            "\n".join(lines) + "\n" for lines in self.families.values() if len(lines) > 2
+        )
+
+
+def _render_service(out: _Exposition, service: Any) -> None:
+    """a service's expired deadlines, bulkheads, and scheduler"""
+    processor = service.name
+
+    out.family("deadlines_expired_total", "counter", "Handlers that ran past their deadlines")
+    for phase, count in getattr(service, "deadlines_expired", {}).items():
+        out.sample("deadlines_expired_total", {"processor": processor, "phase": phase}, count)
+
+    bulkheads = service.bulkhead_stats() if hasattr(service, "bulkhead_stats") else {}
+    out.family("bulkhead_running", "gauge", "Phases running in handler bulkheads")
+    out.family("bulkhead_queued", "gauge", "Phases waiting for handler bulkheads")
+    out.family("bulkhead_rejected_total", "counter", "Phases handler bulkheads had no room for")
+    for phase, stats in bulkheads.items():
+        labels = {"processor": processor, "phase": phase}
+        out.sample("bulkhead_running", labels, stats["running"])
+        out.sample("bulkhead_queued", labels, stats["queued"])
+        out.sample("bulkhead_rejected_total", labels, stats["rejected"])
+
+    scheduler = getattr(service, "scheduler", None)
+    if scheduler is not None:
+        out.family("scheduler_running", "gauge", "Handlers the scheduler is running")
+        out.family("scheduler_queued", "gauge", "Handlers waiting for the scheduler")
+        out.family("scheduler_wait_seconds", "summary", "Time handlers waited to be scheduled")
+        out.sample("scheduler_running", {"processor": processor}, scheduler.running)
+        out.sample("scheduler_queued", {"processor": processor}, scheduler.queued)
+        for phase, wait in scheduler.waits.items():
+            labels = {"processor": processor, "phase": phase}
+            out.sample("scheduler_wait_seconds_sum", labels, wait.total_ns / 1e9)
+            out.sample("scheduler_wait_seconds_count", labels, wait.count)
+
+
+def _render_admission(out: _Exposition, admission: Any) -> None:
+    """the server's admission control"""
+    out.family("admission_streams", "gauge", "Streams admitted and open")
+    out.family("admission_phases", "gauge", "Phases admitted and being handled")
+    out.family("admission_shed_total", "counter", "Work shed while overloaded")
+    out.sample("admission_streams", {}, admission.streams)
+    out.sample("admission_phases", {}, admission.phases)
+    out.sample("admission_shed_total", {"what": "stream"}, admission.shed_streams)
+    out.sample("admission_shed_total", {"what": "phase"}, admission.shed_phases)
+    if admission.adaptive is not None:
+        out.family("admission_limit", "gauge", "Adaptive phase concurrency limits")
+        for phase, limit in admission.adaptive.items():
+            out.sample("admission_limit", {"phase": phase}, limit.limit)
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _seconds(value_ns: int) -> str:
+    return repr(value_ns / 1e9)
+
+
+def _number(value: Any) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+async def start_metrics_server(
+    metrics: Metrics, port: int = METRICS_PORT, host: Optional[str] = None
+) -> AbstractServer:
+    """Serve the metrics (GET /metrics) over HTTP on port, on this event
+    loop; close the server returned to stop"""
+    server = await start_server(partial(_respond, metrics), host, port)
+    logger.info(f"Serving metrics at {port}")
+    return server
+
+
+async def _respond(metrics: Metrics, reader: StreamReader, writer: StreamWriter) -> None:
+    try:
+        request = (await reader.readline()).split()
+        while (await reader.readline()).strip():
+            pass  # (headers)
+        path = request[1].split(b"?")[0] if len(request) > 1 else None
+        if request[:1] == [b"GET"] and path in (b"/", b"/metrics"):
+            status, body = "200 OK", metrics.render().encode()
+        else:
+            status, body = "404 Not Found", b"not found\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: {CONTENT_TYPE}\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode()
+        )
+        writer.write(body)
+        await writer.drain()
+    except (ConnectionError, IncompleteReadError):
+        pass
+    finally:
+        writer.close()
@@ -0,0 +1,124 @@
+from __future__ import annotations
+
+from functools import lru_cache
+from typing import Dict, Iterator, Tuple, Union
+
+from .util.envoy import EnvoyHeaderValue, EnvoyHeaderValueOption, ext_api
+
+# how many constant (key, value) header options are kept prebuilt
+CONSTANT_OPTIONS = 1024
+
+
+def header_option(key: str, value: str) -> EnvoyHeaderValueOption:
+    """a (new) option setting a header"""
+    return EnvoyHeaderValueOption(header=EnvoyHeaderValue(key=key, value=value))
+
+
+@lru_cache(maxsize=CONSTANT_OPTIONS)
+def constant_header_option(key: str, value: str) -> EnvoyHeaderValueOption:
+    """
+    A prebuilt option setting a header to a value that doesn't change from
+    request to request, built once. Options are copied into responses (as
+    any message added to a repeated field is), so sharing one is safe, but
+    it must never be mutated.
+    """
+    return header_option(key, value)
+
+
+def omit_empty_mutation(response: Union[ext_api.CommonResponse, ext_api.HeaderMutation]) -> None:
+    """drop a CommonResponse's header_mutation if it doesn't change anything"""
+    if isinstance(response, ext_api.CommonResponse) and response.HasField("header_mutation"):
+        mutation = response.header_mutation
+        if not (mutation.set_headers or mutation.remove_headers):
+            response.ClearField("header_mutation")
+
+
+class MutationBuilder:
+    """
+    Header sets and removals collected over a phase (see the context's
+    `mutations`), coalesced by (lower cased) header name so only the last
+    change to a header is sent: a set replaces an earlier set or removal
+    of the same header, and a removal an earlier set. The options are
+    built and added to the phase's response in one go when the handler
+    returns (see `apply`), and nothing is added if nothing was changed.
+
+    Pass `constant=True` to `set` for values that are the same for every
+    request (a version, a processor's name) to use a prebuilt option (see
+    constant_header_option).
+    """
+
+    __slots__ = ("_sets", "_removes")
+
+    def __init__(self) -> None:
+        self._sets: Dict[str, Tuple[str, bool]] = {}
+        self._removes: Dict[str, None] = {}  # (ordered)
+
+    def __repr__(self) -> str:
+        sets = {key: value for key, (value, _) in self._sets.items()}
+        return f"MutationBuilder(set={sets}, remove={list(self._removes)})"
+
+    def __bool__(self) -> bool:
+        return bool(self._sets or self._removes)
+
+    def __len__(self) -> int:
+        return len(self._sets) + len(self._removes)
+
+    def __iter__(self) -> Iterator[Tuple[str, str]]:
+        """the headers set, as (key, value) pairs"""
+        return ((key, value) for key, (value, _) in self._sets.items())
+
+    def set(self, key: str, value: str, constant: bool = False) -> MutationBuilder:
+        """set a header (replacing any earlier change to it)"""
+        key = key.lower()
+        self._removes.pop(key, None)
+        self._sets[key] = (value, constant)
+        return self
+
+    def update(self, headers: Dict[str, str], constant: bool = False) -> MutationBuilder:
+        """set several headers"""
+        for key, value in headers.items():
+            self.set(key, value, constant=constant)
+        return self
+
+    def remove(self, *keys: str) -> MutationBuilder:
+        """remove headers (replacing any earlier sets of them)"""
+        for key in keys:
+            key = key.lower()
+            self._sets.pop(key, None)
+            self._removes[key] = None
+        return self
+
+    def get(self, key: str) -> Union[str, None]:
+        """the value a header is set to (None if it isn't)"""
+        value = self._sets.get(key.lower())
+        return None if value is None else value[0]
+
+    def removes(self, key: str) -> bool:
+        """whether a header is removed"""
+        return key.lower() in self._removes
+
+    def clear(self) -> None:
+        self._sets.clear()
+        self._removes.clear()
+
+    def apply(
+        self, response: Union[ext_api.CommonResponse, ext_api.HeaderMutation]
+    ) -> Union[ext_api.CommonResponse, ext_api.HeaderMutation]:
+        """Add what's collected to response (a CommonResponse, or a
+        HeaderMutation for trailers), and clear"""
+        if not (self._sets or self._removes):
+            return response
+        mutation = (
+            response.header_mutation if isinstance(response, ext_api.CommonResponse) else response
+        )
+        if self._removes:
+            mutation.remove_headers.extend(self._removes)
+        if self._sets:
+            mutation.set_headers.extend(
+                [
+                    constant_header_option(key, value) if constant else header_option(key, value)
+                    for key, (value, constant) in self._sets.items()
+                ]
+            )
+        self.clear()
+        return response
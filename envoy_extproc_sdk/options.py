@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+from typing import Any, Callable, Optional
+
+OFFLOAD_POLICIES = ("inline", "thread", "process")
+
+# what to respond when a handler runs past its deadline
+DEADLINE_FALLBACKS = ("continue", "error", "skip")
+
+# what to do with a phase when its handler's bulkhead (and queue) is full
+BULKHEAD_OVERFLOWS = ("continue", "error", "wait")
+
+
+class HandlerOptions:
+    """
+    Per-handler execution options. Set these for subclass methods with the
+    @handler_options decorator, or pass them to @process when registering
+    a handler:
+
+        class SomeExtProcService(BaseExtProcService):
+
+            @handler_options(offload="thread", offload_threshold=64 * 1024)
+            def process_request_body(self, body, context, request, response):
+                ...
+
+        @P.process("request_body", offload="thread", offload_threshold=64 * 1024)
+        def some_func(body, context, request, response):
+            ...
+
+    offload: where to run a (synchronous) handler. "inline" calls it on
+        the event loop, "thread" runs it in the server's thread pool, and
+        "process" in the server's process pool. A handler run in a process
+        is called with a copy of the request context (changes to its data
+        are copied back) and no ServicerContext, so the handler and what it
+        keeps in the context must be picklable.
+    offload_threshold: for body phases, only offload bodies larger than
+        this many bytes; smaller bodies are handled inline.
+    deadline: seconds the handler has to respond (None uses the
+        HANDLER_DEADLINE setting; 0 means no deadline). Set it below the
+        filter's message_timeout: past that, envoy has moved on without
+        the response. A handler past its deadline is cancelled and the
+        on_deadline fallback sent instead. Only the event loop can cancel
+        a handler, so deadlines apply to async handlers and offloaded
+        ones (a thread or process runs on, but its response is dropped);
+        an inline sync handler holds the loop until it returns.
+    on_deadline: the fallback for a handler past its deadline (None uses
+        the DEADLINE_FALLBACK setting): "continue" responds as if the
+        handler changed nothing; "error" responds immediately with a 504;
+        "skip" continues and asks envoy to skip the request's remaining
+        phases (which envoy only takes from the request headers phase).
+    priority: where the handler's work goes in the server's scheduler
+        (see PhaseScheduler), lower first; None uses the phase's default
+        (see PHASE_PRIORITIES: 0 for headers, 1 for trailers, 2 for bodies).
+    max_concurrency: the most phases the handler runs at once (its own
+        "bulkhead", see Bulkhead), so a slow handler can't take up the
+        capacity other handlers need; None doesn't limit it.
+    max_queue: how many phases wait for the handler when it's running
+        max_concurrency of them.
+    overflow: what to do with a phase when the handler's queue is full
+        too: "continue" responds as if the handler changed nothing;
+        "error" responds immediately with a 503; "wait" waits anyway.
+    """
+
+    __slots__ = (
+        "offload",
+        "offload_threshold",
+        "deadline",
+        "on_deadline",
+        "priority",
+        "max_concurrency",
+        "max_queue",
+        "overflow",
+    )
+
+    def __init__(
+        self,
+        offload: str = "inline",
+        offload_threshold: int = 0,
+        deadline: Optional[float] = None,
+        on_deadline: Optional[str] = None,
+        priority: Optional[int] = None,
+        max_concurrency: Optional[int] = None,
+        max_queue: int = 0,
+        overflow: str = "continue",
+    ) -> None:
+        if offload not in OFFLOAD_POLICIES:
+            raise ValueError(f"offload must be one of {OFFLOAD_POLICIES}, not {offload}")
+        if (deadline is not None) and (deadline < 0):
+            raise ValueError(f"deadline must be positive (or 0 for none), not {deadline}")
+        if (on_deadline is not None) and (on_deadline not in DEADLINE_FALLBACKS):
+            raise ValueError(f"on_deadline must be one of {DEADLINE_FALLBACKS}, not {on_deadline}")
+        if (priority is not None) and not isinstance(priority, int):
+            raise ValueError(f"priority must be an int, not {priority}")
+        if (max_concurrency is not None) and (max_concurrency < 1):
+            raise ValueError(f"max_concurrency must be at least 1, not {max_concurrency}")
+        if max_queue < 0:
+            raise ValueError(f"max_queue must be positive, not {max_queue}")
+        if overflow not in BULKHEAD_OVERFLOWS:
+            raise ValueError(f"overflow must be one of {BULKHEAD_OVERFLOWS}, not {overflow}")
+        self.offload = offload
+        self.offload_threshold = offload_threshold
+        self.deadline = deadline
+        self.on_deadline = on_deadline
+        self.priority = priority
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.overflow = overflow
+
+    def __repr__(self) -> str:
+        return f"HandlerOptions({', '.join(f'{k}={getattr(self, k)}' for k in self.__slots__)})"
+
+    @staticmethod
+    def of(func: Callable) -> Optional[HandlerOptions]:
+        """the options a handler was decorated with, if any"""
+        return getattr(func, "__extproc_options__", None)
+
+
+def handler_options(**options: Any) -> Callable[[Callable], Callable]:
+    """Decorate a phase handler with HandlerOptions"""
+
+    def wrapper(func: Callable) -> Callable:
+        func.__extproc_options__ = HandlerOptions(**options)
+        return func
+
+    return wrapper
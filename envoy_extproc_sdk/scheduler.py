@@ -0,0 +1,156 @@
+from __future__ import annotations
+
+from asyncio import CancelledError, Future, get_running_loop
+from bisect import insort
+from collections import defaultdict, deque
+from time import perf_counter_ns
+from typing import Any, Deque, Dict, Hashable, List
+
+from .settings import SCHEDULER_CONCURRENCY
+
+# The default priority of each phase's handlers (lower runs first). Header
+# phases are on the critical path of every request (envoy holds the request,
+# or response, until they're answered), so go ahead of bodies.
+PHASE_PRIORITIES = {
+    "request_headers": 0,
+    "response_headers": 0,
+    "request_trailers": 1,
+    "response_trailers": 1,
+    "request_body": 2,
+    "response_body": 2,
+}
+
+
+class QueueWait:
+    """How long a phase's handlers waited to be scheduled"""
+
+    __slots__ = ("count", "total_ns", "max_ns")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+
+    def __repr__(self) -> str:
+        return f"QueueWait(count={self.count}, mean_ns={self.mean_ns}, max_ns={self.max_ns})"
+
+    @property
+    def mean_ns(self) -> int:
+        return self.total_ns // self.count if self.count else 0
+
+    def record(self, wait_ns: int) -> None:
+        self.count += 1
+        self.total_ns += wait_ns
+        if wait_ns > self.max_ns:
+            self.max_ns = wait_ns
+
+    def stats(self) -> Dict[str, int]:
+        return {"count": self.count, "mean_ns": self.mean_ns, "max_ns": self.max_ns}
+
+
+class PhaseScheduler:
+    """
+    Runs phase handlers `concurrency` at a time, in priority order: header
+    phases ahead of trailers, and trailers ahead of bodies (see
+    PHASE_PRIORITIES, or a handler's `priority` option). Within a priority,
+    envoy connections take turns, so one busy connection can't hold up the
+    others.
+
+    Handlers at priority 0 (or below) run at once if there's room and
+    nothing is waiting. Others always wait for a turn of the event loop,
+    so that header phases already received, on any stream, run first; a
+    heavy body handler then holds up the headers that arrive while it
+    runs, but not those queued with it. Waiting work of a lower priority
+    only runs when none of a higher priority is waiting.
+
+    `running` and `queued` count the handlers running and waiting, and
+    `waits` how long each phase's handlers waited (see QueueWait).
+    """
+
+    def __init__(self, concurrency: int = SCHEDULER_CONCURRENCY) -> None:
+        if concurrency < 1:
+            raise ValueError(f"concurrency must be at least 1, not {concurrency}")
+        self.concurrency = concurrency
+        self.running = 0
+        self.queued = 0
+        self.waits: Dict[str, QueueWait] = defaultdict(QueueWait)
+        # waiters by priority, then by connection (which take turns)
+        self._queues: Dict[int, Dict[Hashable, Deque[Future]]] = {}
+        self._priorities: List[int] = []
+        self._dispatching = False
+
+    def __repr__(self) -> str:
+        return f"PhaseScheduler({self.concurrency}, running={self.running}, queued={self.queued})"
+
+    async def acquire(self, phase: str, priority: int, connection: Hashable = None) -> None:
+        """wait for a turn to run a handler (release it when it's done)"""
+        if (priority <= 0) and (self.running < self.concurrency) and not self.queued:
+            self.running += 1
+            self.waits[phase].record(0)
+            return
+
+        future = get_running_loop().create_future()
+        queue = self._queues.get(priority)
+        if queue is None:
+            queue = self._queues[priority] = {}
+            insort(self._priorities, priority)
+        waiters = queue.get(connection)
+        if waiters is None:
+            waiters = queue[connection] = deque()
+        waiters.append(future)
+        self.queued += 1
+        self._schedule()
+
+        start = perf_counter_ns()
+        try:
+            await future
+        except CancelledError:
+            # (a waiter cancelled before its turn is skipped when it comes)
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+        self.waits[phase].record(perf_counter_ns() - start)
+
+    def release(self) -> None:
+        """a handler finished"""
+        self.running -= 1
+        if self.queued:
+            self._schedule()
+
+    def _schedule(self) -> None:
+        # dispatch on the next turn of the loop, after whatever else has
+        # arrived meanwhile has been queued
+        if not self._dispatching:
+            self._dispatching = True
+            get_running_loop().call_soon(self._dispatch)
+
+    def _dispatch(self) -> None:
+        self._dispatching = False
+        while self.queued and (self.running < self.concurrency):
+            future = self._next()
+            self.queued -= 1
+            if not future.cancelled():
+                self.running += 1
+                future.set_result(None)
+
+    def _next(self) -> Future:
+        """the next waiter: the first connection's at the top priority"""
+        priority = self._priorities[0]
+        queue = self._queues[priority]
+        connection = next(iter(queue))
+        waiters = queue.pop(connection)
+        future = waiters.popleft()
+        if waiters:
+            queue[connection] = waiters  # (to the back of the line)
+        elif not queue:
+            del self._queues[priority]
+            self._priorities.pop(0)
+        return future
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "concurrency": self.concurrency,
+            "running": self.running,
+            "queued": self.queued,
+            "waits": {phase: wait.stats() for phase, wait in self.waits.items()},
+        }
@@ -1,16 +1,39 @@
-from asyncio import get_event_loop
+from asyncio import AbstractServer, Event, get_event_loop, new_event_loop
+from functools import partial
 from logging import getLogger
+from signal import SIGTERM
+from typing import Any, Optional, Sequence, Tuple, Union
 
+from grpc import (
+    method_handlers_generic_handler,
+    stream_stream_rpc_method_handler,
+)
 from grpc.aio import Server
 from grpc.aio import server as grpc_aio_server
 
+from .executors import Executors
 from .extproc import BaseExtProcService
 from .health import add_HealthServicer_to_server, HealthService
-from .settings import GRPC_PORT, SHUTDOWN_GRACE_PERIOD
+from .instrumentation import Instrumentation
+from .limits import AdmissionController, get_admission
+from .metrics import Metrics, start_metrics_server
+from .settings import (
+    ENVOY_SERVICE_NAME,
+    GENERIC_HANDLER,
+    GRPC_PORT,
+    LAZY_BODIES,
+    METRICS_PORT,
+    MIN_READY_WORKERS,
+    SHUTDOWN_GRACE_PERIOD,
+    WORKERS,
+)
 from .util.envoy import (
     add_ExternalProcessorServicer_to_server,
     EnvoyExtProcServicer,
+    ext_api,
 )
+from .util.lazy import LazyProcessingRequest
+from .workers import Supervisor, WorkerReadiness
 
 logger = getLogger(__name__)
 
@@ -18,25 +41,100 @@ logger = getLogger(__name__)
 _cleanup = []
 
 
+def serialize_response(response: Union[ext_api.ProcessingResponse, bytes]) -> bytes:
+    """serialize a ProcessingResponse, passing pre-serialized ones through"""
+    if isinstance(response, bytes):
+        return response
+    return response.SerializeToString()
+
+
+def add_generic_ExternalProcessor_to_server(
+    service: EnvoyExtProcServicer, server: Server, lazy_bodies: bool = False
+) -> None:
+    """
+    Register the ExternalProcessor like add_ExternalProcessorServicer_to_server,
+    but with a response serializer that sends bytes as they are, so
+    constant responses can be serialized once (see preserialize) instead of
+    for every message. With lazy_bodies, body messages are only decoded as
+    far as the body, which is a memoryview of the message received (see
+    LazyProcessingRequest).
+    """
+    if lazy_bodies:
+        deserializer = LazyProcessingRequest.FromString
+    else:
+        deserializer = ext_api.ProcessingRequest.FromString
+    handlers = {
+        "Process": stream_stream_rpc_method_handler(
+            service.Process,
+            request_deserializer=deserializer,
+            response_serializer=serialize_response,
+        ),
+    }
+    server.add_generic_rpc_handlers(
+        (method_handlers_generic_handler(ENVOY_SERVICE_NAME, handlers),)
+    )
+
+
 def create_server(
     service: EnvoyExtProcServicer = BaseExtProcService(),
     port: int = GRPC_PORT,
+    instrumentation: Optional[Union[str, Instrumentation]] = None,
+    executors: Optional[Executors] = None,
+    health: Optional[HealthService] = None,
+    options: Optional[Sequence[Tuple[str, Any]]] = None,
+    generic: bool = GENERIC_HANDLER,
+    lazy_bodies: bool = LAZY_BODIES,
+    admission: Optional[AdmissionController] = None,
+    metrics: Optional[Metrics] = None,
 ) -> Server:
-    server = grpc_aio_server()
-    add_ExternalProcessorServicer_to_server(service, server)
-    add_HealthServicer_to_server(HealthService, server)
+    if instrumentation is not None:
+        service.instrument(instrumentation)
+    if executors is not None:
+        service.executors = executors
+    # limits (if any are set) on the work the server takes on at once
+    admission = admission or get_admission()
+    if (admission is not None) and isinstance(service, BaseExtProcService):
+        service.admission = admission
+    # latencies and outcomes (served by serve, with a metrics_port)
+    if (metrics is not None) and isinstance(service, BaseExtProcService):
+        service.metrics = metrics
+        metrics.register(service)
+    server = grpc_aio_server(options=options)
+    # lazy bodies are decoded by the generic handler
+    generic = generic or lazy_bodies
+    if generic:
+        add_generic_ExternalProcessor_to_server(service, server, lazy_bodies=lazy_bodies)
+    else:
+        add_ExternalProcessorServicer_to_server(service, server)
+    # the service can only send bytes as they are through the generic handler
+    if isinstance(service, BaseExtProcService):
+        service.preserialized = generic
+    add_HealthServicer_to_server(health or HealthService(), server)
     server.add_insecure_port(f"[::]:{port}")
     return server
 
 
+async def _start_metrics(metrics: Optional[Metrics], port: int) -> Optional[AbstractServer]:
+    """serve the metrics over HTTP, if there are any"""
+    if metrics is None:
+        return None
+    return await start_metrics_server(metrics, port)
+
+
 async def _serve(
     service: EnvoyExtProcServicer = BaseExtProcService(),
     port: int = GRPC_PORT,
     grace_period: int = SHUTDOWN_GRACE_PERIOD,
+    instrumentation: Optional[Union[str, Instrumentation]] = None,
+    metrics_port: int = METRICS_PORT,
 ) -> None:
-    server = create_server(service=service, port=port)
+    metrics = Metrics() if metrics_port else None
+    server = create_server(
+        service=service, port=port, instrumentation=instrumentation, metrics=metrics
+    )
     logger.info(f'Starting Envoy ExternalProcessor "{service}" at {port}')
     await server.start()
+    metrics_server = await _start_metrics(metrics, metrics_port)
 
     async def server_graceful_shutdown():
         logger.info("Starting graceful shutdown...")
@@ -44,19 +142,92 @@ async def _serve(
         # grace period, the server won't accept new connections and allow
         # existing RPCs to continue within the grace period.
         await server.stop(grace_period)
+        if metrics_server is not None:
+            metrics_server.close()
+        # offloaded handlers run in pools the server owns
+        if isinstance(service, BaseExtProcService):
+            service.executors.shutdown()
 
     _cleanup.append(server_graceful_shutdown())
     await server.wait_for_termination()
 
 
+async def _serve_worker(
+    index: int,
+    readiness: WorkerReadiness,
+    service: EnvoyExtProcServicer,
+    port: int,
+    grace_period: int,
+    instrumentation: Optional[Union[str, Instrumentation]],
+    metrics_port: int = METRICS_PORT,
+) -> None:
+    # every worker listens on the same port; the kernel balances
+    # connections across them with SO_REUSEPORT
+    metrics = Metrics() if metrics_port else None
+    server = create_server(
+        service=service,
+        port=port,
+        instrumentation=instrumentation,
+        health=HealthService(readiness.ready),
+        options=[("grpc.so_reuseport", 1)],
+        metrics=metrics,
+    )
+    stop = Event()
+    get_event_loop().add_signal_handler(SIGTERM, stop.set)
+    await server.start()
+    # but each serves its own metrics, on its own port
+    metrics_server = await _start_metrics(metrics, metrics_port + index)
+    readiness.set(index)
+    logger.info(f'Worker {index} serving Envoy ExternalProcessor "{service}" at {port}')
+    await stop.wait()
+    logger.info(f"Worker {index} starting graceful shutdown...")
+    readiness.set(index, False)
+    await server.stop(grace_period)
+    if metrics_server is not None:
+        metrics_server.close()
+    if isinstance(service, BaseExtProcService):
+        service.executors.shutdown()
+
+
+def _work(index: int, readiness: WorkerReadiness, **kwargs: Any) -> None:
+    loop = new_event_loop()
+    try:
+        loop.run_until_complete(_serve_worker(index, readiness, **kwargs))
+    finally:
+        loop.close()
+
+
 def serve(
     service: EnvoyExtProcServicer = BaseExtProcService(),
     port: int = GRPC_PORT,
     grace_period: int = SHUTDOWN_GRACE_PERIOD,
+    instrumentation: Optional[Union[str, Instrumentation]] = None,
+    workers: int = WORKERS,
+    metrics_port: int = METRICS_PORT,
+    min_ready_workers: int = MIN_READY_WORKERS,
 ) -> None:
+    if workers > 1:
+        # pre-fork: the supervisor (this process) never starts gRPC itself
+        target = partial(
+            _work,
+            service=service,
+            port=port,
+            grace_period=grace_period,
+            instrumentation=instrumentation,
+            metrics_port=metrics_port,
+        )
+        Supervisor(target, workers, grace_period=grace_period, min_ready=min_ready_workers).run()
+        return
+
     loop = get_event_loop()
     try:
-        runc = _serve(service=service, port=port, grace_period=grace_period)
+        runc = _serve(
+            service=service,
+            port=port,
+            grace_period=grace_period,
+            instrumentation=instrumentation,
+            metrics_port=metrics_port,
+        )
         loop.run_until_complete(runc)
     finally:
         loop.run_until_complete(*_cleanup)
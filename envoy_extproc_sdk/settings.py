@@ -11,4 +11,99 @@ REVEAL_EXTPROC_CHAIN = (
 
 EXTPROCS_APPLIED_HEADER = environ.get("EXTPROCS_APPLIED_HEADER", "x-ext-procs-applied")
 
+# whether to ask envoy (with a mode_override) to skip phases a processor
+# doesn't handle; envoy only honors this with allow_mode_override set, and
+# replaces its whole processing_mode with the override, so only turn this on
+# where processors' PROCESSING_MODE matches the filter's processing_mode
+MODE_OVERRIDE = (
+    re.match(r"^([Tt](rue)?|[Yy](es)?)$", environ.get("MODE_OVERRIDE", "False")) is not None
+)
+
+# how to trace/time/log processing: ddtrace, logging, memory, or noop
+INSTRUMENTATION = environ.get("INSTRUMENTATION", "ddtrace")
+
+# head-based sampling of traced streams: the fraction of streams to trace,
+# whether to decide deterministically from the x-request-id (so that every
+# processor in a chain makes the same decision), and an upstream header
+# carrying a sampling priority to defer to (empty to ignore)
+TRACE_SAMPLE_RATE = float(environ.get("TRACE_SAMPLE_RATE", "1.0"))
+
+TRACE_SAMPLE_BY_REQUEST_ID = (
+    re.match(r"^([Tt](rue)?|[Yy](es)?)$", environ.get("TRACE_SAMPLE_BY_REQUEST_ID", "True"))
+    is not None
+)
+
+TRACE_SAMPLING_PRIORITY_HEADER = environ.get(
+    "TRACE_SAMPLING_PRIORITY_HEADER", "x-datadog-sampling-priority"
+)
+
+# pool sizes for offloaded handlers (see HandlerOptions); unset uses the
+# concurrent.futures defaults
+OFFLOAD_THREADS = int(environ["OFFLOAD_THREADS"]) if environ.get("OFFLOAD_THREADS") else None
+
+OFFLOAD_PROCESSES = int(environ["OFFLOAD_PROCESSES"]) if environ.get("OFFLOAD_PROCESSES") else None
+
+# the number of server processes to pre-fork (sharing the port); 1 serves
+# from this process
+WORKERS = int(environ.get("WORKERS", "1"))
+
+# the number of those workers that must be ready for health checks to
+# report SERVING (the others may be restarting)
+MIN_READY_WORKERS = int(environ.get("MIN_READY_WORKERS", "1"))
+
+# whether to register the ExternalProcessor through a generic RPC handler
+# that sends pre-serialized (bytes) responses as they are
+GENERIC_HANDLER = (
+    re.match(r"^([Tt](rue)?|[Yy](es)?)$", environ.get("GENERIC_HANDLER", "False")) is not None
+)
+
+# whether to decode body messages only as far as the body, passing handlers
+# a memoryview of it (implies GENERIC_HANDLER)
+LAZY_BODIES = re.match(r"^([Tt](rue)?|[Yy](es)?)$", environ.get("LAZY_BODIES", "False")) is not None
+
+# whether handlers get a stand in for their response, built only if it's
+# used (so responses to phases that change nothing aren't built at all);
+# the stand in isn't a message, so can't be embedded in or copied into one
+LAZY_RESPONSES = (
+    re.match(r"^([Tt](rue)?|[Yy](es)?)$", environ.get("LAZY_RESPONSES", "False")) is not None
+)
+
+# seconds handlers have to respond (0 for no deadline), unless their
+# options say otherwise; keep it below the filter's message_timeout
+HANDLER_DEADLINE = float(environ.get("HANDLER_DEADLINE", "0")) or None
+
+# what to respond when a handler runs past its deadline: continue, error
+# (a 504), or skip (the request's remaining phases)
+DEADLINE_FALLBACK = environ.get("DEADLINE_FALLBACK", "continue")
+
+# server-wide limits on the streams open and the phases being handled at
+# once (0 for no limit), past which work is shed instead of queued
+MAX_STREAMS = int(environ.get("MAX_STREAMS", "0"))
+
+MAX_PHASES = int(environ.get("MAX_PHASES", "0"))
+
+# whether to also limit each phase's concurrency adaptively, from its
+# handlers' latency (see AdaptiveLimit)
+ADAPTIVE_CONCURRENCY = (
+    re.match(r"^([Tt](rue)?|[Yy](es)?)$", environ.get("ADAPTIVE_CONCURRENCY", "False")) is not None
+)
+
+# what to respond to work shed while overloaded: continue, or error (a 503)
+OVERLOAD_FALLBACK = environ.get("OVERLOAD_FALLBACK", "continue")
+
+# how many phase handlers to run at once, in priority order (header phases
+# ahead of bodies; see PhaseScheduler); 0 runs them as messages arrive
+SCHEDULER_CONCURRENCY = int(environ.get("SCHEDULER_CONCURRENCY", "0"))
+
+# the port to serve metrics on, in the Prometheus text format (0 for none);
+# with several WORKERS, each serves its own on the ports that follow
+METRICS_PORT = int(environ.get("METRICS_PORT", "0"))
+
+# the JSON parser for request.body_json: json, orjson, or auto (orjson if
+# it's installed)
+JSON_BACKEND = environ.get("JSON_BACKEND", "auto")
+
+# the largest body (in bytes) the request.body_... helpers will parse
+BODY_PARSE_LIMIT = int(environ.get("BODY_PARSE_LIMIT", str(8 * 1024 * 1024)))
+
 ENVOY_SERVICE_NAME = "envoy.service.ext_proc.v3.ExternalProcessor"
@@ -1,5 +1,6 @@
 from .extproc import AsEnvoyExtProc  # noqa: F401
 from .extproc import envoy_extproc_cycle  # noqa: F401
 from .http import envoy_body  # noqa: F401
+from .http import envoy_body_chunks  # noqa: F401
 from .http import envoy_headers  # noqa: F401
 from .http import envoy_set_headers_to_dict  # noqa: F401
@@ -1,4 +1,5 @@
-from typing import AsyncGenerator
+from itertools import chain
+from typing import AsyncGenerator, Iterable, Union
 
 from ..util.envoy import ext_api
 
@@ -24,24 +25,43 @@ async def envoy_extproc_cycle(
 
 
 class AsEnvoyExtProc:
+    """
+    Iterates ProcessingRequests as envoy would send them for a request,
+    to pass to Process. Either body can be an HttpBody, or an iterable of
+    HttpBody chunks as envoy sends in STREAMED mode (see envoy_body_chunks);
+    an iterable is consumed lazily, and so can only be processed once.
+    """
+
     def __init__(
         self,
         request_headers: ext_api.HttpHeaders = ext_api.HttpHeaders(),
-        request_body: ext_api.HttpBody = ext_api.HttpBody(),
+        request_body: Union[ext_api.HttpBody, Iterable[ext_api.HttpBody]] = ext_api.HttpBody(),
         request_trailers: ext_api.HttpTrailers = ext_api.HttpTrailers(),
         response_headers: ext_api.HttpHeaders = ext_api.HttpHeaders(),
-        response_body: ext_api.HttpBody = ext_api.HttpBody(),
+        response_body: Union[ext_api.HttpBody, Iterable[ext_api.HttpBody]] = ext_api.HttpBody(),
         response_trailers: ext_api.HttpTrailers = ext_api.HttpTrailers(),
     ) -> None:
-        self.messages = [
-            ext_api.ProcessingRequest(request_headers=request_headers),
-            ext_api.ProcessingRequest(request_body=request_body),
-            ext_api.ProcessingRequest(request_trailers=request_trailers),
-            ext_api.ProcessingRequest(response_headers=response_headers),
-            ext_api.ProcessingRequest(response_body=response_body),
-            ext_api.ProcessingRequest(response_trailers=response_trailers),
+        messages = [
+            [ext_api.ProcessingRequest(request_headers=request_headers)],
+            body_messages("request_body", request_body),
+            [ext_api.ProcessingRequest(request_trailers=request_trailers)],
+            [ext_api.ProcessingRequest(response_headers=response_headers)],
+            body_messages("response_body", response_body),
+            [ext_api.ProcessingRequest(response_trailers=response_trailers)],
         ]
+        if all(isinstance(phase, list) for phase in messages):
+            self.messages = list(chain.from_iterable(messages))
+        else:
+            self.messages = chain.from_iterable(messages)
 
     async def __aiter__(self) -> AsyncGenerator[ext_api.ProcessingRequest, None]:
         for msg in self.messages:
             yield msg
+
+
+def body_messages(
+    phase: str, body: Union[ext_api.HttpBody, Iterable[ext_api.HttpBody]]
+) -> Iterable[ext_api.ProcessingRequest]:
+    if isinstance(body, ext_api.HttpBody):
+        return [ext_api.ProcessingRequest(**{phase: body})]
+    return (ext_api.ProcessingRequest(**{phase: chunk}) for chunk in body)
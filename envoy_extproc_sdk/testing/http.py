@@ -1,5 +1,5 @@
 from json import dumps
-from typing import Dict, List, Tuple, Union
+from typing import Dict, Iterable, Iterator, List, Tuple, Union
 
 from ..util.envoy import EnvoyHeaderMap, EnvoyHeaderValue, ext_api
 
@@ -36,6 +36,29 @@ def envoy_body(body: Union[bytes, int, str, list, dict] = None) -> ext_api.HttpB
     raise ValueError(f"Unparseable body type {type(body)}")
 
 
+def envoy_body_chunks(
+    body: Union[bytes, Iterable[bytes]], chunk_size: int = 64 * 1024
+) -> Iterator[ext_api.HttpBody]:
+    """
+    Lazily create envoy-typed body chunks, as envoy sends a body in STREAMED
+    mode, with end_of_stream set on the last. body is either bytes (split into
+    chunk_size chunks) or an iterable of byte strings, each sent as a chunk
+    (so a generator makes arbitrarily large bodies in constant memory).
+    """
+    if isinstance(body, bytes):
+        view = memoryview(body)
+        body = (view[i : i + chunk_size].tobytes() for i in range(0, len(body), chunk_size))
+    chunks = iter(body)
+    chunk = next(chunks, None)
+    if chunk is None:
+        yield ext_api.HttpBody(end_of_stream=True)
+        return
+    for following in chunks:
+        yield ext_api.HttpBody(body=chunk)
+        chunk = following
+    yield ext_api.HttpBody(body=chunk, end_of_stream=True)
+
+
 def envoy_set_headers_to_dict(response: ext_api.CommonResponse) -> Dict[str, str]:
     headers = {}
     for header_option in response.header_mutation.set_headers:
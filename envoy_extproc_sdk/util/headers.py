@@ -0,0 +1,160 @@
+from __future__ import annotations
+
+from contextvars import ContextVar
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Tuple,
+    Union,
+)
+
+from .envoy import ext_api
+
+# the view of the headers being processed in the current (asyncio) task,
+# which is how helpers that are only handed the raw HttpHeaders find it
+_current_view: ContextVar[Optional[HeaderView]] = ContextVar("extproc_headers", default=None)
+
+
+class HeaderView:
+    """
+    Read-only, indexed view of an envoy HttpHeaders message. The index
+    (header name -> values, in the order received) is built on the first
+    lookup, after which lookups are O(1) however many headers there are.
+    Names are matched exactly; envoy sends them lower cased.
+
+    The service builds one of these per header phase, stores it on the
+    request context (`request.headers`), and makes it "current" so the
+    static header helpers (`get_header` and friends) use it too.
+    """
+
+    __slots__ = ("message", "_index")
+
+    def __init__(self, message: ext_api.HttpHeaders) -> None:
+        self.message = message
+        self._index: Optional[Dict[str, List[str]]] = None
+
+    def __repr__(self) -> str:
+        return f"HeaderView({dict(self.items())})"
+
+    @property
+    def index(self) -> Dict[str, List[str]]:
+        if self._index is None:
+            index: Dict[str, List[str]] = {}
+            for header in self.message.headers.headers:
+                values = index.get(header.key)
+                if values is None:
+                    index[header.key] = [header.value]
+                else:
+                    values.append(header.value)
+            self._index = index
+        return self._index
+
+    def get(self, name: str, default: Optional[str] = None) -> Optional[str]:
+        """the first value of a header, or default if it wasn't sent"""
+        values = self.index.get(name)
+        return values[0] if values else default
+
+    def get_last(self, name: str, default: Optional[str] = None) -> Optional[str]:
+        """the last value of a header, or default if it wasn't sent"""
+        values = self.index.get(name)
+        return values[-1] if values else default
+
+    def get_all(self, name: str) -> List[str]:
+        """all values of a header, in the order received"""
+        return self.index.get(name, [])
+
+    def __contains__(self, name: object) -> bool:
+        return name in self.index
+
+    def __len__(self) -> int:
+        return len(self.message.headers.headers)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.index)
+
+    def items(self) -> Iterator[Tuple[str, str]]:
+        """(name, value) pairs, one for each value of each header"""
+        for name, values in self.index.items():
+            for value in values:
+                yield name, value
+
+    def activate(self) -> HeaderView:
+        """make this the current view, for the current task"""
+        _current_view.set(self)
+        return self
+
+    @staticmethod
+    def cached(headers: Union[ext_api.HttpHeaders, HeaderView]) -> Optional[HeaderView]:
+        """the view for headers if there is one, without building one"""
+        if isinstance(headers, HeaderView):
+            return headers
+        view = _current_view.get()
+        if (view is not None) and (view.message is headers):
+            return view
+        return None
+
+    @staticmethod
+    def of(headers: Union[ext_api.HttpHeaders, HeaderView]) -> HeaderView:
+        """the view for headers, building one if there isn't one"""
+        view = HeaderView.cached(headers)
+        return HeaderView(headers) if view is None else view
+
+
+HeaderSpec = Mapping[str, Union[str, Tuple[str, Optional[Callable[[str], Any]]]]]
+
+
+class HeaderExtractor:
+    """
+    Pulls a declared set of headers into named fields in one pass over
+    the header list. Declarations map a header name to the field to store
+    its value at, optionally with a conversion, as in
+
+        {"x-tenant-id": "tenant", "content-length": ("content_length", int)}
+
+    Headers that weren't sent (or whose values can't be converted) are
+    extracted as None. As with get_headers, a repeated header extracts
+    its last value.
+    """
+
+    __slots__ = ("fields", "targets")
+
+    def __init__(self, spec: Optional[HeaderSpec] = None) -> None:
+        self.targets: Dict[str, Tuple[str, Optional[Callable[[str], Any]]]] = {}
+        for name, target in (spec or {}).items():
+            field, convert = (target, None) if isinstance(target, str) else target
+            self.targets[name.lower()] = (field, convert)
+        self.fields = tuple({field: None for field, _ in self.targets.values()})
+
+    def __repr__(self) -> str:
+        return f"HeaderExtractor({self.targets})"
+
+    def merge(self, spec: Optional[HeaderSpec]) -> HeaderExtractor:
+        """a new extractor with spec's declarations added (or overriding)"""
+        merged = HeaderExtractor()
+        merged.targets = {**self.targets, **HeaderExtractor(spec).targets}
+        merged.fields = tuple({field: None for field, _ in merged.targets.values()})
+        return merged
+
+    def __call__(self, headers: Union[ext_api.HttpHeaders, HeaderView]) -> Dict[str, Any]:
+        if isinstance(headers, HeaderView):
+            headers = headers.message
+        results: Dict[str, Any] = dict.fromkeys(self.fields)
+        targets = self.targets
+        for header in headers.headers.headers:
+            target = targets.get(header.key)
+            if target is None:
+                continue
+            field, convert = target
+            if convert is None:
+                results[field] = header.value
+            else:
+                try:
+                    results[field] = convert(header.value)
+                except (TypeError, ValueError):
+                    results[field] = None
+        return results
@@ -0,0 +1,199 @@
+from __future__ import annotations
+
+from typing import Any, Callable, Iterator, Optional, Tuple, Union
+
+from .envoy import ext_api
+
+# ProcessingRequest field numbers of the body phases
+BODY_FIELDS = {4: "request_body", 5: "response_body"}
+
+# wire types (https://protobuf.dev/programming-guides/encoding/)
+VARINT, FIXED64, LENGTH_DELIMITED, FIXED32 = 0, 1, 2, 5
+
+
+def _varint(raw: memoryview, offset: int) -> Tuple[int, int]:
+    """decode the varint at offset, returning it and the offset after it"""
+    value, shift = 0, 0
+    while True:
+        byte = raw[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+def _fields(raw: memoryview, start: int, end: int) -> Iterator[Tuple[int, int, int, int]]:
+    """
+    Walk the fields of the message in raw[start:end], yielding each as
+    (number, wire type, value, offset): for length delimited fields, value
+    is the end of the field's data and offset its start; otherwise value
+    is the (integer) value, and offset the end of the field.
+    """
+    offset = start
+    while offset < end:
+        tag, offset = _varint(raw, offset)
+        number, wire_type = tag >> 3, tag & 0x07
+        if wire_type == VARINT:
+            value, offset = _varint(raw, offset)
+            yield number, wire_type, value, offset
+        elif wire_type == LENGTH_DELIMITED:
+            length, offset = _varint(raw, offset)
+            yield number, wire_type, offset + length, offset
+            offset += length
+        elif wire_type == FIXED64:
+            offset += 8
+            yield number, wire_type, 0, offset
+        elif wire_type == FIXED32:
+            offset += 4
+            yield number, wire_type, 0, offset
+        else:
+            raise ValueError(f"Unsupported wire type {wire_type} in ProcessingRequest")
+
+
+def _http_body(body: bytes, end_of_stream: bool) -> ext_api.HttpBody:
+    return ext_api.HttpBody(body=body, end_of_stream=end_of_stream)
+
+
+class LazyHttpBody:
+    """
+    Read-only stand in for an envoy HttpBody message whose `body` is a
+    memoryview of the received message, so (large) bodies are never
+    copied out of it. Use `bytes(body.body)` where a copy is needed (say,
+    to put the body in a response). Pickles (for handlers offloaded to
+    processes) as an HttpBody.
+    """
+
+    __slots__ = ("body", "end_of_stream")
+
+    def __init__(self, body: memoryview, end_of_stream: bool = False) -> None:
+        self.body = body
+        self.end_of_stream = end_of_stream
+
+    def __repr__(self) -> str:
+        return f"LazyHttpBody({len(self.body)} bytes, end_of_stream={self.end_of_stream})"
+
+    def __reduce__(self) -> Tuple[Any, ...]:
+        return (_http_body, (bytes(self.body), self.end_of_stream))
+
+    def message(self) -> ext_api.HttpBody:
+        """an HttpBody with (a copy of) this body"""
+        return _http_body(bytes(self.body), self.end_of_stream)
+
+
+class LazyProcessingRequest:
+    """
+    A body ProcessingRequest, decoded only as far as the body: the phase
+    and a LazyHttpBody over the received bytes. Anything else (metadata,
+    attributes) decodes the whole message the first time it's used.
+    """
+
+    __slots__ = ("raw", "phase", "body", "_message")
+
+    # messages smaller than this are cheaper to decode in full
+    MIN_SIZE = 16 * 1024
+
+    def __init__(self, raw: bytes, phase: str, body: LazyHttpBody) -> None:
+        self.raw = raw
+        self.phase = phase
+        self.body = body
+        self._message: Optional[ext_api.ProcessingRequest] = None
+
+    def __repr__(self) -> str:
+        return f"LazyProcessingRequest({self.phase}, {self.body})"
+
+    @classmethod
+    def FromString(cls, raw: bytes) -> Union[LazyProcessingRequest, ext_api.ProcessingRequest]:
+        """Deserialize a ProcessingRequest, lazily if it is for a body
+        phase (use as a gRPC request deserializer)"""
+        if len(raw) < cls.MIN_SIZE:
+            return ext_api.ProcessingRequest.FromString(raw)
+        view = memoryview(raw)
+        for number, wire_type, end, start in _fields(view, 0, len(view)):
+            phase = BODY_FIELDS.get(number)
+            if (phase is not None) and (wire_type == LENGTH_DELIMITED):
+                return cls(raw, phase, cls.body_of(view, start, end))
+        return ext_api.ProcessingRequest.FromString(raw)
+
+    @staticmethod
+    def body_of(view: memoryview, start: int, end: int) -> LazyHttpBody:
+        """the HttpBody in view[start:end], without copying the body"""
+        body, end_of_stream = view[0:0], False
+        for number, wire_type, value, offset in _fields(view, start, end):
+            if (number == 1) and (wire_type == LENGTH_DELIMITED):
+                body = view[offset:value]
+            elif (number == 2) and (wire_type == VARINT):
+                end_of_stream = bool(value)
+        return LazyHttpBody(body, end_of_stream)
+
+    @property
+    def message(self) -> ext_api.ProcessingRequest:
+        """the fully decoded ProcessingRequest"""
+        if self._message is None:
+            self._message = ext_api.ProcessingRequest.FromString(self.raw)
+        return self._message
+
+    def WhichOneof(self, name: str) -> Optional[str]:
+        if name == "request":
+            return self.phase
+        return self.message.WhichOneof(name)
+
+    def HasField(self, name: str) -> bool:
+        if name == self.phase:
+            return True
+        return self.message.HasField(name)
+
+    def __getattr__(self, name: str) -> Any:
+        # only called for what isn't a slot: the phase, or another field
+        if name == self.phase:
+            return self.body
+        return getattr(self.message, name)
+
+
+class LazyResponse:
+    """
+    Stands in for the response (a CommonResponse, or a HeaderMutation for
+    trailers) passed to a phase handler, building the message only when
+    a handler first uses it. A handler that returns it unused has changed
+    nothing, so the service can send a shared (prebuilt) "continue"
+    response instead. It passes isinstance checks as the message type,
+    and pickles (for handlers offloaded to processes) as the message.
+    """
+
+    __slots__ = ("factory", "message")
+
+    def __init__(self, factory: Callable[[], Any]) -> None:
+        object.__setattr__(self, "factory", factory)
+        object.__setattr__(self, "message", None)
+
+    @property  # type: ignore[misc]
+    def __class__(self) -> Any:
+        return self.factory
+
+    def materialize(self) -> Any:
+        """the response message (built now, if it wasn't already)"""
+        message = self.message
+        if message is None:
+            message = self.factory()
+            object.__setattr__(self, "message", message)
+        return message
+
+    def __getattr__(self, name: str) -> Any:
+        # only called for what isn't a slot: the message's fields and methods
+        return getattr(self.materialize(), name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        setattr(self.materialize(), name, value)
+
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, LazyResponse):
+            other = other.materialize()
+        return self.materialize() == other
+
+    def __repr__(self) -> str:
+        if self.message is None:
+            return f"LazyResponse({self.factory.__name__}, unused)"
+        return f"LazyResponse({self.factory.__name__}, {self.message})"
+
+    def __reduce__(self) -> Tuple[Any, ...]:
+        return self.materialize().__reduce__()
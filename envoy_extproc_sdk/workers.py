@@ -0,0 +1,152 @@
+from logging import getLogger
+from multiprocessing import get_context
+from multiprocessing.connection import wait
+from multiprocessing.process import BaseProcess
+from signal import SIG_DFL, SIG_IGN, SIGINT, signal, SIGTERM
+from time import monotonic, sleep
+from typing import Any, Callable, List, Optional
+
+from .settings import MIN_READY_WORKERS, SHUTDOWN_GRACE_PERIOD
+
+logger = getLogger(__name__)
+
+
+class WorkerReadiness:
+    """
+    Readiness flags for a set of worker processes, in shared memory so
+    that every worker (and the supervisor) sees every other's. Workers
+    mark themselves ready once serving and not ready when they start to
+    shut down; the supervisor marks a worker not ready when it exits.
+    The set is ready while at least min_ready workers are, so one worker
+    restarting doesn't take the others out of rotation.
+    """
+
+    def __init__(
+        self, workers: int, context: Any = None, min_ready: int = MIN_READY_WORKERS
+    ) -> None:
+        if not 1 <= min_ready <= workers:
+            raise ValueError(f"Can't require {min_ready} of {workers} workers to be ready")
+        context = context or get_context("fork")
+        self.flags = context.RawArray("b", workers)
+        self.min_ready = min_ready
+
+    def __repr__(self) -> str:
+        return f"WorkerReadiness({list(self.flags)})"
+
+    def __len__(self) -> int:
+        return len(self.flags)
+
+    def set(self, index: int, ready: bool = True) -> None:
+        self.flags[index] = 1 if ready else 0
+
+    def count(self) -> int:
+        """the number of ready workers"""
+        return sum(self.flags)
+
+    def ready(self) -> bool:
+        """whether at least min_ready workers are ready"""
+        return self.count() >= self.min_ready
+
+
+class Supervisor:
+    """
+    Pre-forks and supervises worker processes. Each worker calls
+
+        target(index, readiness)
+
+    in a forked child, where index is the worker's slot (0 to workers - 1)
+    and readiness the WorkerReadiness shared by all of them. Workers that
+    exit are restarted in the same slot (no faster than once every
+    restart_delay seconds, so a worker that can't start doesn't spin).
+
+    SIGTERM or SIGINT to the supervisor stops it: SIGTERM is sent on to
+    every worker, which have grace_period seconds (and a little) to exit
+    before they are killed. Workers ignore SIGINT, leaving shutdown to the
+    supervisor even when a terminal signals the whole process group.
+    """
+
+    def __init__(
+        self,
+        target: Callable[[int, WorkerReadiness], None],
+        workers: int,
+        grace_period: int = SHUTDOWN_GRACE_PERIOD,
+        restart_delay: float = 1.0,
+        min_ready: int = MIN_READY_WORKERS,
+    ) -> None:
+        if workers < 1:
+            raise ValueError(f"Can't supervise {workers} workers")
+        self.target = target
+        self.workers = workers
+        self.grace_period = grace_period
+        self.restart_delay = restart_delay
+        self.context = get_context("fork")
+        self.readiness = WorkerReadiness(workers, self.context, min_ready)
+        self.processes: List[Optional[BaseProcess]] = [None] * workers
+        self.started: List[float] = [0.0] * workers
+        self.restarts = 0
+        self.stopping = False
+
+    def __repr__(self) -> str:
+        return f"Supervisor(workers={self.workers}, readiness={self.readiness})"
+
+    def start(self, index: int) -> None:
+        process = self.context.Process(
+            target=self._work, args=(index,), name=f"extproc-worker-{index}"
+        )
+        process.start()
+        logger.info(f"Started worker {index} (pid {process.pid})")
+        self.processes[index] = process
+        self.started[index] = monotonic()
+
+    def _work(self, index: int) -> None:
+        signal(SIGINT, SIG_IGN)
+        signal(SIGTERM, SIG_DFL)
+        self.target(index, self.readiness)
+
+    def stop(self, *args: Any) -> None:
+        """stop supervising (and stop the workers); a signal handler"""
+        self.stopping = True
+
+    def run(self) -> None:
+        """start the workers, and supervise them until stopped"""
+        handlers = {signum: signal(signum, self.stop) for signum in (SIGINT, SIGTERM)}
+        try:
+            for index in range(self.workers):
+                self.start(index)
+            while not self.stopping:
+                wait([p.sentinel for p in self.processes if p is not None], timeout=0.5)
+                for index, process in enumerate(self.processes):
+                    if self.stopping:
+                        break
+                    if (process is None) or process.is_alive():
+                        continue
+                    self.readiness.set(index, False)
+                    logger.warning(
+                        f"Worker {index} (pid {process.pid}) exited with {process.exitcode}"
+                    )
+                    process.close()
+                    wait_for = self.started[index] + self.restart_delay - monotonic()
+                    if wait_for > 0:
+                        sleep(wait_for)
+                    self.restarts += 1
+                    self.start(index)
+        finally:
+            self.shutdown()
+            for signum, handler in handlers.items():
+                signal(signum, handler)
+
+    def shutdown(self) -> None:
+        """SIGTERM the workers, killing any that outlast the grace period"""
+        logger.info("Stopping workers...")
+        running = [p for p in self.processes if (p is not None) and p.is_alive()]
+        for process in running:
+            process.terminate()
+        deadline = monotonic() + self.grace_period + 1.0
+        for process in running:
+            process.join(max(0.0, deadline - monotonic()))
+            if process.is_alive():
+                logger.warning(f"Killing worker pid {process.pid}")
+                process.kill()
+                process.join()
+        for index in range(self.workers):
+            self.readiness.set(index, False)
@@ -1,6 +1,9 @@
+from .chained import ChainedExamples  # noqa: F401
 from .context import CtxExtProcService  # noqa: F401
 from .decorated import DecoratedExtProcService  # noqa: F401
 from .digest import DigestExtProcService  # noqa: F401
 from .echo import EchoExtProcService  # noqa: F401,E402
+from .streamed import StreamedDigestExtProcService  # noqa: F401
+from .tenant import TenantCheckExtProcService  # noqa: F401
 from .timer import TimerExtProcService  # noqa: F401
 from .trivial import TrivialExtProcService  # noqa: F401
@@ -0,0 +1,27 @@
+# ChainedExamples
+#
+# The trivial, timer, and digest examples run in a single ExternalProcessor,
+# as one filter (and one gRPC stream per request) instead of three. Requests
+# see the same mutations, and responses the same x-ext-procs-applied chain,
+# as with the three filters configured separately.
+
+from envoy_extproc_sdk import ChainedExtProcService, serve
+
+from .digest import DigestExtProcService
+from .timer import TimerExtProcService
+from .trivial import TrivialExtProcService
+
+ChainedExamples = ChainedExtProcService(
+    [TrivialExtProcService(), TimerExtProcService(), DigestExtProcService()],
+    name="ChainedExamples",
+)
+
+
+if __name__ == "__main__":
+
+    import logging
+
+    FORMAT = "%(asctime)s : %(levelname)s : %(message)s"
+    logging.basicConfig(level=logging.INFO, format=FORMAT, handlers=[logging.StreamHandler()])
+
+    serve(service=ChainedExamples)
@@ -2,16 +2,19 @@
 #
 # TBD
 
-from json import loads
 from typing import Dict, Union
 
 from envoy_extproc_sdk import BaseExtProcService, ext_api, serve
+from envoy_extproc_sdk.context import RequestContext
 from grpc import ServicerContext
 
 CONTEXT_ID_HEADER = "x-context-id"
 
 
 class CtxExtProcService(BaseExtProcService):
+
+    REQUEST_HEADERS = {CONTEXT_ID_HEADER: "cid"}
+
     def process_request_headers(
         self,
         headers: ext_api.HttpHeaders,
@@ -19,7 +22,6 @@ class CtxExtProcService(BaseExtProcService):
         request: Dict,
         response: ext_api.CommonResponse,
     ) -> ext_api.CommonResponse:
-        request["cid"] = self.get_header(headers, CONTEXT_ID_HEADER)
         self.add_header(response, CONTEXT_ID_HEADER, request["cid"])
         return response
 
@@ -27,11 +29,11 @@ class CtxExtProcService(BaseExtProcService):
         self,
         body: ext_api.HttpBody,
         context: ServicerContext,
-        request: Dict,
+        request: RequestContext,
         response: ext_api.CommonResponse,
     ) -> ext_api.CommonResponse:
         if request.get("cid", None):
-            cid = body.body.decode()
+            cid = request.body_text()
             assert cid == request["cid"]
         return response
 
@@ -39,11 +41,11 @@ class CtxExtProcService(BaseExtProcService):
         self,
         body: ext_api.HttpBody,
         context: ServicerContext,
-        request: Dict,
+        request: RequestContext,
         response: ext_api.CommonResponse,
     ) -> ext_api.CommonResponse:
         if request.get("cid", None):
-            data = loads(body.body.decode())
+            data = request.body_json()
             path = data["path"]
             assert path == request["path"]
             self.add_header(response, CONTEXT_ID_HEADER, request["cid"])
@@ -24,7 +24,10 @@ from .digest import digest_headers
 REQUEST_DIGEST_HEADER = "x-request-digest"
 TENANT_ID_HEADER = "x-tenant-id"
 
-DecoratedExtProcService = BaseExtProcService(name="DecoratedExtProcService")
+DecoratedExtProcService = BaseExtProcService(
+    name="DecoratedExtProcService",
+    request_headers={TENANT_ID_HEADER: "tenant"},
+)
 
 
 @DecoratedExtProcService.process("request_headers")
@@ -34,7 +37,6 @@ def start_digest(
     request: Dict,
     response: ext_api.CommonResponse,
 ) -> ext_api.CommonResponse:
-    request["tenant"] = BaseExtProcService.get_header(headers, TENANT_ID_HEADER)
     if not request["tenant"]:
         request["tenant"] = "unknown"
     request["digest"] = digest_headers(headers, request)
@@ -6,16 +6,24 @@
 # hex form of that digest to upstreams and back to the caller
 # via a header `x-request-digest`. This is another example of
 # storing an _object_ in the request context, like the timer
-# service TimerExtProcService.
+# service TimerExtProcService. Hashing a large body is CPU-bound
+# work, so bodies over 64 KiB are hashed in the server's thread
+# pool instead of blocking every other stream on the event loop.
 
 from hashlib import sha256
 from typing import Any, Dict
 
-from envoy_extproc_sdk import BaseExtProcService, ext_api, serve
+from envoy_extproc_sdk import (
+    BaseExtProcService,
+    ext_api,
+    handler_options,
+    serve,
+)
 from grpc import ServicerContext
 
 REQUEST_DIGEST_HEADER = "x-request-digest"
 TENANT_ID_HEADER = "x-tenant-id"
+OFFLOAD_BODY_BYTES = 64 * 1024
 
 
 def digest_headers(headers: ext_api.HttpHeaders, request: Dict) -> Any:
@@ -27,6 +35,9 @@ def digest_headers(headers: ext_api.HttpHeaders, request: Dict) -> Any:
 
 
 class DigestExtProcService(BaseExtProcService):
+
+    REQUEST_HEADERS = {TENANT_ID_HEADER: "tenant"}
+
     def process_request_headers(
         self,
         headers: ext_api.HttpHeaders,
@@ -35,7 +46,6 @@ class DigestExtProcService(BaseExtProcService):
         response: ext_api.CommonResponse,
     ) -> ext_api.CommonResponse:
 
-        request["tenant"] = self.get_header(headers, TENANT_ID_HEADER)
         if not request["tenant"]:
             request["tenant"] = "unknown"
 
@@ -49,6 +59,7 @@ class DigestExtProcService(BaseExtProcService):
 
         return response
 
+    @handler_options(offload="thread", offload_threshold=OFFLOAD_BODY_BYTES)
     def process_request_body(
         self,
         body: ext_api.HttpBody,
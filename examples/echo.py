@@ -54,7 +54,7 @@ class EchoExtProcService(BaseExtProcService):
             return response
 
         response = self.form_immediate_response(
-            EnvoyHttpStatusCode.OK, request["request_headers"], body.body
+            EnvoyHttpStatusCode.OK, request["request_headers"], bytes(body.body)
         )
         raise StopRequestProcessing(response=response)
 
@@ -0,0 +1,75 @@
+# StreamedDigestExtProcService
+#
+# An incremental DigestExtProcService, for envoy's STREAMED request body
+# mode: the request body is hashed chunk by chunk as envoy streams it,
+# so neither envoy nor this processor ever holds the whole body, and
+# hashing starts with the first chunk instead of after the last. The
+# processor only keeps the digest's state, whatever the body's size.
+#
+# In STREAMED mode the request headers have gone upstream before the
+# body is seen, so the digest can't be sent upstream as DigestExtProcService
+# does; it is returned to the caller in the `x-request-digest` response
+# header. Configure the filter with
+#
+#   processing_mode:
+#     request_header_mode: SEND
+#     response_header_mode: SEND
+#     request_body_mode: STREAMED
+
+from typing import Dict
+
+from envoy_extproc_sdk import BaseExtProcService, ext_api, serve
+from grpc import ServicerContext
+
+from .digest import digest_headers, REQUEST_DIGEST_HEADER, TENANT_ID_HEADER
+
+
+class StreamedDigestExtProcService(BaseExtProcService):
+
+    REQUEST_HEADERS = {TENANT_ID_HEADER: "tenant"}
+
+    def process_request_headers(
+        self,
+        headers: ext_api.HttpHeaders,
+        context: ServicerContext,
+        request: Dict,
+        response: ext_api.CommonResponse,
+    ) -> ext_api.CommonResponse:
+
+        if not request["tenant"]:
+            request["tenant"] = "unknown"
+
+        request["digest"] = digest_headers(headers, request)
+        return response
+
+    def process_request_body_chunk(
+        self,
+        chunk: ext_api.HttpBody,
+        context: ServicerContext,
+        request: Dict,
+        response: ext_api.CommonResponse,
+    ) -> ext_api.CommonResponse:
+
+        request["digest"].update(chunk.body)
+        return response
+
+    def process_response_headers(
+        self,
+        headers: ext_api.HttpHeaders,
+        context: ServicerContext,
+        request: Dict,
+        response: ext_api.CommonResponse,
+    ) -> ext_api.CommonResponse:
+
+        self.add_header(response, REQUEST_DIGEST_HEADER, request["digest"].hexdigest())
+        return response
+
+
+if __name__ == "__main__":
+
+    import logging
+
+    FORMAT = "%(asctime)s : %(levelname)s : %(message)s"
+    logging.basicConfig(level=logging.INFO, format=FORMAT, handlers=[logging.StreamHandler()])
+
+    serve(service=StreamedDigestExtProcService())
@@ -0,0 +1,80 @@
+# TenantCheckExtProcService
+#
+# Rejects (403) requests whose JSON body names a different `tenant_id`
+# than the `x-tenant-id` header, checking the body as envoy streams it:
+# a JsonFieldExtractor scans the chunks for just that field, so the
+# decision is made at the chunk where `tenant_id` appears, without
+# buffering or parsing the rest of the body (the remaining chunks are
+# passed straight through). Configure the filter with
+#
+#   processing_mode:
+#     request_header_mode: SEND
+#     request_body_mode: STREAMED
+
+from typing import Dict
+
+from envoy_extproc_sdk import (
+    BaseExtProcService,
+    ext_api,
+    serve,
+    StopRequestProcessing,
+)
+from envoy_extproc_sdk.jsonpath import JsonFieldExtractor
+from envoy_extproc_sdk.util.envoy import EnvoyHttpStatusCode
+from grpc import ServicerContext
+
+from .digest import TENANT_ID_HEADER
+
+TENANT_ID_FIELD = "tenant_id"
+
+
+class TenantCheckExtProcService(BaseExtProcService):
+
+    REQUEST_HEADERS = {TENANT_ID_HEADER: "tenant"}
+
+    def process_request_headers(
+        self,
+        headers: ext_api.HttpHeaders,
+        context: ServicerContext,
+        request: Dict,
+        response: ext_api.CommonResponse,
+    ) -> ext_api.CommonResponse:
+
+        request["fields"] = JsonFieldExtractor([TENANT_ID_FIELD])
+        return response
+
+    def process_request_body_chunk(
+        self,
+        chunk: ext_api.HttpBody,
+        context: ServicerContext,
+        request: Dict,
+        response: ext_api.CommonResponse,
+    ) -> ext_api.CommonResponse:
+
+        fields = request["fields"]
+        if fields.done:
+            return response  # already decided
+
+        try:
+            if not fields.feed(chunk):
+                return response
+        except ValueError:
+            return response  # not JSON; not ours to judge
+
+        tenant = fields.found.get(TENANT_ID_FIELD)
+        if (tenant is not None) and request["tenant"] and (tenant != request["tenant"]):
+            response = self.form_immediate_response(
+                EnvoyHttpStatusCode.Forbidden, {}, f"{TENANT_ID_FIELD} doesn't match".encode()
+            )
+            raise StopRequestProcessing(response=response, reason="tenant mismatch")
+        return response
+
+
+if __name__ == "__main__":
+
+    import logging
+
+    FORMAT = "%(asctime)s : %(levelname)s : %(message)s"
+    logging.basicConfig(level=logging.INFO, format=FORMAT, handlers=[logging.StreamHandler()])
+
+    serve(service=TenantCheckExtProcService())
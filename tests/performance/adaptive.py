@@ -0,0 +1,105 @@
+# Adaptive concurrency limiting under a step change in handler cost
+#
+# Simulates a processor whose request headers handler calls a backend
+# that can serve CAPACITY calls at once, taking COST seconds each. The
+# cost steps up (the backend slows down) and back, while streams arrive
+# at a steady RATE: once slowed, the backend can serve only half of them.
+# Without a limit, work queues without bound and every request's latency
+# grows past envoy's message_timeout; with an adaptive limit (see
+# AdaptiveLimit) the excess is shed (and continued, unprocessed), and the
+# requests processed keep their latency. Reports, for each interval, the
+# requests processed and shed, the processed requests' latency (p50/p99),
+# how many took longer than TIMEOUT, and the limit.
+#
+#   DD_TRACE_ENABLED=false python -m tests.performance.adaptive
+
+import asyncio
+from statistics import quantiles
+from time import perf_counter_ns
+from typing import Callable, Dict, List, Optional, Tuple
+
+from envoy_extproc_sdk import BaseExtProcService, ext_api
+from envoy_extproc_sdk.limits import AdaptiveLimit, AdmissionController
+from envoy_extproc_sdk.testing import envoy_headers
+
+CAPACITY = 4
+COST = ((0.0, 0.002), (2.0, 0.010), (4.0, 0.002))  # (from seconds, cost)
+DURATION = 6.0
+RATE = 800  # streams per second
+INTERVAL = 0.5
+TIMEOUT = 0.2
+REQUEST = ext_api.ProcessingRequest(request_headers=envoy_headers({":path": "/"}))
+
+
+def cost_at(elapsed: float) -> float:
+    return [cost for start, cost in COST if start <= elapsed][-1]
+
+
+def service(start: int) -> BaseExtProcService:
+    P = BaseExtProcService(instrumentation="noop")
+    backend = asyncio.Semaphore(CAPACITY)
+
+    @P.process("request_headers")
+    async def call_backend(headers, context, request, response):
+        async with backend:
+            await asyncio.sleep(cost_at((perf_counter_ns() - start) / 1e9))
+        request.mutations.set("x-processed", "yes")
+        return response
+
+    return P
+
+
+async def messages():
+    yield REQUEST
+
+
+async def stream(P: BaseExtProcService, results: List[Tuple[int, int, bool]], due: int) -> None:
+    async for response in P.Process(messages(), None):
+        processed = bool(response.request_headers.response.header_mutation.set_headers)
+    results.append((due, perf_counter_ns() - due, processed))
+
+
+async def load(admission: Optional[AdmissionController]) -> None:
+    start = perf_counter_ns()
+    P = service(start)
+    P.admission = admission
+    results: List[Tuple[int, int, bool]] = []
+    limits: Dict[int, int] = {}
+    tasks = []
+    for i in range(int(DURATION * RATE)):
+        due = start + int(i * 1e9 / RATE)
+        await asyncio.sleep(max(0, due - perf_counter_ns()) / 1e9)
+        tasks.append(asyncio.create_task(stream(P, results, due)))
+        if (admission is not None) and admission.adaptive:
+            bucket = int((due - start) / 1e9 / INTERVAL)
+            limits[bucket] = admission.adaptive["request_headers"].limit
+    await asyncio.gather(*tasks)
+
+    for bucket in range(int(DURATION / INTERVAL)):
+        low, high = start + bucket * INTERVAL * 1e9, start + (bucket + 1) * INTERVAL * 1e9
+        window = [(latency, processed) for due, latency, processed in results if low <= due < high]
+        latencies = [latency for latency, processed in window if processed]
+        shed = len(window) - len(latencies)
+        late = sum(1 for latency in latencies if latency > TIMEOUT * 1e9)
+        cuts = quantiles(latencies, n=100) if len(latencies) > 1 else [0] * 99
+        limit = limits.get(bucket, "-")
+        print(
+            f"  {bucket * INTERVAL:4.1f}s cost {cost_at(bucket * INTERVAL) * 1e3:4.1f} ms: "
+            f"processed {len(latencies):4d}, shed {shed:4d}, "
+            f"p50 {cuts[49] / 1e6:8.1f} ms, p99 {cuts[98] / 1e6:8.1f} ms, "
+            f"late {late:4d}, limit {limit}"
+        )
+
+
+def run(name: str, admission: Callable[[], Optional[AdmissionController]]) -> None:
+    print(f"{name}:")
+    asyncio.run(load(admission()))
+
+
+if __name__ == "__main__":
+
+    run("unlimited", lambda: None)
+    run(
+        "adaptive",
+        lambda: AdmissionController(adaptive=lambda: AdaptiveLimit(min_rtt_interval=1.0)),
+    )
@@ -0,0 +1,65 @@
+# Parsing JSON bodies in a chain
+#
+# Four chained processors each read a field from a JSON response body.
+# "each parses" is every member calling json.loads itself (as the context
+# example used to); "body_json" is every member calling request.body_json,
+# which parses once for the chain, with each JSON backend.
+#
+#   DD_TRACE_ENABLED=false python -m tests.performance.body
+
+from asyncio import run
+import json
+from time import perf_counter_ns
+
+from envoy_extproc_sdk import BaseExtProcService, body, ChainedExtProcService
+from envoy_extproc_sdk.testing import AsEnvoyExtProc, envoy_body
+
+MEMBERS = 4
+SIZES = (4 * 1024, 64 * 1024, 1024 * 1024)
+
+
+class EachParses(BaseExtProcService):
+    def process_response_body(self, body, context, request, response):
+        request["tenant"] = json.loads(body.body.decode())["tenant_id"]
+        return response
+
+
+class BodyJson(BaseExtProcService):
+    def process_response_body(self, body, context, request, response):
+        request["tenant"] = request.body_json()["tenant_id"]
+        return response
+
+
+def document(size: int) -> bytes:
+    items = [
+        {"id": i, "name": f"item-{i}", "tags": ["a", "b"], "price": i * 1.5}
+        for i in range(size // 64)
+    ]
+    return json.dumps({"tenant_id": "t", "items": items}).encode()
+
+
+async def time_streams(service: BaseExtProcService, data: bytes, count: int) -> float:
+    E = AsEnvoyExtProc(response_body=envoy_body(data))
+    start = perf_counter_ns()
+    for _ in range(count):
+        async for _ in service.Process(E, None):
+            pass
+    return (perf_counter_ns() - start) / count
+
+
+if __name__ == "__main__":
+
+    for size in SIZES:
+        data = document(size)
+        count = max(10, 50_000_000 // len(data) // MEMBERS)
+        each = ChainedExtProcService([EachParses() for _ in range(MEMBERS)], instrumentation="noop")
+        elapsed = run(time_streams(each, data, count))
+        results = [f"each parses {elapsed / 1000:8.1f} us"]
+        for backend in ("json", "orjson"):
+            body.set_json_backend(backend)
+            once = ChainedExtProcService(
+                [BodyJson() for _ in range(MEMBERS)], instrumentation="noop"
+            )
+            elapsed = run(time_streams(once, data, count))
+            results.append(f"body_json ({backend}) {elapsed / 1000:8.1f} us")
+        print(f"{len(data) // 1024:5d} KiB: " + ", ".join(results))
@@ -0,0 +1,69 @@
+# Memory and allocation cost of the per-stream request context
+#
+# Holds many streams' contexts open at once, as a server does with
+# streams parked in BUFFERED mode, and compares the plain dict the
+# SDK used to seed and update with the standard headers against the
+# slotted RequestContext (with standard headers deferred, and after
+# they've been read).
+#
+#   DD_TRACE_ENABLED=false python -m tests.performance.context
+
+from time import perf_counter_ns
+import tracemalloc
+from typing import Callable, List
+
+from envoy_extproc_sdk import BaseExtProcService
+from envoy_extproc_sdk.context import RequestContext
+from envoy_extproc_sdk.testing import envoy_headers
+
+STREAMS = 50_000
+
+HEADERS = envoy_headers(
+    [
+        (":method", "post"),
+        (":path", "/api/v0/resource"),
+        ("content-type", "application/json"),
+        ("content-length", "1024"),
+        ("x-request-id", "4b1c3c3c-52cb-4a3f-a2c5-5d1a7b1c8e8e"),
+    ]
+)
+
+
+def legacy_context() -> dict:
+    request = {"__overhead_ns": 0, "__phase": "unknown", "__id": "unknown"}
+    request["__phase"] = "request_headers"
+    request.update(BaseExtProcService.get_standard_request_headers(HEADERS))
+    return request
+
+
+def deferred_context() -> RequestContext:
+    request = RequestContext()
+    request.phase = "request_headers"
+    request.defer(BaseExtProcService.get_standard_request_headers, HEADERS)
+    return request
+
+
+def materialized_context() -> RequestContext:
+    request = deferred_context()
+    request.id
+    return request
+
+
+def measure(name: str, make: Callable) -> None:
+    tracemalloc.start()
+    start = perf_counter_ns()
+    held: List = [make() for _ in range(STREAMS)]
+    elapsed = perf_counter_ns() - start
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(
+        f"{name:>12}: {current / STREAMS:7.1f} bytes/stream, "
+        f"{elapsed / STREAMS:7.1f} ns/stream to create ({len(held)} held)"
+    )
+
+
+if __name__ == "__main__":
+
+    measure("dict", legacy_context)
+    measure("deferred", deferred_context)
+    measure("materialized", materialized_context)
@@ -0,0 +1,81 @@
+# Per-message dispatch overhead in BaseExtProcService.Process
+#
+# Compares the lookup work Process used to do for every message
+# (WhichOneof, getattr of the phase data, building "process_{phase}",
+# getattr of the handler, iscoroutinefunction, endswith checks for
+# the response wrapper, and rebuilding the tracer resource name) with
+# the precompiled dispatch table lookup. Also times a whole Process
+# stream end-to-end so the saving can be seen in context.
+#
+#   DD_TRACE_ENABLED=false python -m tests.performance.dispatch
+
+from asyncio import iscoroutinefunction, run
+from time import perf_counter_ns
+from typing import Callable
+
+from envoy_extproc_sdk import BaseExtProcService, ext_api
+from envoy_extproc_sdk.settings import ENVOY_SERVICE_NAME
+from envoy_extproc_sdk.testing import AsEnvoyExtProc, envoy_body, envoy_headers
+
+COUNT = 200_000
+STREAMS = 5_000
+
+MESSAGES = AsEnvoyExtProc(
+    request_headers=envoy_headers([(":method", "get"), (":path", "/"), ("x-request-id", "1")]),
+    request_body=envoy_body("something"),
+).messages
+
+
+def legacy_dispatch(service: BaseExtProcService, req: ext_api.ProcessingRequest) -> Callable:
+    phase = req.WhichOneof("request")
+    data = getattr(req, phase)
+    action = getattr(service, f"process_{phase}", None)
+    if (action is None) or (not callable(action)):
+        raise ValueError(phase)
+    response = ext_api.HeaderMutation() if phase.endswith("trailers") else ext_api.CommonResponse()
+    iscoroutinefunction(action)
+    camel_case_phase = "".join([w.title() for w in phase.split("_")])
+    f"/{ENVOY_SERVICE_NAME}/Process/{camel_case_phase}"
+    if phase.endswith("headers"):
+        wrapper = ext_api.HeadersResponse
+    elif phase.endswith("body"):
+        wrapper = ext_api.BodyResponse
+    else:
+        wrapper = ext_api.TrailersResponse
+    return action, data, response, wrapper
+
+
+def table_dispatch(service: BaseExtProcService, req: ext_api.ProcessingRequest) -> Callable:
+    phase = req.WhichOneof("request")
+    handler = service._dispatch.get(phase)
+    if handler is None:
+        raise ValueError(phase)
+    data = getattr(req, phase)
+    response = handler.new_response()
+    return handler, data, response, handler.wrap
+
+
+def time_dispatch(name: str, dispatch: Callable, service: BaseExtProcService) -> None:
+    n = len(MESSAGES)
+    start = perf_counter_ns()
+    for i in range(COUNT):
+        dispatch(service, MESSAGES[i % n])
+    elapsed = perf_counter_ns() - start
+    print(f"{name:>8} dispatch: {elapsed / COUNT:8.1f} ns/msg")
+
+
+async def time_streams(service: BaseExtProcService) -> None:
+    start = perf_counter_ns()
+    for _ in range(STREAMS):
+        async for _ in service.Process(AsEnvoyExtProc(), None):
+            pass
+    elapsed = perf_counter_ns() - start
+    print(f"  Process stream: {elapsed / (STREAMS * len(MESSAGES)):8.1f} ns/msg (end-to-end)")
+
+
+if __name__ == "__main__":
+
+    service = BaseExtProcService()
+    time_dispatch("legacy", legacy_dispatch, service)
+    time_dispatch("table", table_dispatch, service)
+    run(time_streams(service))
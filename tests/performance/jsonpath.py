@@ -0,0 +1,64 @@
+# Extracting a field from a streamed JSON body
+#
+# Time until `tenant_id` is known from a JSON document arriving in 64 KiB
+# chunks: "buffered" joins every chunk and parses the whole document
+# (what a BUFFERED body handler does); "extractor" feeds chunks to a
+# JsonFieldExtractor, which is done at the chunk holding the field. The
+# field is either first in the document, or last (the worst case, where
+# everything is scanned).
+#
+#   DD_TRACE_ENABLED=false python -m tests.performance.jsonpath
+
+import json
+from time import perf_counter_ns
+from typing import Callable, List
+
+from envoy_extproc_sdk.jsonpath import JsonFieldExtractor
+from envoy_extproc_sdk.testing import envoy_body_chunks
+from envoy_extproc_sdk.util.envoy import ext_api
+
+CHUNK_SIZE = 64 * 1024
+SIZES = (64 * 1024, 1024 * 1024, 16 * 1024 * 1024)
+
+
+def document(size: int, first: bool) -> bytes:
+    items = [
+        {"id": i, "name": f"item-{i}", "tags": ["a", "b"], "price": i * 1.5}
+        for i in range(size // 64)
+    ]
+    if first:
+        return json.dumps({"tenant_id": "t", "items": items}).encode()
+    return json.dumps({"items": items, "tenant_id": "t"}).encode()
+
+
+def buffered(chunks: List[ext_api.HttpBody]) -> str:
+    return json.loads(b"".join(chunk.body for chunk in chunks))["tenant_id"]
+
+
+def extractor(chunks: List[ext_api.HttpBody]) -> str:
+    fields = JsonFieldExtractor(["tenant_id"])
+    for chunk in chunks:
+        if fields.feed(chunk):
+            break
+    return fields.found["tenant_id"]
+
+
+def time_it(method: Callable[[List[ext_api.HttpBody]], str], chunks, count: int) -> float:
+    start = perf_counter_ns()
+    for _ in range(count):
+        assert method(chunks) == "t"
+    return (perf_counter_ns() - start) / count
+
+
+if __name__ == "__main__":
+
+    for size in SIZES:
+        for first in (True, False):
+            chunks = list(envoy_body_chunks(document(size, first), chunk_size=CHUNK_SIZE))
+            count = max(5, 50_000_000 // size)
+            results = [
+                f"{name} {time_it(method, chunks, count) / 1000:9.1f} us"
+                for name, method in (("buffered", buffered), ("extractor", extractor))
+            ]
+            where = "first" if first else "last"
+            print(f"{size // 1024:6d} KiB, field {where:5s}: " + ", ".join(results))
@@ -0,0 +1,77 @@
+# Decoding body messages lazily (LAZY_BODIES)
+#
+# Times decoding a request body ProcessingRequest as gRPC hands it to the
+# service (from its serialized bytes), and then processing it: once with
+# a header-only processor (the trivial example, which never reads the
+# body) and once with one that digests it. "full" is the usual
+# ProcessingRequest.FromString, "lazy" LazyProcessingRequest.FromString.
+# Also reports the peak memory allocated (as tracemalloc sees it) for
+# each, for 1 KiB, 1 MiB and 16 MiB bodies.
+#
+#   DD_TRACE_ENABLED=false python -m tests.performance.lazy
+
+from asyncio import run
+from time import perf_counter_ns
+import tracemalloc
+from typing import Callable, List
+
+from envoy_extproc_sdk import BaseExtProcService, ext_api
+from envoy_extproc_sdk.testing import envoy_body, envoy_headers
+from envoy_extproc_sdk.util.lazy import LazyProcessingRequest
+from examples import DigestExtProcService, TrivialExtProcService
+
+SIZES = (1024, 1024 * 1024, 16 * 1024 * 1024)
+HEADERS = envoy_headers({":method": "post", ":path": "/upload", "x-tenant-id": "tenant"})
+DECODERS = {"full": ext_api.ProcessingRequest.FromString, "lazy": LazyProcessingRequest.FromString}
+
+
+class Messages:
+    """the (decoded) messages of a stream, as gRPC passes them to Process"""
+
+    def __init__(self, raw: List[bytes], decode: Callable) -> None:
+        self.raw = raw
+        self.decode = decode
+
+    async def __aiter__(self):
+        for msg in self.raw:
+            yield self.decode(msg)
+
+
+async def process(service: BaseExtProcService, raw: List[bytes], decode: Callable) -> None:
+    async for _ in service.Process(Messages(raw, decode), None):
+        pass
+
+
+async def measure(
+    service: BaseExtProcService, raw: List[bytes], decode: Callable, count: int
+) -> str:
+    await process(service, raw, decode)  # warm up
+    start = perf_counter_ns()
+    for _ in range(count):
+        await process(service, raw, decode)
+    elapsed = (perf_counter_ns() - start) / count
+
+    tracemalloc.start()
+    await process(service, raw, decode)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return f"{elapsed / 1000:9.1f} us/stream, peak {peak / 1024:9.1f} KiB"
+
+
+if __name__ == "__main__":
+
+    services = {
+        "header-only": TrivialExtProcService(instrumentation="noop"),
+        "digest": DigestExtProcService(instrumentation="noop"),
+    }
+    for size in SIZES:
+        body = b"x" * size
+        raw = [
+            ext_api.ProcessingRequest(request_headers=HEADERS).SerializeToString(),
+            ext_api.ProcessingRequest(request_body=envoy_body(body)).SerializeToString(),
+        ]
+        count = max(10, 20_000_000 // (size + 10_000))
+        for name, service in services.items():
+            for decoder, decode in DECODERS.items():
+                result = run(measure(service, raw, decode, count))
+                print(f"{size // 1024:6d} KiB {name:>11} {decoder}: {result}")
@@ -0,0 +1,62 @@
+# Cost of recording metrics
+#
+# Times a single observation into a phase's latency histogram (see
+# Metrics.observe), and whole streams through the trivial example with
+# and without metrics, so the cost per observation (and per stream) can
+# be seen against the cost of processing. Takes the best of ROUNDS.
+#
+#   DD_TRACE_ENABLED=false python -m tests.performance.metrics
+
+from asyncio import run
+from time import perf_counter_ns
+
+from envoy_extproc_sdk import BaseExtProcService
+from envoy_extproc_sdk.metrics import Metrics
+from envoy_extproc_sdk.testing import AsEnvoyExtProc, envoy_body, envoy_headers
+from examples import TrivialExtProcService
+
+COUNT = 1_000_000
+STREAMS = 20_000
+ROUNDS = 3
+
+MESSAGES = AsEnvoyExtProc(
+    request_headers=envoy_headers([(":method", "post"), (":path", "/"), ("x-request-id", "1")]),
+    request_body=envoy_body("something"),
+    response_headers=envoy_headers([(":status", "200")]),
+    response_body=envoy_body("something else"),
+)
+
+
+def time_observations() -> float:
+    metrics = Metrics()
+    observe = metrics.observe
+    durations = [(n * 7919) % 10**8 for n in range(1000)]  # (across the buckets)
+    start = perf_counter_ns()
+    for _ in range(COUNT // len(durations)):
+        for duration in durations:
+            observe("TrivialExtProcService", "request_headers", duration)
+    return (perf_counter_ns() - start) / COUNT
+
+
+async def time_streams(service: BaseExtProcService) -> float:
+    start = perf_counter_ns()
+    for _ in range(STREAMS):
+        async for _ in service.Process(MESSAGES, None):
+            pass
+    return (perf_counter_ns() - start) / STREAMS
+
+
+if __name__ == "__main__":
+
+    print(f"observation: {min(time_observations() for _ in range(ROUNDS)):5.0f} ns")
+    P = TrivialExtProcService(instrumentation="noop")
+    plain, measured = float("inf"), float("inf")
+    for _ in range(ROUNDS):
+        P.metrics = None
+        plain = min(plain, run(time_streams(P)))
+        P.metrics = Metrics()
+        measured = min(measured, run(time_streams(P)))
+    print(
+        f"stream: {plain / 1000:5.1f} us without metrics, {measured / 1000:5.1f} us with "
+        f"({(measured - plain) / 1000:4.1f} us for {len(P.metrics.phases)} phases)"
+    )
@@ -0,0 +1,62 @@
+# Cost of phases a processor doesn't handle
+#
+# A processor that only handles headers (like the trivial example) gets
+# every phase envoy sends it. Phases left to the base (no-op) handlers
+# are answered with a precomputed continue response, without calling the
+# handler (or opening spans or timers for it). This times whole streams
+# through the trivial example against the same processor with the base
+# handlers redefined, which can't be told apart from real handlers and
+# so take the full path, as every phase used to.
+#
+#   DD_TRACE_ENABLED=false python -m tests.performance.noop
+
+from asyncio import run
+from time import perf_counter_ns
+
+from envoy_extproc_sdk import BaseExtProcService
+from envoy_extproc_sdk.testing import AsEnvoyExtProc, envoy_body, envoy_headers
+from examples import TrivialExtProcService
+
+STREAMS = 20_000
+
+MESSAGES = AsEnvoyExtProc(
+    request_headers=envoy_headers([(":method", "post"), (":path", "/"), ("x-request-id", "1")]),
+    request_body=envoy_body("something"),
+    response_headers=envoy_headers([(":status", "200")]),
+    response_body=envoy_body("something else"),
+)
+
+
+class FullPathTrivialExtProcService(TrivialExtProcService):
+    """The trivial example, with the base no-op handlers redefined"""
+
+    async def process_request_body(self, body, context, request, response):
+        return response
+
+    async def process_request_trailers(self, trailers, context, request, response):
+        return response
+
+    async def process_response_body(self, body, context, request, response):
+        return response
+
+    async def process_response_trailers(self, trailers, context, request, response):
+        return response
+
+
+async def time_streams(service: BaseExtProcService) -> float:
+    start = perf_counter_ns()
+    for _ in range(STREAMS):
+        async for _ in service.Process(MESSAGES, None):
+            pass
+    return (perf_counter_ns() - start) / STREAMS
+
+
+if __name__ == "__main__":
+
+    for instrumentation in ("noop", "logging", "ddtrace"):
+        full = run(time_streams(FullPathTrivialExtProcService(instrumentation=instrumentation)))
+        fast = run(time_streams(TrivialExtProcService(instrumentation=instrumentation)))
+        print(
+            f"{instrumentation:>8}: full path {full / 1000:7.1f} us/stream, "
+            f"continue {fast / 1000:7.1f} us/stream ({1 - fast / full:4.0%} less)"
+        )
@@ -0,0 +1,78 @@
+# Header-phase latency next to CPU-bound body handlers
+#
+# Runs small header-only requests, arriving at a steady rate, alongside
+# streams repeatedly sending large bodies to a handler that digests them,
+# and reports the header requests' latency (p50/p99) with no body load,
+# with the digest inline on the event loop, and offloaded to threads.
+#
+#   DD_TRACE_ENABLED=false python -m tests.performance.offload
+
+import asyncio
+from hashlib import sha256
+from statistics import quantiles
+from time import perf_counter_ns
+from typing import List, Optional
+
+from envoy_extproc_sdk import BaseExtProcService
+from envoy_extproc_sdk.testing import AsEnvoyExtProc, envoy_body, envoy_headers
+
+HEADER_STREAMS = 1_000
+BODY_STREAMS = 1
+BODY = b"x" * (1024 * 1024)
+INTERVAL_NS = 2_000_000
+HEADERS = envoy_headers({":method": "get", ":path": "/"})
+
+
+def digest(body, context, request, response):
+    for _ in range(4):
+        sha256(body.body).hexdigest()
+    return response
+
+
+def service(offload: Optional[str]) -> BaseExtProcService:
+    P = BaseExtProcService()
+    if offload is not None:
+        P.process("request_body", offload=offload)(digest)
+    return P
+
+
+async def header_stream(P: BaseExtProcService, latencies: List[int], due: int) -> None:
+    async for _ in P.Process(AsEnvoyExtProc(request_headers=HEADERS), None):
+        pass
+    latencies.append(perf_counter_ns() - due)
+
+
+async def body_load(P: BaseExtProcService, done: asyncio.Event) -> None:
+    while not done.is_set():
+        async for _ in P.Process(AsEnvoyExtProc(request_body=envoy_body(BODY)), None):
+            pass
+        await asyncio.sleep(0)
+
+
+async def header_load(P: BaseExtProcService, latencies: List[int], done: asyncio.Event) -> None:
+    # open loop: requests "arrive" on a schedule, and latency is measured
+    # from arrival, so time spent waiting for a blocked loop is counted
+    start = perf_counter_ns()
+    for i in range(HEADER_STREAMS):
+        due = start + i * INTERVAL_NS
+        await asyncio.sleep(max(0, due - perf_counter_ns()) / 1e9)
+        await header_stream(P, latencies, due)
+    done.set()
+
+
+async def run(name: str, offload: Optional[str]) -> None:
+    P = service(offload)
+    latencies: List[int] = []
+    done = asyncio.Event()
+    bodies = [body_load(P, done) for _ in range(BODY_STREAMS)] if offload else []
+    await asyncio.gather(header_load(P, latencies, done), *bodies)
+    P.executors.shutdown()
+    cuts = quantiles(latencies, n=100)
+    print(f"{name:>8}: p50 {cuts[49] / 1e3:9.1f} us, p99 {cuts[98] / 1e3:9.1f} us")
+
+
+if __name__ == "__main__":
+
+    asyncio.run(run("idle", None))
+    asyncio.run(run("inline", "inline"))
+    asyncio.run(run("thread", "thread"))
@@ -0,0 +1,72 @@
+# Cost of responses handlers don't change
+#
+# Many handlers only read a phase (to record something in the context)
+# and return the response they were given as it is, which is answered
+# with a prebuilt continue response. With LAZY_RESPONSES, handlers get a
+# stand in for the response (see LazyResponse), built only if it's used.
+# This times whole streams through a processor whose handlers only read,
+# with and without LAZY_RESPONSES.
+#
+#   DD_TRACE_ENABLED=false python -m tests.performance.response
+
+from asyncio import run
+from time import perf_counter_ns
+
+from envoy_extproc_sdk import BaseExtProcService, extproc
+from envoy_extproc_sdk.testing import AsEnvoyExtProc, envoy_body, envoy_headers
+
+STREAMS = 20_000
+
+MESSAGES = AsEnvoyExtProc(
+    request_headers=envoy_headers([(":method", "post"), (":path", "/"), ("x-request-id", "1")]),
+    request_body=envoy_body("something"),
+    response_headers=envoy_headers([(":status", "200")]),
+    response_body=envoy_body("something else"),
+)
+
+
+class ReaderExtProcService(BaseExtProcService):
+    """Reads every phase, changing nothing"""
+
+    def process_request_headers(self, headers, context, request, response):
+        request["path"] = request.headers.get(":path")
+        return response
+
+    def process_request_body(self, body, context, request, response):
+        request["request_size"] = len(body.body)
+        return response
+
+    def process_request_trailers(self, trailers, context, request, response):
+        return response
+
+    def process_response_headers(self, headers, context, request, response):
+        request["status"] = request.headers.get(":status")
+        return response
+
+    def process_response_body(self, body, context, request, response):
+        request["response_size"] = len(body.body)
+        return response
+
+    def process_response_trailers(self, trailers, context, request, response):
+        return response
+
+
+async def time_streams(service: BaseExtProcService) -> float:
+    start = perf_counter_ns()
+    for _ in range(STREAMS):
+        async for _ in service.Process(MESSAGES, None):
+            pass
+    return (perf_counter_ns() - start) / STREAMS
+
+
+if __name__ == "__main__":
+
+    for instrumentation in ("noop", "logging"):
+        extproc.LAZY_RESPONSES = False
+        built = run(time_streams(ReaderExtProcService(instrumentation=instrumentation)))
+        extproc.LAZY_RESPONSES = True
+        lazy = run(time_streams(ReaderExtProcService(instrumentation=instrumentation)))
+        print(
+            f"{instrumentation:>8}: built {built / 1000:7.1f} us/stream, "
+            f"lazy {lazy / 1000:7.1f} us/stream ({1 - lazy / built:4.0%} less)"
+        )
@@ -0,0 +1,52 @@
+# Memory use digesting a large upload in STREAMED mode
+#
+# Streams a (generated) 1 GiB request body through the incremental digest
+# example in 64 KiB chunks, as envoy does in STREAMED mode, and reports the
+# time taken and the peak memory allocated while processing; that peak
+# stays around a chunk's worth of memory however large the body is.
+#
+#   DD_TRACE_ENABLED=false python -m tests.performance.streamed
+
+import asyncio
+from time import perf_counter
+import tracemalloc
+from typing import Iterator
+
+from envoy_extproc_sdk.testing import (
+    AsEnvoyExtProc,
+    envoy_body_chunks,
+    envoy_headers,
+)
+from examples import StreamedDigestExtProcService
+
+SIZES = (64 * 1024 * 1024, 1024 * 1024 * 1024)
+CHUNK_SIZE = 64 * 1024
+HEADERS = envoy_headers({":method": "post", ":path": "/upload", "x-tenant-id": "tenant"})
+
+
+def generate(size: int) -> Iterator[bytes]:
+    chunk = b"x" * CHUNK_SIZE
+    for offset in range(0, size, CHUNK_SIZE):
+        yield chunk if offset + CHUNK_SIZE <= size else chunk[: size - offset]
+
+
+async def digest(size: int) -> None:
+    P = StreamedDigestExtProcService(instrumentation="noop")
+    E = AsEnvoyExtProc(request_headers=HEADERS, request_body=envoy_body_chunks(generate(size)))
+    tracemalloc.start()
+    start = perf_counter()
+    async for _ in P.Process(E, None):
+        pass
+    elapsed = perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(
+        f"{size / 2**20:6.0f} MiB: {elapsed:6.2f} s ({size / 2**20 / elapsed:6.0f} MiB/s), "
+        f"peak {peak / 2**10:7.1f} KiB allocated"
+    )
+
+
+if __name__ == "__main__":
+
+    for size in SIZES:
+        asyncio.run(digest(size))
@@ -3,9 +3,16 @@ from datetime import datetime as dt
 from datetime import timedelta as td
 from typing import Optional
 
+from envoy_extproc_sdk import extproc
 import pytest  # noqa: F401
 
 
+@pytest.fixture
+def override_modes(monkeypatch: pytest.MonkeyPatch) -> None:
+    """turn MODE_OVERRIDE on (it's off by default) for services built in a test"""
+    monkeypatch.setattr(extproc, "MODE_OVERRIDE", True)
+
+
 @dataclass
 class StoredString:
     upd: dt
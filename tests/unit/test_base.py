@@ -1,12 +1,14 @@
+import pickle
 from typing import Dict, List, Optional
 
-from envoy_extproc_sdk import BaseExtProcService
+from envoy_extproc_sdk import BaseExtProcService, extproc
 from envoy_extproc_sdk.testing import AsEnvoyExtProc, envoy_body, envoy_headers
 from envoy_extproc_sdk.util.envoy import (
     EnvoyHeaderValue,
     EnvoyHeaderValueOption,
     ext_api,
 )
+from envoy_extproc_sdk.util.lazy import LazyResponse
 import pytest
 
 
@@ -54,6 +56,116 @@ async def test_abort_on_unknown() -> None:
             print(r)
 
 
+@pytest.mark.asyncio
+async def test_base_handlers_just_continue() -> None:
+    class BodyOnly(BaseExtProcService):
+        def process_request_body(self, body, context, request, response):
+            return response
+
+    p = BodyOnly()
+    assert p._dispatch["request_body"].continue_response is None
+    trailers = p._dispatch["request_trailers"].continue_response
+    assert isinstance(trailers, ext_api.ProcessingResponse)
+    assert_empty_header_mutation(trailers.request_trailers.header_mutation)
+
+    # phases only the base handlers handle get the same, precomputed, response
+    responses = [r async for r in p.Process(AsEnvoyExtProc(), FakeServicerContext())]
+    assert responses[2] is trailers
+    assert responses[4] is p._dispatch["response_body"].continue_response
+    assert responses[5] is p._dispatch["response_trailers"].continue_response
+    assert [r.WhichOneof("response") for r in responses] == [
+        "request_headers",
+        "request_body",
+        "request_trailers",
+        "response_headers",
+        "response_body",
+        "response_trailers",
+    ]
+
+
+class Untouched(BaseExtProcService):
+    def process_request_headers(self, headers, context, request, response):
+        request["seen"] = True
+        return response
+
+    def process_response_body(self, body, context, request, response):
+        if body.body == b"change":
+            return self.add_header(response, "x-changed", "yes")
+        return response
+
+
+@pytest.mark.asyncio
+async def test_no_mode_override_by_default() -> None:
+    E = AsEnvoyExtProc(request_headers=envoy_headers({}))
+    responses = [r async for r in BaseExtProcService().Process(E, None)]
+    assert not responses[0].HasField("mode_override")
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("override_modes")
+async def test_unused_responses_not_built() -> None:
+    p = Untouched()
+
+    @p.process("request_trailers")
+    def trailers(trailers, context, request, response):
+        assert isinstance(response, ext_api.HeaderMutation)
+        return response
+
+    E = AsEnvoyExtProc(
+        request_headers=envoy_headers({}),
+        request_trailers=ext_api.HttpTrailers(),
+        response_body=envoy_body(b"same"),
+    )
+    responses = [r async for r in p.Process(E, FakeServicerContext())]
+    # subclass and decorated handlers that don't change their response get
+    # the shared "continue" response
+    assert responses[2] is p._dispatch["request_trailers"].unchanged_response
+    assert responses[4] is p._dispatch["response_body"].unchanged_response
+    assert responses[0].HasField("mode_override")  # (built, to carry the override)
+
+    E = AsEnvoyExtProc(response_body=envoy_body(b"change"))
+    responses = [r async for r in p.Process(E, FakeServicerContext())]
+    assert responses[4] is not p._dispatch["response_body"].unchanged_response
+    headers = responses[4].response_body.response.header_mutation.set_headers
+    assert [(o.header.key, o.header.value) for o in headers] == [("x-changed", "yes")]
+
+
+def test_lazy_response_stands_in() -> None:
+    response = LazyResponse(ext_api.CommonResponse)
+    assert isinstance(response, ext_api.CommonResponse) and response.message is None
+    assert pickle.loads(pickle.dumps(response)) == ext_api.CommonResponse()
+    response.status = ext_api.CommonResponse.ResponseStatus.CONTINUE_AND_REPLACE
+    assert response.message.status == ext_api.CommonResponse.ResponseStatus.CONTINUE_AND_REPLACE
+    assert response == response.message
+
+
+def test_lazy_responses_opt_in(monkeypatch) -> None:
+    p = Untouched()
+    assert p._dispatch["response_body"].new_response is ext_api.CommonResponse
+    monkeypatch.setattr(extproc, "LAZY_RESPONSES", True)
+    p = Untouched()
+    assert type(p._dispatch["response_body"].new_response()) is LazyResponse
+
+
+@pytest.mark.asyncio
+async def test_responses_are_messages() -> None:
+    p = BaseExtProcService()
+
+    @p.process("request_body")
+    def body(body, context, request, response):
+        # (handlers can embed and copy the response they're given)
+        wrapped = ext_api.BodyResponse(response=response)
+        copied = ext_api.CommonResponse()
+        copied.CopyFrom(response)
+        copied.MergeFrom(wrapped.response)
+        return p.add_header(copied, "x-copied", "yes")
+
+    E = AsEnvoyExtProc(request_body=envoy_body(b"body"))
+    responses = [r async for r in p.Process(E, FakeServicerContext())]
+    headers = responses[1].request_body.response.header_mutation.set_headers
+    assert [(o.header.key, o.header.value) for o in headers] == [("x-copied", "yes")]
+
+
 def test_just_continue_response() -> None:
     p = BaseExtProcService()
     response = p.just_continue_response()
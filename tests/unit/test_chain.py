@@ -0,0 +1,317 @@
+import asyncio
+from typing import List
+
+from envoy_extproc_sdk import (
+    BaseExtProcService,
+    ChainedExtProcService,
+    StopRequestProcessing,
+)
+from envoy_extproc_sdk.chain import (
+    apply_header_mutation,
+    apply_response,
+    merge_header_mutation,
+)
+from envoy_extproc_sdk.testing import (
+    AsEnvoyExtProc,
+    envoy_body,
+    envoy_headers,
+    envoy_set_headers_to_dict,
+)
+from envoy_extproc_sdk.util.envoy import (
+    EnvoyHeaderMap,
+    EnvoyHeaderValue,
+    EnvoyHeaderValueOption,
+    EnvoyHttpStatusCode,
+    ext_api,
+)
+from examples import (
+    DigestExtProcService,
+    EchoExtProcService,
+    TimerExtProcService,
+    TrivialExtProcService,
+)
+from examples.digest import REQUEST_DIGEST_HEADER
+from examples.timer import REQUEST_DURATION_HEADER
+from examples.trivial import EXTRA_REQUEST_ID_HEADER
+import pytest
+
+
+def header_option(key: str, value: str, **kwargs) -> EnvoyHeaderValueOption:
+    return EnvoyHeaderValueOption(header=EnvoyHeaderValue(key=key, value=value), **kwargs)
+
+
+def test_apply_header_mutation() -> None:
+    headers = ext_api.HttpHeaders(
+        headers=EnvoyHeaderMap(
+            headers=[
+                EnvoyHeaderValue(key=key, value=value)
+                for key, value in [("a", "1"), ("b", "2"), ("b", "3"), ("c", "4")]
+            ]
+        )
+    )
+    mutation = ext_api.HeaderMutation(
+        set_headers=[
+            header_option("a", "5"),
+            header_option("b", "6", append_action=EnvoyHeaderValueOption.ADD_IF_ABSENT),
+            header_option("c", "7", append_action=EnvoyHeaderValueOption.APPEND_IF_EXISTS_OR_ADD),
+            header_option("d", "8", append_action=EnvoyHeaderValueOption.OVERWRITE_IF_EXISTS),
+        ],
+        remove_headers=["c"],
+    )
+    apply_header_mutation(headers.headers, mutation)
+    assert [(h.key, h.value) for h in headers.headers.headers] == [
+        ("b", "2"),
+        ("b", "3"),
+        ("a", "5"),
+        ("c", "7"),
+    ]
+
+
+def test_merge_header_mutation() -> None:
+    merged = ext_api.HeaderMutation(
+        set_headers=[header_option("a", "1"), header_option("b", "2")], remove_headers=["c"]
+    )
+    merge_header_mutation(
+        merged,
+        ext_api.HeaderMutation(set_headers=[header_option("c", "3")], remove_headers=["a"]),
+    )
+    assert [(o.header.key, o.header.value) for o in merged.set_headers] == [("b", "2"), ("c", "3")]
+    assert list(merged.remove_headers) == ["c", "a"]
+
+    # applying the merged mutation is applying each in turn
+    separately = envoy_headers({"a": "0", "c": "0", "d": "0"})
+    apply_header_mutation(
+        separately.headers,
+        ext_api.HeaderMutation(
+            set_headers=[header_option("a", "1"), header_option("b", "2")], remove_headers=["c"]
+        ),
+    )
+    apply_header_mutation(
+        separately.headers,
+        ext_api.HeaderMutation(set_headers=[header_option("c", "3")], remove_headers=["a"]),
+    )
+    together = envoy_headers({"a": "0", "c": "0", "d": "0"})
+    apply_header_mutation(together.headers, merged)
+    assert sorted((h.key, h.value) for h in separately.headers.headers) == sorted(
+        (h.key, h.value) for h in together.headers.headers
+    )
+
+
+def test_apply_response_copies() -> None:
+    headers = envoy_headers({"a": "1"})
+    response = BaseExtProcService.add_header(ext_api.CommonResponse(), "a", "2")
+    mutated = apply_response(headers, response)
+    assert BaseExtProcService.get_header(headers, "a") == "1"
+    assert BaseExtProcService.get_header(mutated, "a") == "2"
+    assert apply_response(headers, ext_api.CommonResponse()) is headers
+
+    body = envoy_body(b"body")
+    response = ext_api.CommonResponse(body_mutation=ext_api.BodyMutation(body=b"new"))
+    assert apply_response(body, response).body == b"new"
+    response = ext_api.CommonResponse(body_mutation=ext_api.BodyMutation(clear_body=True))
+    assert apply_response(body, response).body == b""
+    assert body.body == b"body"
+
+
+class Recorder(BaseExtProcService):
+    """Records what it sees, and sets a header to its name"""
+
+    def __init__(self, name: str, seen: List) -> None:
+        super().__init__(name=name)
+        self.seen = seen
+
+    def process_request_headers(self, headers, context, request, response):
+        request["calls"] = request.get("calls", 0) + 1
+        self.seen.append(
+            (self.name, request.phase, dict(request.headers.items()), request["calls"])
+        )
+        self.add_header(response, "x-last", self.name)
+        self.remove_header(response, f"x-remove-{self.name}")
+        return response
+
+    def process_response_headers(self, headers, context, request, response):
+        request["calls"] = request.get("calls", 0) + 1
+        self.seen.append(
+            (self.name, request.phase, dict(request.headers.items()), request["calls"])
+        )
+        self.add_header(response, "x-last", self.name)
+        return response
+
+
+@pytest.mark.asyncio
+async def test_chain_order_and_visibility() -> None:
+    seen = []
+    P = ChainedExtProcService([Recorder("one", seen), Recorder("two", seen)])
+    E = AsEnvoyExtProc(
+        request_headers=envoy_headers({"x-remove-two": "yes"}),
+        response_headers=envoy_headers({}),
+    )
+    responses = {}
+    async for response in P.Process(E, None):
+        responses[response.WhichOneof("response")] = response
+
+    assert seen == [
+        ("one", "request_headers", {"x-remove-two": "yes"}, 1),
+        # two sees the headers as one left them, and one's context isn't two's
+        ("two", "request_headers", {"x-remove-two": "yes", "x-last": "one"}, 1),
+        # response phases run in reverse
+        ("two", "response_headers", {}, 2),
+        ("one", "response_headers", {"x-last": "two"}, 2),
+    ]
+
+    mutation = responses["request_headers"].request_headers.response.header_mutation
+    assert [(o.header.key, o.header.value) for o in mutation.set_headers] == [
+        ("x-last", "one"),
+        ("x-last", "two"),
+    ]
+    assert list(mutation.remove_headers) == ["x-remove-one", "x-remove-two"]
+
+    headers = envoy_set_headers_to_dict(responses["response_headers"].response_headers.response)
+    assert headers["x-ext-procs-applied"] == "one,two"
+    assert headers["x-last"] == "one"
+
+
+class Reader(BaseExtProcService):
+    def process_request_body(self, body, context, request, response):
+        request["size"] = len(body.body)
+        return response
+
+
+@pytest.mark.asyncio
+async def test_chain_unchanged_response() -> None:
+    P = ChainedExtProcService([Reader(), Reader()], instrumentation="noop")
+    E = AsEnvoyExtProc(request_body=envoy_body(b"body"))
+    responses = [r async for r in P.Process(E, None)]
+    # members that don't use their responses leave the chain's unchanged
+    assert responses[1] is P._dispatch["request_body"].unchanged_response
+
+
+@pytest.mark.asyncio
+async def test_chain_examples() -> None:
+    P = ChainedExtProcService(
+        [TrivialExtProcService(), TimerExtProcService(), DigestExtProcService()]
+    )
+    E = AsEnvoyExtProc(
+        request_headers=envoy_headers(
+            {":method": "post", ":path": "/", "x-request-id": "abc", "x-tenant-id": "t"}
+        ),
+        request_body=envoy_body(b"body"),
+        response_headers=envoy_headers({"x-ext-procs-applied": "Upstream"}),
+        response_body=envoy_body(b"body"),
+    )
+    responses = {}
+    async for response in P.Process(E, None):
+        phase = response.WhichOneof("response")
+        if not phase.endswith("trailers"):
+            responses[phase] = envoy_set_headers_to_dict(getattr(response, phase).response)
+
+    assert responses["request_headers"][EXTRA_REQUEST_ID_HEADER] == "abc"
+    assert REQUEST_DIGEST_HEADER in responses["request_body"]
+    assert responses["response_headers"]["x-ext-procs-applied"] == (
+        "TrivialExtProcService,TimerExtProcService,DigestExtProcService,Upstream"
+    )
+    assert REQUEST_DURATION_HEADER in responses["response_body"]
+    assert (
+        responses["response_body"][REQUEST_DIGEST_HEADER]
+        == responses["request_body"][REQUEST_DIGEST_HEADER]
+    )
+
+
+@pytest.mark.asyncio
+async def test_chain_stops() -> None:
+    seen = []
+    P = ChainedExtProcService(
+        [TrivialExtProcService(), EchoExtProcService(), Recorder("after", seen)]
+    )
+    E = AsEnvoyExtProc(
+        request_headers=envoy_headers({"x-echo-only": "yes"}),
+        request_body=envoy_body(b"echo"),
+    )
+    responses = [r async for r in P.Process(E, None)]
+    assert responses[1].WhichOneof("response") == "immediate_response"
+    immediate = responses[1].immediate_response
+    assert immediate.body == b"echo"
+    headers = {h.header.key: h.header.value for h in immediate.headers.set_headers}
+    assert headers["x-ext-procs-applied"] == "TrivialExtProcService,EchoExtProcService"
+
+
+def test_chain_needs_members() -> None:
+    with pytest.raises(ValueError):
+        ChainedExtProcService([])
+
+
+class Sleeper(BaseExtProcService):
+    """Sleeps, then sets a header; records when it ran and if cancelled"""
+
+    INDEPENDENT = True
+
+    def __init__(self, name: str, delay: float, log: List, stop: bool = False) -> None:
+        super().__init__(name=name)
+        self.delay = delay
+        self.log = log
+        self.stop = stop
+
+    async def process_request_headers(self, headers, context, request, response):
+        self.log.append(("start", self.name, dict(request.headers.items())))
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.log.append(("cancelled", self.name))
+            raise
+        self.log.append(("end", self.name))
+        if self.stop:
+            raise StopRequestProcessing(
+                self.form_immediate_response(EnvoyHttpStatusCode.Forbidden, {}, self.name.encode())
+            )
+        self.add_header(response, "x-last", self.name)
+        return response
+
+
+def test_chain_batches() -> None:
+    log = []
+    P = ChainedExtProcService(
+        [
+            Sleeper("a", 0, log),
+            Sleeper("b", 0, log),
+            Recorder("c", []),
+            Sleeper("d", 0, log),
+        ]
+    )
+    assert P.batches("request_headers") == [[0, 1], [2], [3]]
+    # response phases run in reverse
+    assert P.batches("response_headers") == [[3], [2], [1, 0]]
+
+
+@pytest.mark.asyncio
+async def test_chain_runs_independent_members_concurrently() -> None:
+    log = []
+    P = ChainedExtProcService(
+        [Sleeper("slow", 0.05, log), Sleeper("fast", 0.01, log), Recorder("after", [])]
+    )
+    E = AsEnvoyExtProc(request_headers=envoy_headers({"x-in": "1"}))
+    responses = [r async for r in P.Process(E, None)]
+
+    # both started (seeing the same headers) before either ended
+    assert log == [
+        ("start", "slow", {"x-in": "1"}),
+        ("start", "fast", {"x-in": "1"}),
+        ("end", "fast"),
+        ("end", "slow"),
+    ]
+    # merged in chain order, not the order they finished
+    mutation = responses[0].request_headers.response.header_mutation
+    assert [o.header.value for o in mutation.set_headers] == ["slow", "fast", "after"]
+    assert P.members[2].seen[0][2] == {"x-in": "1", "x-last": "fast"}
+
+
+@pytest.mark.asyncio
+async def test_chain_stop_cancels_independent_members() -> None:
+    log = []
+    P = ChainedExtProcService([Sleeper("first", 0.01, log, stop=True), Sleeper("second", 1.0, log)])
+    E = AsEnvoyExtProc(request_headers=envoy_headers({}))
+    responses = [r async for r in P.Process(E, None)]
+    assert log[-1] == ("cancelled", "second")
+    immediate = responses[0].immediate_response
+    assert immediate.body == b"first"
+    headers = {h.header.key: h.header.value for h in immediate.headers.set_headers}
+    assert headers["x-ext-procs-applied"] == "first"
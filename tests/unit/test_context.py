@@ -0,0 +1,165 @@
+from json import loads
+from typing import Dict
+
+from envoy_extproc_sdk import BaseExtProcService, body, ChainedExtProcService
+from envoy_extproc_sdk.body import BodyTooLarge, set_json_backend
+from envoy_extproc_sdk.context import RequestContext
+from envoy_extproc_sdk.testing import AsEnvoyExtProc, envoy_body, envoy_headers
+from envoy_extproc_sdk.util.headers import HeaderView
+from envoy_extproc_sdk.util.lazy import LazyHttpBody
+import pytest
+
+
+def test_sdk_keys() -> None:
+    request = RequestContext()
+    assert request["__overhead_ns"] == 0
+    assert request["__phase"] == "unknown"
+    assert request["__id"] == "unknown"
+    request["__phase"] = "request_headers"
+    assert request.phase == "request_headers"
+    request.overhead_ns += 10
+    assert request["__overhead_ns"] == 10
+    with pytest.raises(KeyError):
+        del request["__id"]
+
+
+def test_user_data() -> None:
+    request = RequestContext({"some": "data"})
+    request["more"] = "data"
+    assert request["some"] == "data"
+    assert request.get("missing") is None
+    assert request.get("missing", 1) == 1
+    assert "more" in request
+    assert request.pop("more") == "data"
+    assert "more" not in request
+    assert request.setdefault("other", 1) == 1
+    assert len(request) == 5
+    assert dict(request) == {
+        "__overhead_ns": 0,
+        "__phase": "unknown",
+        "__id": "unknown",
+        "some": "data",
+        "other": 1,
+    }
+    with pytest.raises(KeyError):
+        request["missing"]
+
+
+def test_deferred_extraction() -> None:
+    calls = []
+
+    def extract(data: Dict) -> Dict:
+        calls.append(data)
+        return data
+
+    request = RequestContext()
+    request.defer(extract, {"__id": "abc", "method": "get"})
+    assert not calls
+    assert request.phase == "unknown"  # slots don't materialize
+    assert not calls
+    assert request["method"] == "get"
+    assert request.id == "abc"
+    assert len(calls) == 1
+
+    # deferring again materializes whatever was pending, in order
+    request.defer(extract, {"method": "put"})
+    request.defer(extract, {"path": "/"})
+    assert len(calls) == 2
+    request["method"] = "post"  # writes materialize before writing
+    assert len(calls) == 3
+    assert request["method"] == "post"
+    assert request["path"] == "/"
+
+
+@pytest.mark.asyncio
+async def test_standard_headers_in_context() -> None:
+    P = BaseExtProcService()
+    seen = {}
+
+    @P.process("request_body")
+    def body(body, context, request, response):
+        seen.update(request)
+        return response
+
+    E = AsEnvoyExtProc(
+        request_headers=envoy_headers(
+            [(":method", "get"), (":path", "/api"), ("x-request-id", "abc")]
+        )
+    )
+    async for _ in P.Process(E, None):
+        pass
+    assert seen["method"] == "get"
+    assert seen["path"] == "/api"
+    assert seen["__id"] == "abc"
+    assert seen["content_type"] is None
+    assert seen["__phase"] == "request_body"
+
+
+def test_body_parsing() -> None:
+    request = RequestContext()
+    with pytest.raises(ValueError):
+        request.body_json()
+
+    request.next_chunk(envoy_body(b'{"a": [1, 2]}'))
+    parsed = request.body_json()
+    assert parsed == {"a": [1, 2]}
+    assert request.body_json() is parsed  # memoized
+    assert request.body_text() == '{"a": [1, 2]}'
+
+    # a new body message is parsed again
+    request.next_chunk(envoy_body(b"a=1&b=&a=2"))
+    assert request.body_form() == {"a": ["1", "2"], "b": [""]}
+
+    request.headers = HeaderView(envoy_headers({"content-type": "text/plain; charset=latin-1"}))
+    request.next_chunk(envoy_body("é".encode("latin-1")))
+    assert request.body_text() == "é"
+
+
+def test_body_parse_limit(monkeypatch) -> None:
+    monkeypatch.setattr(body, "BODY_PARSE_LIMIT", 4)
+    request = RequestContext()
+    request.next_chunk(envoy_body(b"1234"))
+    assert request.body_json() == 1234
+    request.next_chunk(envoy_body(b"12345"))
+    with pytest.raises(BodyTooLarge):
+        request.body_json()
+
+
+@pytest.mark.parametrize("backend", ("json", "orjson", "auto", lambda data: loads(bytes(data))))
+def test_json_backends(monkeypatch, backend) -> None:
+    monkeypatch.setattr(body, "json_loads", body.json_loads)
+    set_json_backend(backend)
+    request = RequestContext()
+    request.next_chunk(LazyHttpBody(memoryview(b'{"a": 1}')))
+    assert request.body_json() == {"a": 1}
+    with pytest.raises(ValueError):
+        set_json_backend("unknown")
+
+
+@pytest.mark.asyncio
+async def test_chain_parses_bodies_once(monkeypatch) -> None:
+    calls = []
+
+    def counting_loads(data):
+        calls.append(bytes(data))
+        return loads(bytes(data))
+
+    monkeypatch.setattr(body, "json_loads", counting_loads)
+
+    class Reader(BaseExtProcService):
+        def process_request_body(self, body, context, request, response):
+            request["parsed"] = request.body_json()
+            return response
+
+    class Writer(Reader):
+        def process_request_body(self, body, context, request, response):
+            super().process_request_body(body, context, request, response)
+            response.body_mutation.body = b'{"b": 2}'
+            return response
+
+    P = ChainedExtProcService([Reader(), Reader(), Writer(), Reader()])
+    E = AsEnvoyExtProc(request_body=envoy_body(b'{"a": 1}'))
+    async for _ in P.Process(E, None):
+        pass
+    # parsed once for the first three members, and again after the change
+    assert calls == [b'{"a": 1}', b'{"b": 2}']
@@ -1,3 +1,4 @@
+from hashlib import sha256
 import re
 from uuid import uuid4
 
@@ -9,6 +10,7 @@ from envoy_extproc_sdk.testing import (
     envoy_set_headers_to_dict,
 )
 from examples import DigestExtProcService
+from examples.digest import OFFLOAD_BODY_BYTES
 import pytest
 
 
@@ -78,3 +80,24 @@ async def test_digester_flow(headers: ext_api.HttpHeaders, body: ext_api.HttpBod
                 assert _headers
                 assert "x-request-digest" in _headers
                 assert re.match(r"^[0-9a-f]{64}$", _headers["x-request-digest"]) is not None
+
+
+@pytest.mark.asyncio
+async def test_digester_offloads_large_bodies() -> None:
+    headers = envoy_headers(
+        headers=[(":method", "post"), (":path", "/api/v0/resource"), ("x-tenant-id", "t")]
+    )
+    body = b"x" * (OFFLOAD_BODY_BYTES + 1)
+
+    P = DigestExtProcService()
+    E = AsEnvoyExtProc(request_headers=headers, request_body=envoy_body(body))
+
+    digests = []
+    async for response in P.Process(E, None):
+        if response.WhichOneof("response") == "request_body":
+            digests.append(envoy_set_headers_to_dict(response.request_body.response))
+    assert P.executors._thread_pool is not None
+    P.executors.shutdown()
+
+    expected = sha256(b"tpost/api/v0/resource" + body).hexdigest()
+    assert digests == [{"x-request-digest": expected}]
@@ -0,0 +1,125 @@
+import socket
+
+from envoy.service.ext_proc.v3.external_processor_pb2_grpc import (
+    ExternalProcessorStub,
+)
+from envoy_extproc_sdk import (
+    BaseExtProcService,
+    ChainedExtProcService,
+    StopRequestProcessing,
+)
+from envoy_extproc_sdk.server import create_server, serialize_response
+from envoy_extproc_sdk.testing import AsEnvoyExtProc, envoy_body, envoy_headers
+from envoy_extproc_sdk.util.envoy import EnvoyHttpStatusCode, ext_api
+from grpc.aio import insecure_channel
+import pytest
+
+CONTINUE = BaseExtProcService.preserialize(
+    "request_body", BaseExtProcService.add_header(ext_api.CommonResponse(), "x-canned", "yes")
+)
+
+FORBIDDEN = BaseExtProcService.preserialize(
+    "immediate_response",
+    BaseExtProcService.form_immediate_response(EnvoyHttpStatusCode.Forbidden, {}, b"no"),
+)
+
+
+class Canned(BaseExtProcService):
+    def process_request_body(self, body, context, request, response):
+        if body.body == b"stop":
+            raise StopRequestProcessing(FORBIDDEN)
+        return CONTINUE
+
+
+def test_serialize_response() -> None:
+    response = ext_api.ProcessingResponse(request_body=ext_api.BodyResponse())
+    assert serialize_response(response) == response.SerializeToString()
+    assert serialize_response(CONTINUE) is CONTINUE
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("override_modes")
+async def test_preserialized_responses() -> None:
+    P = Canned()
+    E = AsEnvoyExtProc(request_body=envoy_body(b"body"))
+
+    # without the generic handler, bytes are deserialized for the server
+    responses = [r async for r in P.Process(E, None)]
+    assert all(isinstance(r, ext_api.ProcessingResponse) for r in responses)
+    assert responses[1].SerializeToString() == CONTINUE
+
+    # with it, bytes (and continue responses) are sent as they are
+    P.preserialized = True
+    responses = [r async for r in P.Process(E, None)]
+    assert responses[1] is CONTINUE
+    assert responses[2] is P._dispatch["request_trailers"].continue_serialized
+    assert isinstance(responses[0], ext_api.ProcessingResponse)
+
+    E = AsEnvoyExtProc(request_body=envoy_body(b"stop"))
+    responses = [r async for r in P.Process(E, None)]
+    assert responses[1] is FORBIDDEN
+
+
+@pytest.mark.asyncio
+async def test_chain_merges_preserialized_responses() -> None:
+    P = ChainedExtProcService([Canned()])
+    E = AsEnvoyExtProc(request_body=envoy_body(b"body"))
+    responses = [r async for r in P.Process(E, None)]
+    mutation = responses[1].request_body.response.header_mutation
+    assert [(o.header.key, o.header.value) for o in mutation.set_headers] == [("x-canned", "yes")]
+
+    E = AsEnvoyExtProc(request_body=envoy_body(b"stop"))
+    responses = [r async for r in P.Process(E, None)]
+    assert responses[1].immediate_response.body == b"no"
+
+
+class Leaky(Canned):
+    def process_request_body(self, body, context, request, response):
+        request.mutations.set("x-leak", "yes")
+        return CONTINUE
+
+    def process_response_headers(self, headers, context, request, response):
+        return response
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("chained", [False, True])
+async def test_preserialized_responses_drop_mutations(chained: bool) -> None:
+    P = ChainedExtProcService([Leaky()]) if chained else Leaky()
+    E = AsEnvoyExtProc(request_body=envoy_body(b"body"), response_headers=envoy_headers({}))
+    responses = [r async for r in P.Process(E, None)]
+    body = responses[1].request_body.response.header_mutation
+    assert [o.header.key for o in body.set_headers] == ["x-canned"]
+    headers = responses[3].response_headers.response.header_mutation
+    assert "x-leak" not in [o.header.key for o in headers.set_headers]
+
+
+def free_port() -> int:
+    with socket.socket(socket.AF_INET6, socket.SOCK_STREAM) as sock:
+        sock.bind(("::", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("generic", (False, True))
+async def test_generic_server(generic: bool) -> None:
+    port = free_port()
+    P = Canned(instrumentation="noop")
+    server = create_server(P, port=port, generic=generic)
+    assert P.preserialized == generic
+    await server.start()
+    try:
+        async with insecure_channel(f"localhost:{port}") as channel:
+            E = AsEnvoyExtProc(request_headers=envoy_headers({}), request_body=envoy_body(b"body"))
+            responses = [r async for r in ExternalProcessorStub(channel).Process(E.__aiter__())]
+    finally:
+        await server.stop(None)
+    assert [r.WhichOneof("response") for r in responses] == [
+        "request_headers",
+        "request_body",
+        "request_trailers",
+        "response_headers",
+        "response_body",
+        "response_trailers",
+    ]
+    assert responses[1].SerializeToString() == CONTINUE
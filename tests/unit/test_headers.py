@@ -0,0 +1,140 @@
+from envoy_extproc_sdk import BaseExtProcService
+from envoy_extproc_sdk.testing import AsEnvoyExtProc, envoy_body, envoy_headers
+from envoy_extproc_sdk.util.envoy import (
+    EnvoyHeaderMap,
+    EnvoyHeaderValue,
+    ext_api,
+)
+from envoy_extproc_sdk.util.headers import HeaderExtractor, HeaderView
+from examples import EchoExtProcService
+import pytest
+
+MULTI = ext_api.HttpHeaders(
+    headers=EnvoyHeaderMap(
+        headers=[
+            EnvoyHeaderValue(key="cookie", value="a=1"),
+            EnvoyHeaderValue(key="x-request-id", value="abc"),
+            EnvoyHeaderValue(key="cookie", value="b=2"),
+        ]
+    )
+)
+
+
+def test_header_view() -> None:
+    view = HeaderView(MULTI)
+    assert len(view) == 3
+    assert view.get("cookie") == "a=1"
+    assert view.get_last("cookie") == "b=2"
+    assert view.get_all("cookie") == ["a=1", "b=2"]
+    assert view.get("missing") is None
+    assert view.get("missing", "default") == "default"
+    assert view.get_all("missing") == []
+    assert "x-request-id" in view
+    assert list(view.items()) == [("cookie", "a=1"), ("cookie", "b=2"), ("x-request-id", "abc")]
+
+
+def test_header_view_helpers() -> None:
+    view = HeaderView(MULTI)
+    assert HeaderView.cached(MULTI) is None
+    assert HeaderView.cached(view) is view
+    view.activate()
+    assert HeaderView.cached(MULTI) is view
+    assert HeaderView.of(MULTI) is view
+    # the helpers agree with and without a view
+    for headers in (MULTI, view, envoy_headers({"cookie": "a=1", "x-request-id": "abc"})):
+        assert BaseExtProcService.get_header(headers, "Cookie") == "a=1"
+        assert BaseExtProcService.get_header(headers, "x-missing") is None
+        assert BaseExtProcService.get_headers(headers, {"x-request-id": "id"}) == {"id": "abc"}
+
+
+@pytest.mark.asyncio
+async def test_context_headers() -> None:
+    P = BaseExtProcService()
+    seen = []
+
+    @P.process("request_headers")
+    def headers(headers, context, request, response):
+        seen.append(request.headers)
+        return response
+
+    E = AsEnvoyExtProc(request_headers=MULTI)
+    async for _ in P.Process(E, None):
+        pass
+    assert seen[0].message == MULTI
+    assert seen[0].get_all("cookie") == ["a=1", "b=2"]
+
+
+@pytest.mark.asyncio
+async def test_chain_header_on_body_phase_immediate_response() -> None:
+    P = EchoExtProcService()
+    E = AsEnvoyExtProc(
+        request_headers=envoy_headers({"x-echo-only": "true"}),
+        request_body=envoy_body("echo"),
+    )
+    responses = [r async for r in P.Process(E, None)]
+    assert responses[1].WhichOneof("response") == "immediate_response"
+    headers = {
+        h.header.key: h.header.value for h in responses[1].immediate_response.headers.set_headers
+    }
+    assert headers["x-ext-procs-applied"] == "EchoExtProcService"
+
+
+def test_header_extractor() -> None:
+    extract = HeaderExtractor({"Content-Length": ("content_length", int), "cookie": "cookie"})
+    headers = envoy_headers({"content-length": "12", "other": "header"})
+    assert extract(headers) == {"content_length": 12, "cookie": None}
+    assert extract(HeaderView(MULTI)) == {"content_length": None, "cookie": "b=2"}
+    assert extract(envoy_headers({"content-length": "twelve"})) == {
+        "content_length": None,
+        "cookie": None,
+    }
+    merged = extract.merge({"cookie": "cookies", "x-request-id": "__id"})
+    assert merged(MULTI) == {"content_length": None, "cookies": "b=2", "__id": "abc"}
+
+
+class DeclaringExtProcService(BaseExtProcService):
+    REQUEST_HEADERS = {"x-tenant-id": "tenant"}
+    RESPONSE_HEADERS = {"content-length": ("content_length", int)}
+
+
+class InheritingExtProcService(DeclaringExtProcService):
+    REQUEST_HEADERS = {"x-api-key": "key"}
+
+
+def test_declared_headers() -> None:
+    P = InheritingExtProcService()
+    assert P.request_header_extractor(
+        envoy_headers({":method": "get", "x-tenant-id": "t", "x-api-key": "k"})
+    ) == {
+        "method": "get",
+        "path": None,
+        "content_type": None,
+        "content_length": None,
+        "__id": None,
+        "tenant": "t",
+        "key": "k",
+    }
+    assert P.response_header_extractor(envoy_headers({"content-length": "3"})) == {
+        "content_type": None,
+        "content_length": 3,
+    }
+    # declarations on a subclass don't leak to the base class
+    assert "tenant" not in BaseExtProcService.request_header_extractor.fields
+
+
+@pytest.mark.asyncio
+async def test_declared_headers_on_instance() -> None:
+    P = BaseExtProcService(request_headers={"x-tenant-id": "tenant"})
+    seen = {}
+
+    @P.process("request_headers")
+    def headers(headers, context, request, response):
+        seen.update(request)
+        return response
+
+    E = AsEnvoyExtProc(request_headers=envoy_headers({":path": "/", "x-tenant-id": "t"}))
+    async for _ in P.Process(E, None):
+        pass
+    assert seen["tenant"] == "t"
+    assert seen["path"] == "/"
+    assert "tenant" not in BaseExtProcService().request_header_extractor.fields
@@ -0,0 +1,110 @@
+from uuid import uuid4
+
+from envoy_extproc_sdk import BaseExtProcService
+from envoy_extproc_sdk.instrumentation import (
+    get_instrumentation,
+    InMemoryInstrumentation,
+    NoopInstrumentation,
+    Sampler,
+)
+from envoy_extproc_sdk.testing import AsEnvoyExtProc, envoy_headers
+from envoy_extproc_sdk.util.envoy import ext_api
+import pytest
+
+
+@pytest.mark.parametrize(
+    "spec, kind",
+    (
+        ("noop", NoopInstrumentation),
+        ("None", NoopInstrumentation),
+        ("memory", InMemoryInstrumentation),
+    ),
+)
+def test_get_instrumentation(spec: str, kind: type) -> None:
+    assert isinstance(get_instrumentation(spec), kind)
+
+
+def test_get_unknown_instrumentation() -> None:
+    with pytest.raises(ValueError):
+        get_instrumentation("unknown")
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("override_modes")
+async def test_in_memory_instrumentation() -> None:
+    instrumentation = InMemoryInstrumentation()
+    P = BaseExtProcService(instrumentation=instrumentation)
+    E = AsEnvoyExtProc(request_headers=envoy_headers([("x-request-id", "abc")]))
+    async for _ in P.Process(E, None):
+        pass
+    assert instrumentation.streams == 1
+    # phases only the base (no-op) handlers handle aren't processed at all
+    assert [p.phase for p in instrumentation.phases] == ["request_headers", "response_headers"]
+    assert all(p.request == "abc" for p in instrumentation.phases)
+
+
+@pytest.mark.asyncio
+async def test_noop_instrumentation() -> None:
+    P = BaseExtProcService(instrumentation="noop")
+    overheads = []
+
+    @P.process("response_trailers")
+    def handler(trailers, context, request, response):
+        overheads.append(request["__overhead_ns"])
+        return response
+
+    responses = [r async for r in P.Process(AsEnvoyExtProc(), None)]
+    assert len(responses) == 6
+    assert overheads == [0]
+
+
+def headers_request(headers: dict) -> ext_api.ProcessingRequest:
+    return ext_api.ProcessingRequest(request_headers=envoy_headers(headers))
+
+
+def test_sampler_rate() -> None:
+    assert Sampler(rate=1.0).sample(headers_request({}))
+    assert not Sampler(rate=0.0).sample(headers_request({}))
+    with pytest.raises(ValueError):
+        Sampler(rate=2.0)
+
+
+def test_sampler_by_request_id() -> None:
+    S = Sampler(rate=0.5, by_request_id=True)
+    for _ in range(100):
+        req = headers_request({"x-request-id": str(uuid4())})
+        assert S.decide(req) == S.decide(req)
+    for _ in range(1000):
+        S.sample(headers_request({"x-request-id": str(uuid4())}))
+    assert S.sampled + S.dropped == 1000
+    assert 400 < S.sampled < 600
+
+
+@pytest.mark.parametrize(
+    "rate, priority, sampled",
+    (
+        (0.0, "1", True),
+        (0.0, "2", True),
+        (1.0, "0", False),
+        (1.0, "-1", False),
+        (1.0, "garbage", True),
+    ),
+)
+def test_sampler_priority_header(rate: float, priority: str, sampled: bool) -> None:
+    S = Sampler(rate=rate, priority_header="x-datadog-sampling-priority")
+    req = headers_request({"x-datadog-sampling-priority": priority})
+    assert S.sample(req) == sampled
+    assert S.stats() == {"sampled": int(sampled), "dropped": int(not sampled)}
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("override_modes")
+async def test_unsampled_streams_skip_spans() -> None:
+    instrumentation = InMemoryInstrumentation(sampler=Sampler(rate=0.0))
+    P = BaseExtProcService(instrumentation=instrumentation)
+    for _ in range(3):
+        async for _ in P.Process(AsEnvoyExtProc(), None):
+            pass
+    assert instrumentation.streams == 0
+    assert instrumentation.sampler.stats() == {"sampled": 0, "dropped": 3}
+    assert len(instrumentation.phases) == 6
@@ -0,0 +1,152 @@
+import asyncio
+import json
+from typing import List
+
+from envoy_extproc_sdk.jsonpath import JsonFieldExtractor, parse_path
+from envoy_extproc_sdk.testing import (
+    AsEnvoyExtProc,
+    envoy_body_chunks,
+    envoy_headers,
+)
+from examples import TenantCheckExtProcService
+import pytest
+
+DOCUMENT = {
+    "items": [{"id": 1, "tags": ["a", "b"]}, {"id": 2, "note": 'with "quotes" and ]}'}],
+    "meta": {"idempotency_key": "key-é\\1", "nested": {"x": [1, 2.5e3, None]}},
+    "ok": True,
+    "tenant_id": "tenant",
+}
+
+
+def pieces(data: bytes, size: int) -> List[bytes]:
+    return [data[i : i + size] for i in range(0, len(data), size)]
+
+
+def test_parse_path() -> None:
+    assert parse_path("tenant_id") == ("tenant_id",)
+    assert parse_path("$.meta.idempotency_key") == ("meta", "idempotency_key")
+    assert parse_path("items[0].id") == ("items", 0, "id")
+    assert parse_path("$[1]") == (1,)
+    for path in ("", "$", "a..b", "a[x]", "a[0"):
+        with pytest.raises(ValueError):
+            parse_path(path)
+
+
+@pytest.mark.parametrize("size", (1, 2, 7, 1000))
+@pytest.mark.parametrize("indent", (None, 2))
+def test_extracts_across_pieces(size: int, indent) -> None:
+    paths = [
+        "tenant_id",
+        "meta.idempotency_key",
+        "items[1].note",
+        "items[0].tags",
+        "items[0].tags[1]",
+        "meta.nested.x[1]",
+        "meta.nested.x[2]",
+        "ok",
+    ]
+    data = json.dumps(DOCUMENT, indent=indent).encode()
+    extractor = JsonFieldExtractor(paths)
+    for piece in pieces(data, size):
+        if extractor.feed(piece):
+            break
+    assert extractor.done and not extractor.missing
+    assert extractor.found == {
+        "tenant_id": "tenant",
+        "meta.idempotency_key": "key-é\\1",
+        "items[1].note": 'with "quotes" and ]}',
+        "items[0].tags": ["a", "b"],
+        "items[0].tags[1]": "b",
+        "meta.nested.x[1]": 2500.0,
+        "meta.nested.x[2]": None,
+        "ok": True,
+    }
+
+
+def test_done_once_found() -> None:
+    extractor = JsonFieldExtractor(["a"])
+    assert not extractor.feed(b'{"big": [' + b"1," * 1000)
+    assert extractor.feed(b'1], "a": 12, "rest": ')
+    assert extractor.found == {"a": 12}
+    # whatever follows is ignored, even if it isn't JSON
+    assert extractor.feed(b"garbage")
+
+
+def test_number_split_across_pieces() -> None:
+    extractor = JsonFieldExtractor(["n"])
+    assert not extractor.feed(b'{"n": 12')
+    assert extractor.feed(b"34}")
+    assert extractor.found == {"n": 1234}
+
+
+def test_long_strings_across_pieces() -> None:
+    # an unwanted string is skipped as it arrives, not held until it ends
+    blob = 'x\\"y' * 100_000
+    data = json.dumps({"blob": blob, "tenant_id": "t", "note": blob}).encode()
+    extractor = JsonFieldExtractor(["tenant_id", "note"])
+    for piece in pieces(data, 1000):
+        extractor.feed(piece)
+        assert len(extractor._buffer) < 1000
+    assert extractor.found == {"tenant_id": "t", "note": blob}
+
+    # as is one that's the whole document
+    extractor = JsonFieldExtractor(["a"])
+    assert not extractor.feed(b'"' + b"x" * 1000)
+    assert extractor.feed(b'"', final=True) and extractor.missing == ["a"]
+
+
+def test_missing_at_end_of_stream() -> None:
+    extractor = JsonFieldExtractor(["a", "b.c", "d[3]"])
+    assert not extractor.feed(b'{"a": "x", "b": {"c"')
+    assert extractor.feed(b': 1}, "d": [1]', final=True)  # (truncated)
+    assert extractor.found == {"a": "x", "b.c": 1}
+    assert extractor.missing == ["d[3]"]
+
+
+@pytest.mark.parametrize(
+    "data", (b'{"a" 1}', b'{"a": tru}', b'{"a": 1]', b"{a: 1}", b"[1, }", b'{"a": "x')
+)
+def test_malformed(data: bytes) -> None:
+    extractor = JsonFieldExtractor(["b"])
+    with pytest.raises(ValueError):
+        extractor.feed(data, final=True)
+    assert extractor.done
+
+
+@pytest.mark.asyncio
+async def test_future_resolves_when_found() -> None:
+    extractor = JsonFieldExtractor(["a", "b"])
+    future = extractor.future
+    extractor.feed(b'{"a": 1, ')
+    await asyncio.sleep(0)
+    assert not future.done()
+    extractor.feed(b'"b": [2]}')
+    assert await asyncio.wait_for(future, 1) == {"a": 1, "b": [2]}
+    # resolved already if done before asked
+    extractor = JsonFieldExtractor(["a"])
+    extractor.feed(b"{}", final=True)
+    assert await extractor.future == {}
+
+
+@pytest.mark.asyncio
+async def test_tenant_check_decides_early() -> None:
+    body = json.dumps({"tenant_id": "other", "data": "x" * 10_000}).encode()
+
+    P = TenantCheckExtProcService()
+    E = AsEnvoyExtProc(
+        request_headers=envoy_headers({":method": "post", ":path": "/", "x-tenant-id": "tenant"}),
+        request_body=envoy_body_chunks(body, chunk_size=1024),
+    )
+    responses = [r async for r in P.Process(E, None)]
+    # stopped at the first chunk
+    assert responses[1].WhichOneof("response") == "immediate_response"
+    assert responses[1].immediate_response.status.code == 403
+
+    body = json.dumps({"data": "x" * 10_000, "tenant_id": "tenant"}).encode()
+    E = AsEnvoyExtProc(
+        request_headers=envoy_headers({":method": "post", ":path": "/", "x-tenant-id": "tenant"}),
+        request_body=envoy_body_chunks(body, chunk_size=1024),
+    )
+    responses = [r async for r in P.Process(E, None)]
+    assert "immediate_response" not in [r.WhichOneof("response") for r in responses]
@@ -0,0 +1,140 @@
+from hashlib import sha256
+import pickle
+import socket
+
+from envoy.service.ext_proc.v3.external_processor_pb2_grpc import (
+    ExternalProcessorStub,
+)
+from envoy_extproc_sdk import BaseExtProcService
+from envoy_extproc_sdk.chain import apply_response
+from envoy_extproc_sdk.server import create_server
+from envoy_extproc_sdk.testing import (
+    AsEnvoyExtProc,
+    envoy_body,
+    envoy_headers,
+    envoy_set_headers_to_dict,
+)
+from envoy_extproc_sdk.util.envoy import ext_api
+from envoy_extproc_sdk.util.lazy import LazyHttpBody, LazyProcessingRequest
+from examples import DigestExtProcService
+from examples.digest import REQUEST_DIGEST_HEADER
+from grpc.aio import insecure_channel
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def always_lazy(monkeypatch) -> None:
+    monkeypatch.setattr(LazyProcessingRequest, "MIN_SIZE", 0)
+
+
+def lazy(req: ext_api.ProcessingRequest) -> LazyProcessingRequest:
+    return LazyProcessingRequest.FromString(req.SerializeToString())
+
+
+@pytest.mark.parametrize("size", (0, 1, 127, 128, 1024 * 1024))
+def test_lazy_body(size: int) -> None:
+    body = bytes(range(256)) * (size // 256) + b"x" * (size % 256)
+    req = lazy(
+        ext_api.ProcessingRequest(
+            response_body=ext_api.HttpBody(body=body, end_of_stream=True),
+            observability_mode=True,
+        )
+    )
+    assert isinstance(req, LazyProcessingRequest)
+    assert req.WhichOneof("request") == "response_body"
+    assert req.HasField("response_body")
+    data = getattr(req, "response_body")
+    assert isinstance(data.body, memoryview)
+    assert data.body == body
+    assert data.end_of_stream
+
+    # anything else decodes the message
+    assert req._message is None
+    assert req.observability_mode
+    assert not req.HasField("protocol_config")
+    assert req.message.response_body.body == body
+
+
+def test_small_messages_decoded(monkeypatch) -> None:
+    monkeypatch.setattr(LazyProcessingRequest, "MIN_SIZE", 1024)
+    req = ext_api.ProcessingRequest(request_body=envoy_body(b"body"))
+    assert lazy(req) == req
+    req = ext_api.ProcessingRequest(request_body=envoy_body(b"x" * 1024))
+    assert isinstance(lazy(req), LazyProcessingRequest)
+
+
+def test_lazy_only_for_bodies() -> None:
+    req = ext_api.ProcessingRequest(request_headers=envoy_headers({"a": "1"}))
+    assert lazy(req) == req
+    # unknown HttpBody fields are skipped
+    req = lazy(
+        ext_api.ProcessingRequest(
+            request_body=ext_api.HttpBody(body=b"body", end_of_stream_without_message=True)
+        )
+    )
+    assert req.request_body.body == b"body"
+    assert not req.request_body.end_of_stream
+
+
+def test_lazy_body_pickles_as_message() -> None:
+    body = LazyHttpBody(memoryview(b"body"), True)
+    assert pickle.loads(pickle.dumps(body)) == ext_api.HttpBody(body=b"body", end_of_stream=True)
+    assert body.message() == ext_api.HttpBody(body=b"body", end_of_stream=True)
+
+
+def test_apply_response_to_lazy_body() -> None:
+    body = LazyHttpBody(memoryview(b"body"), True)
+    assert apply_response(body, ext_api.CommonResponse()) is body
+    response = ext_api.CommonResponse(body_mutation=ext_api.BodyMutation(body=b"new"))
+    assert apply_response(body, response) == ext_api.HttpBody(body=b"new", end_of_stream=True)
+
+
+class LazyEnvoyExtProc(AsEnvoyExtProc):
+    """Sends messages as the lazy deserializer decodes them"""
+
+    async def __aiter__(self):
+        for msg in self.messages:
+            yield lazy(msg)
+
+
+@pytest.mark.asyncio
+async def test_process_lazy_bodies() -> None:
+    P = DigestExtProcService()
+    E = LazyEnvoyExtProc(
+        request_headers=envoy_headers({":method": "post", ":path": "/", "x-tenant-id": "t"}),
+        request_body=envoy_body(b"body"),
+    )
+    responses = [r async for r in P.Process(E, None)]
+    headers = envoy_set_headers_to_dict(responses[1].request_body.response)
+    assert REQUEST_DIGEST_HEADER in headers
+
+
+def free_port() -> int:
+    with socket.socket(socket.AF_INET6, socket.SOCK_STREAM) as sock:
+        sock.bind(("::", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.mark.asyncio
+async def test_lazy_server() -> None:
+    seen = []
+    P = BaseExtProcService(instrumentation="noop")
+
+    @P.process("request_body")
+    def request_body(body, context, request, response):
+        seen.append(body)
+        return P.add_header(response, "x-digest", sha256(body.body).hexdigest())
+
+    port = free_port()
+    server = create_server(P, port=port, lazy_bodies=True)
+    assert P.preserialized
+    await server.start()
+    try:
+        async with insecure_channel(f"localhost:{port}") as channel:
+            E = AsEnvoyExtProc(request_body=envoy_body(b"body"))
+            responses = [r async for r in ExternalProcessorStub(channel).Process(E.__aiter__())]
+    finally:
+        await server.stop(None)
+    assert isinstance(seen[0], LazyHttpBody)
+    headers = envoy_set_headers_to_dict(responses[1].request_body.response)
+    assert headers["x-digest"] == sha256(b"body").hexdigest()
@@ -0,0 +1,295 @@
+import asyncio
+from typing import List
+
+from envoy_extproc_sdk import BaseExtProcService, ext_api
+from envoy_extproc_sdk.instrumentation import InMemoryInstrumentation
+from envoy_extproc_sdk.limits import (
+    AdaptiveLimit,
+    AdmissionController,
+    Bulkhead,
+)
+from envoy_extproc_sdk.options import HandlerOptions
+from envoy_extproc_sdk.server import create_server
+from envoy_extproc_sdk.testing import (
+    AsEnvoyExtProc,
+    envoy_headers,
+    envoy_set_headers_to_dict,
+)
+from envoy_extproc_sdk.util.envoy import EnvoyProcessingMode
+import pytest
+
+
+def test_admission_controller() -> None:
+    admission = AdmissionController(max_streams=1, max_phases=0)
+    assert admission.max_phases is None
+    assert admission.admit_stream() and not admission.admit_stream()
+    admission.release_stream()
+    assert admission.admit_stream()
+    assert all(admission.admit_phase("request_body") for _ in range(100))
+    assert admission.stats() == {
+        "max_streams": 1,
+        "max_phases": None,
+        "streams": 1,
+        "phases": 100,
+        "shed_streams": 1,
+        "shed_phases": 0,
+    }
+    with pytest.raises(ValueError):
+        AdmissionController(max_streams=-1)
+    with pytest.raises(ValueError):
+        AdmissionController(on_overload="queue")
+
+
+class Clock:
+    def __init__(self) -> None:
+        self.now = 0
+
+    def __call__(self) -> int:
+        return self.now
+
+    def run(
+        self, limit: AdaptiveLimit, latency_ms: float, seconds: float, in_flight: int = 0
+    ) -> None:
+        """record latencies over some (simulated) time, with the limit in use"""
+        for _ in range(int(seconds * 1000)):
+            self.now += 1_000_000
+            limit.record(int(latency_ms * 1_000_000), in_flight or limit.limit)
+
+
+def test_adaptive_limit() -> None:
+    clock = Clock()
+    limit = AdaptiveLimit(initial=10, min_limit=2, min_rtt_interval=10, clock=clock)
+
+    # pinned at min_limit until the min RTT is measured
+    assert limit.measuring and limit.limit == 2
+    clock.run(limit, 1, 0.05)
+    assert not limit.measuring and limit.min_rtt_ns == 1_000_000 and limit.limit == 10
+
+    # grows while latency stays near the min RTT, up to max_limit
+    clock.run(limit, 1.1, 1)
+    grown = limit.limit
+    assert 10 < grown < 1000 and limit.sample_rtt_ns == 1_100_000
+    # (but not while the load doesn't need it)
+    clock.run(limit, 1, 0.5, in_flight=2)
+    assert limit.limit == grown
+    clock.run(limit, 1.1, 2)
+    assert limit.limit == 1000
+
+    # shrinks as work queues
+    clock.run(limit, 4, 1.5)
+    assert limit.limit == 2
+
+    # handlers got slower: the next min RTT measured finds the new normal
+    clock.run(limit, 4, 7)
+    assert limit.min_rtt_ns == 4_000_000 and limit.limit > 2
+
+    with pytest.raises(ValueError):
+        AdaptiveLimit(initial=1, min_limit=2)
+
+
+class HeldExtProcService(BaseExtProcService):
+    """holds its first request in the request headers until released"""
+
+    def __init__(self, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.held, self.release = asyncio.Event(), asyncio.Event()
+
+    async def process_request_headers(self, headers, context, request, response):
+        if not self.held.is_set():
+            self.held.set()
+            await self.release.wait()
+        request.mutations.set("x-processed", "yes")
+        return response
+
+
+async def shed(P: HeldExtProcService) -> List[ext_api.ProcessingResponse]:
+    """the responses to a stream while another is held"""
+    held = asyncio.create_task(collect(P))
+    await P.held.wait()
+    responses = await collect(P)
+    P.release.set()
+    assert "immediate_response" not in [r.WhichOneof("response") for r in await held]
+    return responses
+
+
+async def collect(P: BaseExtProcService) -> List[ext_api.ProcessingResponse]:
+    E = AsEnvoyExtProc(request_headers=envoy_headers({":path": "/"}))
+    return [r async for r in P.Process(E, None)]
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("override_modes")
+async def test_streams_shed_continue() -> None:
+    P = HeldExtProcService(instrumentation="noop")
+    P.admission = AdmissionController(max_streams=1, on_overload="continue")
+    responses = await shed(P)
+
+    # every phase continues unprocessed, and envoy is asked to skip the rest
+    assert [r.WhichOneof("response") for r in responses] == [
+        "request_headers",
+        "request_body",
+        "request_trailers",
+        "response_headers",
+        "response_body",
+        "response_trailers",
+    ]
+    assert not envoy_set_headers_to_dict(responses[0].request_headers.response)
+    mode = responses[0].mode_override
+    assert mode.request_body_mode == EnvoyProcessingMode.NONE
+    assert mode.response_header_mode == EnvoyProcessingMode.SKIP
+    assert P.admission.stats()["shed_streams"] == 1
+    assert P.admission.streams == 0
+
+
+@pytest.mark.asyncio
+async def test_streams_shed_error() -> None:
+    instrumentation = InMemoryInstrumentation()
+    P = HeldExtProcService(instrumentation=instrumentation)
+    P.admission = AdmissionController(max_streams=1, on_overload="error")
+    responses = await shed(P)
+
+    assert len(responses) == 1
+    assert responses[0].immediate_response.status.code == 503
+    assert len(instrumentation.sheds) == 1
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("on_overload", ("continue", "error"))
+async def test_phases_shed(on_overload: str) -> None:
+    instrumentation = InMemoryInstrumentation()
+    P = HeldExtProcService(instrumentation=instrumentation)
+    P.admission = AdmissionController(max_phases=1, on_overload=on_overload)
+    responses = await shed(P)
+
+    if on_overload == "error":
+        assert responses[0].immediate_response.status.code == 503
+    else:
+        assert not envoy_set_headers_to_dict(responses[0].request_headers.response)
+        # (the shed response headers still reveal the chain)
+        assert envoy_set_headers_to_dict(responses[3].response_headers.response) == {
+            "x-ext-procs-applied": P.name
+        }
+    # (and so was the chain header's response headers phase)
+    assert [r.phase for r in instrumentation.sheds][0] == "request_headers"
+    assert P.admission.stats()["shed_phases"] == len(instrumentation.sheds)
+    assert P.admission.phases == 0
+    # with room again, phases are processed
+    responses = await collect(P)
+    assert envoy_set_headers_to_dict(responses[0].request_headers.response) == {
+        "x-processed": "yes"
+    }
+
+
+@pytest.mark.asyncio
+async def test_phases_shed_adaptively() -> None:
+    P = HeldExtProcService(instrumentation="noop")
+    P.admission = AdmissionController(adaptive=lambda: AdaptiveLimit(min_limit=1, initial=1))
+    responses = await shed(P)
+
+    assert not envoy_set_headers_to_dict(responses[0].request_headers.response)
+    stats = P.admission.stats()
+    assert stats["shed_phases"] >= 1
+    assert stats["adaptive"]["request_headers"]["limit"] == 1
+    assert not any(P.admission.in_flight.values())
+
+
+@pytest.mark.asyncio
+async def test_server_admission() -> None:
+    P = BaseExtProcService()
+    admission = AdmissionController(max_streams=1)
+    create_server(P, port=0, generic=True, admission=admission)
+    assert P.admission is admission
+    # shed streams' responses are built (and serialized) once
+    response = P.overload_response("request_body")
+    assert isinstance(response, bytes) and P.overload_response("request_body") is response
+
+
+@pytest.mark.asyncio
+async def test_bulkhead() -> None:
+    bulkhead = Bulkhead(1, max_queue=1)
+    assert await bulkhead.acquire()
+    waiting = asyncio.create_task(bulkhead.acquire())
+    await asyncio.sleep(0)
+    assert bulkhead.queued == 1
+    assert not await bulkhead.acquire()  # (full, and its queue too)
+    bulkhead.release()
+    assert await waiting and bulkhead.running == 1
+    bulkhead.release()
+    assert bulkhead.stats() == {
+        "max_concurrency": 1,
+        "max_queue": 1,
+        "running": 0,
+        "queued": 0,
+        "peak_queued": 1,
+        "waited": 1,
+        "rejected": 1,
+    }
+
+    # waiting past the queue, and giving up waiting
+    bulkhead = Bulkhead(1, overflow="wait")
+    assert await bulkhead.acquire()
+    waiting = [asyncio.create_task(bulkhead.acquire()) for _ in range(3)]
+    await asyncio.sleep(0)
+    assert bulkhead.queued == 3
+    waiting[0].cancel()
+    await asyncio.sleep(0)
+    assert bulkhead.queued == 2
+    bulkhead.release()
+    assert await waiting[1]
+    bulkhead.release()
+    bulkhead.release()
+    assert await waiting[2] and bulkhead.running == 0
+    assert bulkhead.rejected == 0
+
+    for options in ({"max_concurrency": 0}, {"max_queue": -1}, {"overflow": "drop"}):
+        with pytest.raises(ValueError):
+            HandlerOptions(**options)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("overflow", ("continue", "error", "wait"))
+async def test_handler_bulkheads(overflow: str) -> None:
+    instrumentation = InMemoryInstrumentation()
+    P = BaseExtProcService(instrumentation=instrumentation)
+    held, release = asyncio.Event(), asyncio.Event()
+
+    @P.process("request_headers")
+    def fast(headers, context, request, response):
+        request.mutations.set("x-fast", "yes")
+        return response
+
+    @P.process("response_headers", max_concurrency=1, overflow=overflow)
+    async def audit(headers, context, request, response):
+        if not held.is_set():
+            held.set()
+            await release.wait()
+        request.mutations.set("x-audited", "yes")
+        return response
+
+    first = asyncio.create_task(collect(P))
+    await held.wait()
+    second = asyncio.create_task(collect(P))
+    for _ in range(5):
+        await asyncio.sleep(0)
+    release.set()
+    await first
+    responses = {r.WhichOneof("response"): r for r in await second}
+
+    # other handlers are unaffected by a full bulkhead
+    assert envoy_set_headers_to_dict(responses["request_headers"].request_headers.response) == {
+        "x-fast": "yes"
+    }
+    stats = P.bulkhead_stats()["response_headers"]
+    if overflow == "wait":
+        audited = envoy_set_headers_to_dict(responses["response_headers"].response_headers.response)
+        assert audited["x-audited"] == "yes"
+        assert stats["waited"] == 1 and stats["rejected"] == 0
+    elif overflow == "error":
+        assert responses["immediate_response"].immediate_response.status.code == 503
+        assert stats["rejected"] == 1
+    else:
+        audited = envoy_set_headers_to_dict(responses["response_headers"].response_headers.response)
+        assert audited == {"x-ext-procs-applied": P.name}  # (still revealing the chain)
+        assert stats["rejected"] == 1
+        assert [r.phase for r in instrumentation.sheds] == ["response_headers"]
+    assert stats["running"] == 0
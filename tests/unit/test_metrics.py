@@ -0,0 +1,134 @@
+import asyncio
+
+from envoy_extproc_sdk import (
+    BaseExtProcService,
+    ChainedExtProcService,
+    ext_api,
+    StopRequestProcessing,
+)
+from envoy_extproc_sdk.limits import AdmissionController
+from envoy_extproc_sdk.metrics import Histogram, Metrics, start_metrics_server
+from envoy_extproc_sdk.server import create_server
+from envoy_extproc_sdk.testing import AsEnvoyExtProc, envoy_body, envoy_headers
+from envoy_extproc_sdk.util.envoy import EnvoyHttpStatusCode
+import pytest
+
+
+def measured(name: str) -> BaseExtProcService:
+    P = BaseExtProcService(name=name, instrumentation="noop")
+
+    @P.process("request_headers")
+    def headers(headers, context, request, response):
+        return response
+
+    @P.process("request_body")
+    def body(body, context, request, response):
+        if body.body == b"stop":
+            response = P.form_immediate_response(EnvoyHttpStatusCode.Forbidden, {}, b"no")
+            raise StopRequestProcessing(response=response, reason="forbidden")
+        if body.body == b"fail":
+            raise ValueError(body.body)
+        return response
+
+    return P
+
+
+async def process(P: BaseExtProcService, body: bytes) -> None:
+    E = AsEnvoyExtProc(request_headers=envoy_headers({}), request_body=envoy_body(body))
+    _ = [r async for r in P.Process(E, None)]
+
+
+def test_histogram() -> None:
+    histogram = Histogram([1000, 10000, 100000])
+    for value in (500, 1000, 1001, 5000, 10**6):
+        histogram.observe(value)
+    assert histogram.counts == [2, 2, 0, 1]
+    assert histogram.count == 5 and histogram.sum_ns == 1007501
+    assert histogram.quantile(0.4) == 1000 and histogram.quantile(0.8) == 10000
+    assert histogram.quantile(1.0) is None and Histogram().quantile(0.5) is None
+
+
+@pytest.mark.asyncio
+async def test_service_metrics() -> None:
+    P = measured("measured")
+    metrics = Metrics()
+    create_server(service=P, metrics=metrics, admission=AdmissionController(max_streams=10))
+    assert P.metrics is metrics and metrics.services == [P]
+
+    await process(P, b"ok")
+    await process(P, b"stop")
+    with pytest.raises(ValueError):
+        await process(P, b"fail")
+
+    async def cancelled():
+        yield ext_api.ProcessingRequest(request_headers=envoy_headers({}))
+        raise asyncio.CancelledError()
+
+    _ = [r async for r in P.Process(cancelled(), None)]
+
+    assert metrics.phases[("measured", "request_headers")].count == 4
+    assert metrics.phases[("measured", "request_body")].count == 2  # (errors aren't timed)
+    assert metrics.streams == {"measured": 4} and metrics.cancelled == {"measured": 1}
+    assert metrics.stopped == {("measured", "request_body", "403"): 1}
+    assert metrics.errors == {("measured", "request_body", "ValueError"): 1}
+
+    text = metrics.render()
+    labels = 'processor="measured",phase="request_body"'
+    assert "# TYPE extproc_phase_duration_seconds histogram" in text
+    assert f'extproc_phase_duration_seconds_bucket{{{labels},le="+Inf"}} 2' in text
+    assert f"extproc_phase_duration_seconds_count{{{labels}}} 2" in text
+    assert 'extproc_streams_total{processor="measured"} 4' in text
+    assert 'extproc_cancelled_total{processor="measured"} 1' in text
+    assert f'extproc_stopped_total{{{labels},status="403"}} 1' in text
+    assert f'extproc_errors_total{{{labels},error="ValueError"}} 1' in text
+    assert "extproc_admission_streams 0" in text
+    assert 'extproc_admission_shed_total{what="stream"} 0' in text
+    # families with no samples are left out
+    assert "bulkhead" not in text and "scheduler" not in text
+
+
+@pytest.mark.asyncio
+async def test_unmeasured_services() -> None:
+    P = measured("unmeasured")
+    await process(P, b"stop")
+    assert P.metrics is None
+
+
+@pytest.mark.asyncio
+async def test_chain_metrics() -> None:
+    C = ChainedExtProcService([measured("first"), measured("second")], name="chain")
+    metrics = Metrics()
+    create_server(service=C, metrics=metrics)
+    await process(C, b"stop")
+
+    for processor in ("chain", "first"):
+        assert metrics.phases[(processor, "request_body")].count == 1
+    assert ("second", "request_body") not in metrics.phases
+    assert metrics.stopped == {
+        ("first", "request_body", "403"): 1,
+        ("chain", "request_body", "403"): 1,
+    }
+
+
+@pytest.mark.asyncio
+async def test_metrics_server() -> None:
+    metrics = Metrics()
+    metrics.observe("P", "request_headers", 3000)
+    server = await start_metrics_server(metrics, port=0, host="127.0.0.1")
+    port = server.sockets[0].getsockname()[1]
+
+    async def get(path: str) -> bytes:
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(f"GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+        response = await reader.read()
+        writer.close()
+        return response
+
+    try:
+        response = await get("/metrics")
+        assert response.startswith(b"HTTP/1.1 200 OK\r\n")
+        assert b'extproc_phase_duration_seconds_bucket{processor="P"' in response
+        assert (await get("/other")).startswith(b"HTTP/1.1 404")
+    finally:
+        server.close()
+        await server.wait_closed()
@@ -0,0 +1,134 @@
+from typing import Optional
+
+from envoy_extproc_sdk import BaseExtProcService, ChainedExtProcService
+from envoy_extproc_sdk.context import RequestContext
+from envoy_extproc_sdk.testing import AsEnvoyExtProc, envoy_headers
+from envoy_extproc_sdk.util.envoy import EnvoyProcessingMode
+from examples import TimerExtProcService, TrivialExtProcService
+import pytest
+
+pytestmark = pytest.mark.usefixtures("override_modes")
+
+
+async def mode_override(
+    P: BaseExtProcService, E: Optional[AsEnvoyExtProc] = None
+) -> Optional[EnvoyProcessingMode]:
+    E = E or AsEnvoyExtProc(request_headers=envoy_headers({}))
+    responses = [r async for r in P.Process(E, None)]
+    # only the response to the request headers can override the mode
+    assert not any(r.HasField("mode_override") for r in responses[1:])
+    first = responses[0]
+    return first.mode_override if first.HasField("mode_override") else None
+
+
+class Skipper(BaseExtProcService):
+    """Handles both bodies, but skips those named in a header"""
+
+    def process_request_headers(self, headers, context, request, response):
+        skip = request.headers.get("x-skip")
+        if skip:
+            request.skip(*skip.split(","))
+        return response
+
+    def process_request_body(self, body, context, request, response):
+        return response
+
+    def process_response_body(self, body, context, request, response):
+        return response
+
+
+@pytest.mark.asyncio
+async def test_skips_unhandled_phases() -> None:
+    mode = await mode_override(TrivialExtProcService())
+    assert mode.request_header_mode == EnvoyProcessingMode.SEND
+    assert mode.response_header_mode == EnvoyProcessingMode.SEND
+    assert mode.request_body_mode == EnvoyProcessingMode.NONE
+    assert mode.response_body_mode == EnvoyProcessingMode.NONE
+
+    mode = await mode_override(TimerExtProcService())
+    assert mode.request_body_mode == EnvoyProcessingMode.NONE
+    assert mode.response_body_mode == EnvoyProcessingMode.BUFFERED
+
+    # the response headers are kept to reveal the chain
+    assert BaseExtProcService().handles("response_headers") is False
+    mode = await mode_override(BaseExtProcService())
+    assert mode.response_header_mode == EnvoyProcessingMode.SEND
+
+
+@pytest.mark.asyncio
+async def test_no_override_when_everything_is_handled() -> None:
+    assert await mode_override(Skipper()) is None
+
+    P = BaseExtProcService()
+
+    @P.process("request_body")
+    async def request_body(body, context, request, response):
+        return response
+
+    @P.process("response_body")
+    async def response_body(body, context, request, response):
+        return response
+
+    assert await mode_override(P) is None
+
+
+@pytest.mark.asyncio
+async def test_protocol_config_body_modes() -> None:
+    E = AsEnvoyExtProc(request_headers=envoy_headers({}))
+    E.messages[0].protocol_config.request_body_mode = EnvoyProcessingMode.STREAMED
+    E.messages[0].protocol_config.response_body_mode = EnvoyProcessingMode.NONE
+    mode = await mode_override(TimerExtProcService(), E)
+    assert mode.request_body_mode == EnvoyProcessingMode.NONE
+    assert mode.response_body_mode == EnvoyProcessingMode.NONE
+
+    E = AsEnvoyExtProc(request_headers=envoy_headers({}))
+    E.messages[0].protocol_config.response_body_mode = EnvoyProcessingMode.STREAMED
+    E.messages[0].protocol_config.request_body_mode = EnvoyProcessingMode.NONE
+    assert await mode_override(Skipper(), E) is None
+
+
+@pytest.mark.asyncio
+async def test_skip_per_request() -> None:
+    P = Skipper()
+    E = AsEnvoyExtProc(request_headers=envoy_headers({"x-skip": "response_body"}))
+    mode = await mode_override(P, E)
+    assert mode.request_body_mode == EnvoyProcessingMode.BUFFERED
+    assert mode.response_body_mode == EnvoyProcessingMode.NONE
+    # and requests that don't skip aren't affected
+    assert await mode_override(P) is None
+
+
+def test_skip_validates_phases() -> None:
+    request = RequestContext()
+    request.skip("request_body")
+    request.skip("response_body", "request_body")
+    assert request.skipped == {"request_body", "response_body"}
+    with pytest.raises(ValueError):
+        request.skip("request_headers")
+
+
+@pytest.mark.asyncio
+async def test_chain_skips_only_what_all_members_skip() -> None:
+    P = ChainedExtProcService([TrivialExtProcService(), TimerExtProcService()])
+    mode = await mode_override(P)
+    assert mode.request_body_mode == EnvoyProcessingMode.NONE
+    assert mode.response_body_mode == EnvoyProcessingMode.BUFFERED
+
+    class Keeper(Skipper):
+        def process_request_headers(self, headers, context, request, response):
+            return response
+
+    P = ChainedExtProcService([Skipper(), Keeper()])
+    E = AsEnvoyExtProc(request_headers=envoy_headers({"x-skip": "request_body"}))
+    assert await mode_override(P, E) is None
+
+    class Ignorer(Skipper):
+        async def process_request_headers(self, headers, context, request, response):
+            request.skip("request_body", "response_body")
+            return response
+
+    P = ChainedExtProcService([Skipper(), Ignorer()])
+    E = AsEnvoyExtProc(request_headers=envoy_headers({"x-skip": "request_body"}))
+    mode = await mode_override(P, E)
+    assert mode.request_body_mode == EnvoyProcessingMode.NONE
+    assert mode.response_body_mode == EnvoyProcessingMode.BUFFERED
@@ -0,0 +1,128 @@
+from envoy_extproc_sdk import (
+    BaseExtProcService,
+    ChainedExtProcService,
+    StopRequestProcessing,
+)
+from envoy_extproc_sdk.mutation import (
+    constant_header_option,
+    MutationBuilder,
+    omit_empty_mutation,
+)
+from envoy_extproc_sdk.testing import (
+    AsEnvoyExtProc,
+    envoy_body,
+    envoy_headers,
+    envoy_set_headers_to_dict,
+)
+from envoy_extproc_sdk.util.envoy import ext_api
+import pytest
+
+
+def test_builder_coalesces() -> None:
+    builder = MutationBuilder()
+    assert not builder
+    builder.set("X-A", "1").set("x-a", "2").set("x-b", "1").remove("x-b", "x-c")
+    builder.set("x-c", "3")
+    assert builder.get("x-a") == "2" and builder.removes("x-b")
+    assert dict(builder) == {"x-a": "2", "x-c": "3"}
+
+    response = builder.apply(ext_api.CommonResponse())
+    assert envoy_set_headers_to_dict(response) == {"x-a": "2", "x-c": "3"}
+    assert list(response.header_mutation.remove_headers) == ["x-b"]
+    assert not builder  # (cleared)
+
+    # trailers responses are HeaderMutations
+    mutation = MutationBuilder().update({"x-t": "t"}).apply(ext_api.HeaderMutation())
+    assert [option.header.key for option in mutation.set_headers] == ["x-t"]
+
+
+def test_empty_mutations_omitted() -> None:
+    response = MutationBuilder().apply(ext_api.CommonResponse())
+    assert not response.HasField("header_mutation")
+    response = ext_api.CommonResponse(header_mutation=ext_api.HeaderMutation())
+    omit_empty_mutation(response)
+    assert not response.HasField("header_mutation")
+    assert not BaseExtProcService.just_continue_response().HasField("header_mutation")
+
+
+def test_constant_options_prebuilt() -> None:
+    option = constant_header_option("x-version", "1")
+    assert constant_header_option("x-version", "1") is option
+    response = (
+        MutationBuilder().set("x-version", "1", constant=True).apply(ext_api.CommonResponse())
+    )
+    assert response.header_mutation.set_headers[0] == option
+
+
+@pytest.mark.asyncio
+async def test_mutations_in_process() -> None:
+    P = BaseExtProcService(instrumentation="noop")
+
+    @P.process("request_headers")
+    def request_headers(headers, context, request, response):
+        request.mutations.set("x-a", "1").remove("x-internal")
+        request.mutations.set("x-a", "2")
+        return response
+
+    @P.process("request_body")
+    def request_body(body, context, request, response):
+        return response  # changes nothing
+
+    @P.process("request_trailers")
+    def request_trailers(trailers, context, request, response):
+        request.mutations.set("x-trailer", "t")
+        return response
+
+    @P.process("response_body")
+    def response_body(body, context, request, response):
+        request.mutations.set("x-dropped", "1")
+        raise StopRequestProcessing(P.form_immediate_response(200, {}, b""))
+
+    @P.process("response_headers")
+    def response_headers(headers, context, request, response):
+        return response
+
+    E = AsEnvoyExtProc(
+        request_headers=envoy_headers({"x-internal": "secret"}),
+        request_body=envoy_body(b"body"),
+        request_trailers=ext_api.HttpTrailers(),
+        response_body=envoy_body(b"body"),
+        response_headers=envoy_headers({}),
+    )
+    responses = {r.WhichOneof("response"): r async for r in P.Process(E, None)}
+
+    mutation = responses["request_headers"].request_headers.response.header_mutation
+    assert envoy_set_headers_to_dict(responses["request_headers"].request_headers.response) == {
+        "x-a": "2"
+    }
+    assert list(mutation.remove_headers) == ["x-internal"]
+    assert not responses["request_body"].request_body.response.HasField("header_mutation")
+    trailers = responses["request_trailers"].request_trailers
+    assert [o.header.key for o in trailers.header_mutation.set_headers] == ["x-trailer"]
+    # what was collected before stopping isn't sent later
+    headers = envoy_set_headers_to_dict(responses["response_headers"].response_headers.response)
+    assert "x-dropped" not in headers
+
+
+class Setter(BaseExtProcService):
+    def __init__(self, key: str, value: str, **kwargs) -> None:
+        super().__init__(**kwargs)
+        self.key, self.value = key, value
+
+    def process_request_headers(self, headers, context, request, response):
+        request.mutations.set(self.key, self.value)
+        return response
+
+
+@pytest.mark.asyncio
+async def test_mutations_in_chain() -> None:
+    P = ChainedExtProcService(
+        [Setter("x-a", "1"), Setter("x-b", "2"), Setter("x-a", "3")], instrumentation="noop"
+    )
+    E = AsEnvoyExtProc(request_headers=envoy_headers({}))
+    responses = [r async for r in P.Process(E, None)]
+    headers = [
+        (o.header.key, o.header.value)
+        for o in responses[0].request_headers.response.header_mutation.set_headers
+    ]
+    assert headers == [("x-a", "1"), ("x-b", "2"), ("x-a", "3")]
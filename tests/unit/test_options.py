@@ -0,0 +1,230 @@
+import asyncio
+from threading import current_thread
+import time
+from typing import Dict
+
+from envoy_extproc_sdk import (
+    BaseExtProcService,
+    ext_api,
+    extproc,
+    handler_options,
+)
+from envoy_extproc_sdk.options import HandlerOptions
+from envoy_extproc_sdk.testing import (
+    AsEnvoyExtProc,
+    envoy_body,
+    envoy_headers,
+    envoy_set_headers_to_dict,
+)
+from envoy_extproc_sdk.util.envoy import EnvoyProcessingMode
+from grpc import ServicerContext
+import pytest
+
+
+def test_handler_options() -> None:
+    options = HandlerOptions(offload="thread", offload_threshold=10)
+    assert options.offload == "thread"
+    assert options.offload_threshold == 10
+    with pytest.raises(ValueError):
+        HandlerOptions(offload="elsewhere")
+    with pytest.raises(ValueError):
+        HandlerOptions(deadline=-1)
+    with pytest.raises(ValueError):
+        HandlerOptions(on_deadline="panic")
+
+
+def test_cant_offload_async_handlers() -> None:
+    P = BaseExtProcService()
+    with pytest.raises(ValueError):
+
+        @P.process("request_body", offload="thread")
+        async def body(body, context, request, response):
+            return response
+
+
+class ThreadedExtProcService(BaseExtProcService):
+    @handler_options(offload="thread", offload_threshold=4)
+    def process_request_body(
+        self,
+        body: ext_api.HttpBody,
+        context: ServicerContext,
+        request: Dict,
+        response: ext_api.CommonResponse,
+    ) -> ext_api.CommonResponse:
+        request["threads"] = request.get("threads", []) + [current_thread().name]
+        return response
+
+    def process_response_body(
+        self,
+        body: ext_api.HttpBody,
+        context: ServicerContext,
+        request: Dict,
+        response: ext_api.CommonResponse,
+    ) -> ext_api.CommonResponse:
+        self.add_header(response, "x-threads", ",".join(request["threads"]))
+        return response
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("body, offloaded", ((b"tiny", False), (b"larger", True)))
+async def test_thread_offload(body: bytes, offloaded: bool) -> None:
+    P = ThreadedExtProcService()
+    E = AsEnvoyExtProc(request_body=envoy_body(body))
+    async for response in P.Process(E, None):
+        if response.WhichOneof("response") == "response_body":
+            mutation = response.response_body.response.header_mutation
+            thread = mutation.set_headers[0].header.value
+    P.executors.shutdown()
+    assert thread.startswith("extproc") == offloaded
+
+
+def count_in_process(body, context, request, response):
+    assert context is None
+    request["size"] = len(body.body)
+    response.header_mutation.remove_headers.append("x-removed")
+    return response
+
+
+@pytest.mark.asyncio
+async def test_process_offload() -> None:
+    P = BaseExtProcService()
+    P.process("request_body", offload="process")(count_in_process)
+    sizes = []
+
+    @P.process("response_body")
+    def check(body, context, request, response):
+        sizes.append(request["size"])
+        return response
+
+    E = AsEnvoyExtProc(request_body=envoy_body(b"some body"))
+    async for response in P.Process(E, None):
+        if response.WhichOneof("response") == "request_body":
+            assert response.request_body.response.header_mutation.remove_headers == ["x-removed"]
+    P.executors.shutdown()
+    assert sizes == [9]
+
+
+def skip_in_process(headers, context, request, response):
+    request.skip("response_body")
+    return response
+
+
+@pytest.mark.asyncio
+async def test_process_offload_keeps_skips() -> None:
+    P = BaseExtProcService()
+    P.process("request_headers", offload="process")(skip_in_process)
+    skipped = []
+
+    @P.process("request_body")
+    def check(body, context, request, response):
+        skipped.append(request.skipped)
+        return response
+
+    E = AsEnvoyExtProc(request_headers=envoy_headers({}), request_body=envoy_body(b"body"))
+    _ = [r async for r in P.Process(E, None)]
+    P.executors.shutdown()
+    assert skipped == [frozenset({"response_body"})]
+
+
+class SlowExtProcService(BaseExtProcService):
+    @handler_options(deadline=0.01, on_deadline="error")
+    async def process_request_headers(self, headers, context, request, response):
+        await asyncio.sleep(float(request.headers.get("x-sleep") or 0))
+        request.mutations.set("x-finished", "yes")
+        return response
+
+    async def process_request_body(self, body, context, request, response):
+        await asyncio.sleep(0.05)
+        return self.add_header(response, "x-finished", "yes")
+
+
+def slow_headers(sleep: float) -> ext_api.HttpHeaders:
+    return envoy_headers({"x-sleep": str(sleep)})
+
+
+@pytest.mark.asyncio
+async def test_deadline_fallbacks(monkeypatch) -> None:
+    P = SlowExtProcService(instrumentation="memory")
+    assert P._dispatch["request_headers"].deadline == 0.01
+    assert P._dispatch["request_body"].deadline is None  # (none set globally)
+
+    # within the deadline
+    E = AsEnvoyExtProc(request_headers=slow_headers(0))
+    responses = [r async for r in P.Process(E, None)]
+    assert responses[0].request_headers.response.header_mutation.set_headers
+    assert not P.deadlines_expired
+
+    # past it, an immediate error
+    E = AsEnvoyExtProc(request_headers=slow_headers(1))
+    responses = [r async for r in P.Process(E, None)]
+    assert responses[0].immediate_response.status.code == 504
+    assert P.deadlines_expired == {"request_headers": 1}
+    assert [e.phase for e in P.instrumentation.expirations] == ["request_headers"]
+
+    # or (registered with process) continue, as if nothing changed
+    @P.process("request_headers", deadline=0.01, on_deadline="continue")
+    async def headers(headers, context, request, response):
+        await asyncio.sleep(1)
+        return P.add_header(response, "x-finished", "yes")
+
+    # (and, globally, a deadline for the rest)
+    monkeypatch.setattr(extproc, "HANDLER_DEADLINE", 0.01)
+    P._build_dispatch()
+    E = AsEnvoyExtProc(request_headers=slow_headers(0), request_body=envoy_body(b"body"))
+    responses = [r async for r in P.Process(E, None)]
+    assert not responses[0].request_headers.response.HasField("header_mutation")
+    assert responses[1] is P._dispatch["request_body"].unchanged_response
+    assert P.deadlines_expired == {"request_headers": 2, "request_body": 1}
+
+
+@pytest.mark.asyncio
+async def test_deadline_continue_reveals_chain() -> None:
+    P = BaseExtProcService(name="slow")
+
+    @P.process("response_headers", deadline=0.01, on_deadline="continue")
+    async def headers(headers, context, request, response):
+        P.add_header(response, "x-started", "yes")
+        await asyncio.sleep(1)
+        return response
+
+    E = AsEnvoyExtProc(response_headers=envoy_headers({}))
+    responses = [r async for r in P.Process(E, None)]
+    mutation = envoy_set_headers_to_dict(responses[3].response_headers.response)
+    assert mutation == {"x-ext-procs-applied": "slow"}
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("override_modes")
+async def test_deadline_skips() -> None:
+    P = BaseExtProcService()
+
+    @P.process("request_headers", deadline=0.01, on_deadline="skip")
+    async def headers(headers, context, request, response):
+        await asyncio.sleep(1)
+        return response
+
+    @P.process("response_body")
+    def body(body, context, request, response):
+        return response
+
+    E = AsEnvoyExtProc(request_headers=envoy_headers({}))
+    responses = [r async for r in P.Process(E, None)]
+    mode = responses[0].mode_override
+    assert mode.response_body_mode == EnvoyProcessingMode.NONE
+    assert mode.response_header_mode == EnvoyProcessingMode.SKIP
+
+
+@pytest.mark.asyncio
+async def test_deadline_abandons_offloaded_handlers() -> None:
+    P = BaseExtProcService()
+
+    @P.process("request_body", offload="thread", deadline=0.01)
+    def body(body, context, request, response):
+        time.sleep(0.1)
+        return P.add_header(response, "x-finished", "yes")
+
+    E = AsEnvoyExtProc(request_body=envoy_body(b"body"))
+    responses = [r async for r in P.Process(E, None)]
+    assert responses[1] is P._dispatch["request_body"].unchanged_response
+    assert P.deadlines_expired["request_body"] == 1
+    P.executors.shutdown()
@@ -0,0 +1,92 @@
+import asyncio
+from typing import List
+
+from envoy_extproc_sdk import BaseExtProcService
+from envoy_extproc_sdk.options import HandlerOptions
+from envoy_extproc_sdk.scheduler import PhaseScheduler
+from envoy_extproc_sdk.testing import AsEnvoyExtProc, envoy_body, envoy_headers
+import pytest
+
+
+async def run(scheduler: PhaseScheduler, name: str, priority: int, connection, order: List[str]):
+    await scheduler.acquire(name.split(":")[0], priority, connection)
+    order.append(name)
+    scheduler.release()
+
+
+@pytest.mark.asyncio
+async def test_priority_and_turns() -> None:
+    scheduler = PhaseScheduler(concurrency=1)
+    await scheduler.acquire("request_headers", 0)  # (holds the only slot)
+    order: List[str] = []
+    waiting = [
+        run(scheduler, "body:a1", 2, "a", order),
+        run(scheduler, "body:a2", 2, "a", order),
+        run(scheduler, "body:a3", 2, "a", order),
+        run(scheduler, "body:b1", 2, "b", order),
+        run(scheduler, "trailers:a", 1, "a", order),
+        run(scheduler, "headers:b", 0, "b", order),
+    ]
+    tasks = [asyncio.create_task(w) for w in waiting]
+    await asyncio.sleep(0)
+    assert scheduler.queued == 6 and not order
+    scheduler.release()
+    await asyncio.gather(*tasks)
+
+    # by priority, then connections take turns
+    assert order == ["headers:b", "trailers:a", "body:a1", "body:b1", "body:a2", "body:a3"]
+    stats = scheduler.stats()
+    assert stats["running"] == 0 and stats["queued"] == 0
+    assert stats["waits"]["body"]["count"] == 4 and stats["waits"]["body"]["max_ns"] > 0
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiters_skipped() -> None:
+    scheduler = PhaseScheduler(concurrency=1)
+    await scheduler.acquire("request_headers", 0)
+    order: List[str] = []
+    cancelled = asyncio.create_task(run(scheduler, "body:a", 2, "a", order))
+    waiting = asyncio.create_task(run(scheduler, "body:b", 2, "b", order))
+    await asyncio.sleep(0)
+    cancelled.cancel()
+    scheduler.release()
+    await waiting
+    assert order == ["body:b"] and scheduler.running == 0 and scheduler.queued == 0
+
+
+@pytest.mark.asyncio
+async def test_headers_ahead_of_bodies() -> None:
+    P = BaseExtProcService(instrumentation="noop")
+    P.scheduler = PhaseScheduler(concurrency=1)
+    calls: List[str] = []
+
+    @P.process("request_headers")
+    def headers(headers, context, request, response):
+        calls.append("headers")
+        return response
+
+    @P.process("request_body")
+    def body(body, context, request, response):
+        calls.append("body")  # (a heavy handler, holding the loop)
+        return response
+
+    async def stream():
+        E = AsEnvoyExtProc(request_headers=envoy_headers({}), request_body=envoy_body(b"x"))
+        return [r async for r in P.Process(E, None)]
+
+    await asyncio.gather(*[stream() for _ in range(3)])
+    assert calls == ["headers"] * 3 + ["body"] * 3
+    assert set(P.scheduler.waits) == {"request_headers", "request_body", "response_headers"}
+
+
+def test_priority_option() -> None:
+    P = BaseExtProcService()
+
+    @P.process("request_body", priority=-1)
+    def body(body, context, request, response):
+        return response
+
+    assert P._dispatch["request_body"].priority == -1
+    assert P._dispatch["request_headers"].priority == 0
+    with pytest.raises(ValueError):
+        HandlerOptions(priority="high")
@@ -0,0 +1,86 @@
+from hashlib import sha256
+from typing import Iterator
+
+from envoy_extproc_sdk import BaseExtProcService
+from envoy_extproc_sdk.testing import (
+    AsEnvoyExtProc,
+    envoy_body,
+    envoy_body_chunks,
+    envoy_headers,
+    envoy_set_headers_to_dict,
+)
+from examples import DigestExtProcService, StreamedDigestExtProcService
+from examples.digest import REQUEST_DIGEST_HEADER
+import pytest
+
+HEADERS = envoy_headers({":method": "post", ":path": "/api/v0/resource", "x-tenant-id": "tenant"})
+
+
+def test_envoy_body_chunks() -> None:
+    chunks = list(envoy_body_chunks(b"abcdefg", chunk_size=3))
+    assert [c.body for c in chunks] == [b"abc", b"def", b"g"]
+    assert [c.end_of_stream for c in chunks] == [False, False, True]
+    chunks = list(envoy_body_chunks(iter([b"ab", b"cd"])))
+    assert [(c.body, c.end_of_stream) for c in chunks] == [(b"ab", False), (b"cd", True)]
+    chunks = list(envoy_body_chunks(b""))
+    assert [(c.body, c.end_of_stream) for c in chunks] == [(b"", True)]
+
+
+@pytest.mark.asyncio
+async def test_chunk_handlers_and_context() -> None:
+    P = BaseExtProcService()
+    seen = []
+
+    @P.process("request_body_chunk")
+    def chunk(body, context, request, response):
+        c = request.chunk
+        seen.append((c.phase, c.index, c.offset, c.size, c.end_of_stream, body.body))
+        return response
+
+    @P.process("response_body")
+    def body(body, context, request, response):
+        c = request.chunk
+        seen.append((c.phase, c.index, c.offset, c.size, c.end_of_stream, body.body))
+        return response
+
+    assert P._dispatch["request_body"].action is chunk
+    E = AsEnvoyExtProc(
+        request_body=envoy_body_chunks(b"abcdefg", chunk_size=3),
+        response_body=envoy_body_chunks([b"xy"]),
+    )
+    responses = [r async for r in P.Process(E, None)]
+    # one response per chunk
+    assert [r.WhichOneof("response") for r in responses].count("request_body") == 3
+    assert seen == [
+        ("request_body", 0, 0, 3, False, b"abc"),
+        ("request_body", 1, 3, 3, False, b"def"),
+        ("request_body", 2, 6, 1, True, b"g"),
+        ("response_body", 0, 0, 2, True, b"xy"),
+    ]
+
+
+def generate(size: int, chunk_size: int) -> Iterator[bytes]:
+    for offset in range(0, size, chunk_size):
+        yield bytes([offset % 251]) * min(chunk_size, size - offset)
+
+
+@pytest.mark.asyncio
+async def test_streamed_digest_matches_buffered() -> None:
+    body = b"".join(generate(1_000_000, 10_000))
+
+    digests = []
+    for P, request_body in (
+        (DigestExtProcService(), envoy_body(body)),
+        (StreamedDigestExtProcService(), envoy_body_chunks(generate(1_000_000, 10_000))),
+    ):
+        E = AsEnvoyExtProc(request_headers=HEADERS, request_body=request_body)
+        async for response in P.Process(E, None):
+            phase = response.WhichOneof("response")
+            if phase in ("request_body", "response_headers"):
+                headers = envoy_set_headers_to_dict(getattr(response, phase).response)
+                if REQUEST_DIGEST_HEADER in headers:
+                    digests.append(headers[REQUEST_DIGEST_HEADER])
+        P.executors.shutdown()
+
+    expected = sha256(b"tenantpost/api/v0/resource" + body).hexdigest()
+    assert digests == [expected, expected]
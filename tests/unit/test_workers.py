@@ -0,0 +1,92 @@
+from multiprocessing import get_context
+import os
+from signal import SIGTERM
+from time import monotonic, sleep
+
+from envoy_extproc_sdk.health import HealthService
+from envoy_extproc_sdk.workers import Supervisor, WorkerReadiness
+from grpc_health_check.v1.health_pb2 import (
+    HealthCheckRequest,
+    HealthCheckResponse,
+)
+import pytest
+
+CONTEXT = get_context("fork")
+
+
+def test_worker_readiness() -> None:
+    readiness = WorkerReadiness(3)
+    assert len(readiness) == 3
+    assert not readiness.ready()
+    for index in range(3):
+        readiness.set(index)
+    assert readiness.ready()
+    readiness.set(1, False)
+    assert readiness.count() == 2
+    assert readiness.ready()  # (at least one is, by default)
+    readiness = WorkerReadiness(3, min_ready=3)
+    for index in range(3):
+        readiness.set(index)
+    readiness.set(1, False)
+    assert not readiness.ready()
+    with pytest.raises(ValueError):
+        WorkerReadiness(2, min_ready=3)
+
+
+@pytest.mark.asyncio
+async def test_health_reflects_readiness() -> None:
+    readiness = WorkerReadiness(2)
+    health = HealthService(readiness.ready)
+    status = HealthCheckResponse.ServingStatus
+    assert (await health.Check(HealthCheckRequest(), None)).status == status.NOT_SERVING
+    readiness.set(0)
+    readiness.set(1)
+    assert (await health.Check(HealthCheckRequest(), None)).status == status.SERVING
+    # one worker down (say, restarting) leaves the rest serving
+    readiness.set(0, False)
+    assert (await health.Check(HealthCheckRequest(), None)).status == status.SERVING
+    readiness.set(1, False)
+    assert (await health.Check(HealthCheckRequest(), None)).status == status.NOT_SERVING
+    assert (await HealthService().Check(HealthCheckRequest(), None)).status == status.SERVING
+
+
+def test_supervisor_needs_workers() -> None:
+    with pytest.raises(ValueError):
+        Supervisor(lambda i, r: None, 0)
+
+
+def crashing_worker(starts, index: int, readiness: WorkerReadiness) -> None:
+    with starts.get_lock():
+        starts[index] += 1
+        first = starts[index] == 1
+    if (index == 0) and first:
+        os._exit(1)  # crash the first start of the first worker
+    readiness.set(index)
+    while True:
+        sleep(0.05)
+
+
+def supervise(starts, readiness) -> None:
+    supervisor = Supervisor(
+        lambda index, _: crashing_worker(starts, index, readiness),
+        len(readiness),
+        grace_period=1,
+        restart_delay=0.1,
+    )
+    supervisor.run()
+
+
+def test_supervisor_restarts_and_stops_workers() -> None:
+    starts = CONTEXT.Array("i", 2)
+    readiness = WorkerReadiness(2, CONTEXT)
+    supervisor = CONTEXT.Process(target=supervise, args=(starts, readiness))
+    supervisor.start()
+    deadline = monotonic() + 10
+    while (readiness.count() < 2) and monotonic() < deadline:
+        sleep(0.05)
+    assert readiness.count() == 2
+    assert list(starts) == [2, 1]
+
+    os.kill(supervisor.pid, SIGTERM)
+    supervisor.join(10)
+    assert supervisor.exitcode == 0